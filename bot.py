@@ -1,24 +1,103 @@
 import asyncio
+import atexit
 import logging
+import logging.handlers
+import queue
+import sys
 from aiogram import Bot, Dispatcher
+from aiogram.fsm.storage.base import BaseStorage
 from aiogram.fsm.storage.memory import MemoryStorage
 from aiogram.client.default import DefaultBotProperties
 from aiogram.enums import ParseMode
+from aiogram.webhook.aiohttp_server import SimpleRequestHandler, setup_application
+from aiohttp import web
 
 from config import config
 from middlewares.auth import AuthMiddleware
-from handlers import (
-    start, avatar_video, seo_article, short_video, 
-    knowledge_base, content_plan, carousel, google_auth
-)
+from middlewares.rate_limit import RateLimitMiddleware
+from middlewares.throttling import ThrottlingMiddleware
+from handlers import ROUTERS
 from services.task_tracker import task_tracker
+from services.http_client import http_client
+from services.kie_callbacks import kie_callbacks
 
 logging.basicConfig(
     level=logging.INFO,
-    format="%(asctime)s - %(name)s - %(levelname)s - %(message)s"
+    format="%(asctime)s - %(name)s - %(levelname)s - %(message)s",
+    datefmt="%H:%M:%S"
 )
+# Не собираем в каждую запись то, что формат всё равно не выводит
+logging.logThreads = False
+logging.logProcesses = False
+logging.logMultiprocessing = False
+logging._srcfile = None
+# aiogram пишет INFO-строку на каждый апдейт
+logging.getLogger("aiogram.event").setLevel(logging.WARNING)
+
+def install_queue_logging():
+    """
+    Переносит запись логов в отдельный поток
+    
+    Корневой логгер только кладёт запись в очередь, а форматирование и вывод в stderr
+    выполняет QueueListener — всплеск ошибок не тормозит event loop на I/O.
+    """
+    root = logging.getLogger()
+    log_queue: queue.SimpleQueue = queue.SimpleQueue()
+    listener = logging.handlers.QueueListener(log_queue, *root.handlers, respect_handler_level=True)
+    root.handlers = [logging.handlers.QueueHandler(log_queue)]
+    listener.start()
+    # Дописываем хвост очереди при выходе
+    atexit.register(listener.stop)
+
+install_queue_logging()
 logger = logging.getLogger(__name__)
 
+def create_storage() -> BaseStorage:
+    """Redis-хранилище FSM с TTL, либо MemoryStorage если Redis не настроен"""
+    if not config.REDIS_URL:
+        return MemoryStorage()
+    
+    from redis.asyncio import Redis
+    from utils.redis_storage import PipelinedRedisStorage
+    
+    return PipelinedRedisStorage(
+        Redis.from_url(config.REDIS_URL, max_connections=config.REDIS_MAX_CONNECTIONS),
+        state_ttl=config.FSM_TTL,
+        data_ttl=config.FSM_TTL
+    )
+
+async def run_webhook(dp: Dispatcher, bot: Bot):
+    """Запуск бота в режиме webhook: Telegram сам присылает апдейты"""
+    path = f"/tg/{config.BOT_TOKEN}"
+    secret = config.WEBHOOK_SECRET or None
+    
+    app = web.Application()
+    SimpleRequestHandler(dispatcher=dp, bot=bot, secret_token=secret).register(app, path=path)
+    # Kie.ai сообщает о готовности изображений сюда же, чтобы не ждать очередного опроса
+    kie_callbacks.register(app)
+    setup_application(app, dp, bot=bot)
+    
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, host=config.WEBHOOK_HOST, port=config.WEBHOOK_PORT)
+    await site.start()
+    
+    _, me = await asyncio.gather(
+        bot.set_webhook(
+            url=f"{config.CALLBACK_BASE_URL}{path}",
+            secret_token=secret,
+            allowed_updates=dp.resolve_used_update_types(),
+            drop_pending_updates=True
+        ),
+        bot.get_me()
+    )
+    logger.info(f"Бот @{me.username} запущен (webhook) на порту {config.WEBHOOK_PORT}!")
+    
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await runner.cleanup()
+
 async def main():
     if not config.BOT_TOKEN:
         logger.error("TELEGRAM_BOT_TOKEN не установлен!")
@@ -40,34 +119,67 @@ async def main():
         default=DefaultBotProperties(parse_mode=ParseMode.HTML)
     )
     
+    # Исходящие сообщения выравниваются под лимиты Telegram, 429 повторяется после паузы
+    bot.session.middleware(RateLimitMiddleware())
+    
     task_tracker.set_bot(bot)
     
-    dp = Dispatcher(storage=MemoryStorage())
+    dp = Dispatcher(storage=create_storage())
     
-    # Подключаем middleware для проверки доступа
-    dp.message.middleware(AuthMiddleware())
-    dp.callback_query.middleware(AuthMiddleware())
+    # Middleware доступа нужен только в приватном режиме: в публичном он лишь пропускал бы всё подряд
+    if config.ALLOWED_USER_IDS:
+        auth = AuthMiddleware()
+        dp.message.middleware(auth)
+        dp.callback_query.middleware(auth)
+    
+    # Двойные нажатия кнопок не должны дважды запускать генерацию
+    dp.callback_query.middleware(ThrottlingMiddleware())
     
     # Регистрация роутеров
-    dp.include_router(start.router)
-    dp.include_router(avatar_video.router)
-    dp.include_router(seo_article.router)
-    dp.include_router(short_video.router)
-    dp.include_router(knowledge_base.router)
-    dp.include_router(content_plan.router)
-    dp.include_router(carousel.router)
-    dp.include_router(google_auth.router)  # Новый handler для OAuth
+    dp.include_routers(*ROUTERS)
     
-    await bot.delete_webhook(drop_pending_updates=True)
+    # Одна HTTP-сессия с пулом соединений живёт столько же, сколько диспетчер
+    dp.startup.register(http_client.start)
+    dp.shutdown.register(http_client.close)
     
-    task_tracker.start_polling()
+    # Генерации, запущенные до рестарта, продолжают отслеживаться
+    dp.startup.register(task_tracker.restore)
     
-    logger.info("Бот запущен!")
+    task_tracker.start_polling()
     
     try:
-        await dp.start_polling(bot)
+        if config.CALLBACK_BASE_URL:
+            await run_webhook(dp, bot)
+        else:
+            _, me = await asyncio.gather(
+                bot.delete_webhook(drop_pending_updates=True),
+                bot.get_me()
+            )
+            logger.info(f"Бот @{me.username} запущен (polling)!")
+            await dp.start_polling(
+                bot,
+                polling_timeout=25,
+                handle_as_tasks=True,
+                allowed_updates=dp.resolve_used_update_types()
+            )
     finally:
         task_tracker.stop_polling()
 
+def install_event_loop():
+    """Подключает io_uring-цикл (Linux) или uvloop, если они установлены"""
+    if sys.platform == "linux":
+        try:
+            import uringcore
+            asyncio.set_event_loop_policy(uringcore.EventLoopPolicy())
+            return
+        except ImportError:
+            pass
+    try:
+        import uvloop
+        uvloop.install()
+    except ImportError:
+        pass
+
 if __name__ == "__main__":
+    install_event_loop()
     asyncio.run(main())
\ No newline at end of file
@@ -1,18 +1,52 @@
 import os
-from dataclasses import dataclass
+import re
+import functools
+from dataclasses import dataclass, field
 from typing import Optional
 from dotenv import load_dotenv
 load_dotenv()
 
-@dataclass
+# Список разрешённых пользователей парсится один раз при импорте
+# (строго «-?цифры»: мусор вроде "--5" пропускается, а не роняет бота на старте)
+_ALLOWED_USER_IDS = frozenset(
+    int(uid.strip())
+    for uid in os.getenv("ALLOWED_USER_IDS", "").split(",")
+    if re.fullmatch(r"-?\d+", uid.strip())
+)
+
+@dataclass(frozen=True, slots=True)
 class Config:
     # Telegram
     BOT_TOKEN: str = os.getenv("TELEGRAM_BOT_TOKEN", "")
-    ALLOWED_USER_IDS: list[int] = None  # Будет инициализирован в __post_init__
+    ALLOWED_USER_IDS: frozenset[int] = field(default_factory=lambda: _ALLOWED_USER_IDS)
+    
+    # Webhook (если CALLBACK_BASE_URL не задан — бот работает через polling)
+    CALLBACK_BASE_URL: str = os.getenv("CALLBACK_BASE_URL", "").rstrip("/")
+    WEBHOOK_SECRET: str = os.getenv("WEBHOOK_SECRET", "")
+    WEBHOOK_HOST: str = os.getenv("WEBHOOK_HOST", "0.0.0.0")
+    WEBHOOK_PORT: int = int(os.getenv("PORT", "8080"))
+    
+    # Redis для FSM (если не задан — состояния хранятся в памяти)
+    REDIS_URL: str = os.getenv("REDIS_URL", "")
+    FSM_TTL: int = int(os.getenv("FSM_TTL", "3600"))
+    REDIS_MAX_CONNECTIONS: int = int(os.getenv("REDIS_MAX_CONNECTIONS", "50"))
     
     # OpenAI
     OPENAI_API_KEY: str = os.getenv("OPENAI_API_KEY", "")
     OPENAI_MODEL: str = os.getenv("OPENAI_MODEL", "gpt-4o")
+    OPENAI_EMBEDDING_MODEL: str = os.getenv("OPENAI_EMBEDDING_MODEL", "text-embedding-3-small")
+    # Опционально: порог косинусной близости тем, при котором сценарий берётся из кэша
+    # похожей темы (например, 0.92). По умолчанию 0 — выключено: каждый промах кэша иначе
+    # платит лишний запрос эмбеддинга, а близкая, но другая тема получает чужой сценарий
+    SCRIPT_SIMILARITY_THRESHOLD: float = float(os.getenv("SCRIPT_SIMILARITY_THRESHOLD", "0"))
+    
+    # Транскрибация для субтитров: "openai" (Whisper API) или "faster" (локально через faster-whisper)
+    WHISPER_BACKEND: str = os.getenv("WHISPER_BACKEND", "openai").lower()
+    WHISPER_MODEL_SIZE: str = os.getenv("WHISPER_MODEL_SIZE", "small")
+    WHISPER_COMPUTE_TYPE: str = os.getenv("WHISPER_COMPUTE_TYPE", "int8")
+    # Всегда транскрибировать видео; по умолчанию видео, совпадающее по длительности
+    # со сценарием, получает субтитры из текста сценария без Whisper
+    USE_WHISPER_TRANSCRIPTION: bool = os.getenv("USE_WHISPER_TRANSCRIPTION", "").lower() in ("1", "true", "yes")
     
     # Kie.ai (Sora2, Veo3, Kling, Nano Banana)
     KIEAI_API_KEY: str = os.getenv("KIEAI_API_KEY", "")
@@ -28,41 +62,36 @@ class Config:
     KNOWLEDGE_BASE_DIR: str = os.getenv("KNOWLEDGE_BASE_DIR", "knowledge_base")
     COMPETITORS_DIR: str = os.getenv("COMPETITORS_DIR", "knowledge_base/competitors")
     
-    def __post_init__(self):
-        """Парсинг списка разрешённых пользователей"""
-        allowed_ids_str = os.getenv("ALLOWED_USER_IDS", "")
-        if allowed_ids_str:
-            try:
-                self.ALLOWED_USER_IDS = [
-                    int(uid.strip()) 
-                    for uid in allowed_ids_str.split(",") 
-                    if uid.strip().isdigit()
-                ]
-            except ValueError:
-                self.ALLOWED_USER_IDS = []
-        else:
-            self.ALLOWED_USER_IDS = []
+    # Сколько файлов пользователей одновременно перекачивается из Telegram на хостинг
+    UPLOAD_CONCURRENCY: int = int(os.getenv("UPLOAD_CONCURRENCY", "8"))
+    # Сколько процессов FFmpeg работает одновременно (по умолчанию — половина ядер)
+    FFMPEG_CONCURRENCY: int = int(os.getenv("FFMPEG_CONCURRENCY", str(max(1, (os.cpu_count() or 2) // 2))))
     
     def is_user_allowed(self, user_id: int) -> bool:
         """Проверяет, разрешён ли доступ пользователю"""
-        if not self.ALLOWED_USER_IDS:
-            return True  # Если список пуст, доступ для всех
-        return user_id in self.ALLOWED_USER_IDS
+        # Если список пуст, доступ для всех
+        return not self.ALLOWED_USER_IDS or user_id in self.ALLOWED_USER_IDS
+    
+    @functools.cache
+    def _env_keys(self) -> tuple[tuple[str, bool], ...]:
+        """Ключи из окружения: конфиг неизменяем, поэтому проверяются один раз"""
+        return (
+            ("telegram", bool(self.BOT_TOKEN)),
+            ("openai", bool(self.OPENAI_API_KEY)),
+            ("kieai", bool(self.KIEAI_API_KEY)),
+        )
     
     def validate(self) -> dict[str, bool]:
         """Проверка наличия API ключей"""
+        # Файл credentials может появиться или пропасть на ходу — его наличие проверяется каждый раз
         return {
-            "telegram": bool(self.BOT_TOKEN),
-            "openai": bool(self.OPENAI_API_KEY),
-            "kieai": bool(self.KIEAI_API_KEY),
+            **dict(self._env_keys()),
             "google": bool(self.GOOGLE_CREDENTIALS_FILE and os.path.exists(self.GOOGLE_CREDENTIALS_FILE)),
         }
     
-    def get_missing_keys(self) -> list[str]:
+    def get_missing_keys(self) -> tuple[str, ...]:
         """Возвращает список отсутствующих ключей"""
         validation = self.validate()
-        return [k for k, v in validation.items() if not v]
+        return tuple(k for k, v in validation.items() if not v)
 
-config = Config()
-# Вызываем __post_init__ для инициализации ALLOWED_USER_IDS
-config.__post_init__()
\ No newline at end of file
+config = Config()
\ No newline at end of file
@@ -7,6 +7,18 @@ from . import content_plan
 from . import carousel
 from . import google_auth
 
+# Роутеры в порядке регистрации в диспетчере
+ROUTERS = (
+    start.router,
+    avatar_video.router,
+    seo_article.router,
+    short_video.router,
+    knowledge_base.router,
+    content_plan.router,
+    carousel.router,
+    google_auth.router,
+)
+
 __all__ = [
     "start", 
     "avatar_video", 
@@ -15,5 +27,6 @@ __all__ = [
     "knowledge_base",
     "content_plan",
     "carousel",
-    "google_auth"
+    "google_auth",
+    "ROUTERS"
 ]
\ No newline at end of file
@@ -1,35 +1,131 @@
 import asyncio
+import functools
+import html
+import itertools
 import logging
 import os
-from datetime import datetime
+import random
+from typing import Optional
 from aiogram import Router, F, Bot
 from aiogram.types import Message, CallbackQuery
 from aiogram.fsm.context import FSMContext
+from aiogram.filters import StateFilter
+from aiogram.filters.callback_data import CallbackData
 from aiogram.utils.keyboard import InlineKeyboardBuilder
-from aiogram.types import InlineKeyboardButton
+from aiogram.types import InlineKeyboardButton, InlineKeyboardMarkup
+from aiogram.fsm.state import State
 
 from states.generation_states import AvatarVideoStates
 from keyboards.menus import cancel_kb, confirm_edit_kb, back_to_menu_kb, cancel_and_back_kb
 from services.openai_service import openai_service
 from services.kling_motion_service import kling_motion_service
 from services.kieai_service import kieai_service
+from services.kie_callbacks import kie_callbacks
 from services.task_tracker import task_tracker, VideoTask
 from services.file_upload_service import file_upload_service
 from services.subtitles_service import subtitles_service
+from utils.fsm import transition
+from utils.limits import OPENAI_SEMAPHORE, KIEAI_SEMAPHORE
+from utils.tasks import spawn
+from utils.chat_queue import chat_queues
+from utils.telegram import fire_ack, safe_edit
+
+# orjson быстрее разбирает resultJson; без него — стандартный json
+try:
+    from orjson import loads as json_loads
+except ImportError:
+    from json import loads as json_loads
 
 logger = logging.getLogger(__name__)
 router = Router()
 
-VIDEO_EXTENSIONS = {'.mp4', '.mov', '.mkv'}
-IMAGE_EXTENSIONS = {'.jpg', '.jpeg', '.png', '.webp'}
+def _stage_router(name: str, *states: State) -> Router:
+    """
+    Подроутер этапа флоу: фильтр состояния стоит на уровне роутера, поэтому
+    апдейт из другого этапа отсекается одной проверкой, а не перебором всех хендлеров
+    """
+    stage = Router(name=name)
+    stage.message.filter(StateFilter(*states))
+    stage.callback_query.filter(StateFilter(*states))
+    router.include_router(stage)
+    return stage
+
+script_router = _stage_router(
+    "avatar_script",
+    AvatarVideoStates.waiting_topic,
+    AvatarVideoStates.waiting_script_confirm,
+    AvatarVideoStates.waiting_script_edit
+)
+video_router = _stage_router("avatar_video_upload", AvatarVideoStates.waiting_video)
+avatar_router = _stage_router(
+    "avatar_image",
+    AvatarVideoStates.selecting_avatar_source,
+    AvatarVideoStates.waiting_avatar_description,
+    AvatarVideoStates.waiting_source_image,
+    AvatarVideoStates.waiting_edit_description,
+    AvatarVideoStates.waiting_avatar_image,
+    AvatarVideoStates.confirming_avatar
+)
+settings_router = _stage_router(
+    "avatar_settings",
+    AvatarVideoStates.selecting_subtitles,
+    AvatarVideoStates.selecting_quality,
+    AvatarVideoStates.selecting_orientation
+)
+
+# Кортежи, а не множества: проверка идёт одним str.endswith
+VIDEO_EXTENSIONS = ('.mp4', '.mov', '.mkv')
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.webp')
+UNSUPPORTED_FORMAT_TEXT = "⚠️ Формат {} не поддерживается."
+
+# Неизменные части промптов Nano Banana: к ним добавляется только описание пользователя
+AVATAR_PROMPT_SUFFIX = ", professional portrait photo, high quality, realistic face, studio lighting, 9:16 vertical format"
+EDIT_PROMPT_PREFIX = "CRITICAL: Preserve the face and facial features EXACTLY as shown in the original image - DO NOT modify face, skin tone, eyes, nose, mouth, or any facial characteristics. ONLY change: "
+EDIT_PROMPT_SUFFIX = ". Professional portrait photo, 9:16 vertical format, high quality, photorealistic"
+
+# Порядковый номер загрузки в процессе: имена временных файлов не совпадают даже в одну наносекунду
+_upload_seq = itertools.count()
+# PID отличает имена из разных воркеров, у которых счётчики идут с нуля независимо
+_PID = os.getpid()
+
+def allowed_suffix(filename: str, allowed: tuple[str, ...]) -> Optional[str]:
+    """Расширение файла в нижнем регистре, если оно из allowed, иначе None"""
+    lower = filename.lower()
+    if not lower.endswith(allowed):
+        return None
+    return lower[lower.rfind("."):]
+
+def upload_filename(prefix: str, user_id: int, suffix: str) -> str:
+    """Уникальное имя загружаемого файла: <prefix>_<user_id>_<pid>_<номер><suffix>"""
+    return f"{prefix}_{user_id}_{_PID}_{next(_upload_seq)}{suffix}"
+
+# Интервалы запасного опроса статуса изображения (секунды)
+POLL_MIN_DELAY = 0.5
+POLL_MAX_DELAY = 8.0
+# Случайная добавка к интервалу (доля от него): одновременные генерации не опрашивают API залпом
+POLL_JITTER = 0.25
+
+@functools.cache
+def _unavailable_text() -> Optional[str]:
+    """Почему флоу недоступен (нет ключа Kie.ai или OpenAI); ключи читаются при старте, так что проверяем один раз"""
+    if not kling_motion_service.is_available():
+        return "⚠️ Kie.ai API не настроен.\nДобавьте KIEAI_API_KEY."
+    if not openai_service.is_available():
+        return "⚠️ OpenAI API не настроен.\nДобавьте OPENAI_API_KEY."
+    return None
+
+class AvatarCB(CallbackData, prefix="avatar"):
+    """Параметрические кнопки настроек: avatar:<action>:<value>"""
+    action: str
+    value: str
 
 # ============ КЛАВИАТУРЫ ============
 
 def avatar_source_kb():
     builder = InlineKeyboardBuilder()
-    builder.row(InlineKeyboardButton(text="📤 Загрузить своё фото", callback_data="avatar:source:upload"))
-    builder.row(InlineKeyboardButton(text="🎨 Сгенерировать по промпту", callback_data="avatar:source:generate"))
-    builder.row(InlineKeyboardButton(text="🖼 Сгенерировать из фото", callback_data="avatar:source:edit"))
+    builder.row(InlineKeyboardButton(text="📤 Загрузить своё фото", callback_data=AvatarCB(action="source", value="upload").pack()))
+    builder.row(InlineKeyboardButton(text="🎨 Сгенерировать по промпту", callback_data=AvatarCB(action="source", value="generate").pack()))
+    builder.row(InlineKeyboardButton(text="🖼 Сгенерировать из фото", callback_data=AvatarCB(action="source", value="edit").pack()))
     builder.row(InlineKeyboardButton(text="❌ Отмена", callback_data="cancel"))
     return builder.as_markup()
 
@@ -37,22 +133,22 @@ def confirm_avatar_kb():
     builder = InlineKeyboardBuilder()
     builder.row(InlineKeyboardButton(text="✅ Использовать", callback_data="avatar:confirm_image"))
     builder.row(InlineKeyboardButton(text="🔄 Сгенерировать другой", callback_data="avatar:regenerate_image"))
-    builder.row(InlineKeyboardButton(text="📤 Загрузить своё фото", callback_data="avatar:source:upload"))
+    builder.row(InlineKeyboardButton(text="📤 Загрузить своё фото", callback_data=AvatarCB(action="source", value="upload").pack()))
     builder.row(InlineKeyboardButton(text="❌ Отмена", callback_data="cancel"))
     return builder.as_markup()
 
 def subtitles_confirm_kb():
     builder = InlineKeyboardBuilder()
-    builder.row(InlineKeyboardButton(text="✅ Да, добавить субтитры", callback_data="avatar:sub:yes"))
-    builder.row(InlineKeyboardButton(text="❌ Без субтитров", callback_data="avatar:sub:no"))
+    builder.row(InlineKeyboardButton(text="✅ Да, добавить субтитры", callback_data=AvatarCB(action="sub", value="yes").pack()))
+    builder.row(InlineKeyboardButton(text="❌ Без субтитров", callback_data=AvatarCB(action="sub", value="no").pack()))
     builder.row(InlineKeyboardButton(text="⬅️ Назад", callback_data="avatar:back_avatar"))
     return builder.as_markup()
 
 def video_quality_kb():
     builder = InlineKeyboardBuilder()
     builder.row(
-        InlineKeyboardButton(text="📺 720p", callback_data="avatar:quality:720p"),
-        InlineKeyboardButton(text="🎬 1080p", callback_data="avatar:quality:1080p")
+        InlineKeyboardButton(text="📺 720p", callback_data=AvatarCB(action="quality", value="720p").pack()),
+        InlineKeyboardButton(text="🎬 1080p", callback_data=AvatarCB(action="quality", value="1080p").pack())
     )
     builder.row(InlineKeyboardButton(text="⬅️ Назад", callback_data="avatar:back_subs"))
     builder.row(InlineKeyboardButton(text="❌ Отмена", callback_data="cancel"))
@@ -60,117 +156,376 @@ def video_quality_kb():
 
 def orientation_kb():
     builder = InlineKeyboardBuilder()
-    builder.row(InlineKeyboardButton(text="🖼 Как на фото (макс 10с)", callback_data="avatar:orient:image"))
-    builder.row(InlineKeyboardButton(text="🎬 Как в видео (макс 30с)", callback_data="avatar:orient:video"))
+    builder.row(InlineKeyboardButton(text="🖼 Как на фото (макс 10с)", callback_data=AvatarCB(action="orient", value="image").pack()))
+    builder.row(InlineKeyboardButton(text="🎬 Как в видео (макс 30с)", callback_data=AvatarCB(action="orient", value="video").pack()))
     builder.row(InlineKeyboardButton(text="⬅️ Назад", callback_data="avatar:back_quality"))
     builder.row(InlineKeyboardButton(text="❌ Отмена", callback_data="cancel"))
     return builder.as_markup()
 
+# Клавиатуры статичны — собираем один раз при импорте и переиспользуем во всех отправках
+AVATAR_SOURCE_KB = avatar_source_kb()
+CONFIRM_AVATAR_KB = confirm_avatar_kb()
+SUBTITLES_CONFIRM_KB = subtitles_confirm_kb()
+VIDEO_QUALITY_KB = video_quality_kb()
+ORIENTATION_KB = orientation_kb()
+
+# ============ ТЕКСТЫ ============
+
+START_TEXT = (
+    "🎭 <b>Создание видео с AI-аватаром</b>\n\n"
+    "Процесс:\n"
+    "1️⃣ Получите сценарий\n"
+    "2️⃣ Запишите видео (3-30 сек)\n"
+    "3️⃣ Загрузите или создайте аватар\n"
+    "4️⃣ Получите готовое видео + субтитры\n\n"
+    "📝 Введите тему для сценария:"
+)
+
+SEND_VIDEO_TEXT = (
+    "✅ <b>Сценарий подтверждён!</b>\n\n"
+    "🎬 <b>Отправьте видео:</b>\n"
+    "• Длительность: 3-30 сек\n"
+    "• Форматы: MP4, MOV, MKV\n"
+    "• Размер: до 100 МБ"
+)
+
+UPLOAD_AVATAR_TEXT = (
+    "📤 <b>Загрузите фото аватара</b>\n\n"
+    "Форматы: JPEG, PNG, WEBP\nРазмер: до 10 МБ\n\n📷 Отправьте фото:"
+)
+
+GENERATE_AVATAR_TEXT = (
+    "🎨 <b>Генерация аватара по промпту</b>\n\n"
+    "💡 Примеры:\n"
+    "• <i>Мужчина 30 лет, тёмные волосы, деловой портрет</i>\n"
+    "• <i>Женщина со светлыми волосами, улыбка</i>\n\n"
+    "✏️ Введите описание аватара:"
+)
+
+EDIT_AVATAR_TEXT = (
+    "🖼 <b>Генерация аватара из фото</b>\n\n"
+    "Отправьте фото, которое нужно использовать как основу.\n"
+    "Лицо будет сохранено 1 в 1.\n\n"
+    "📷 Отправьте фото:"
+)
+
+SUBTITLES_QUESTION_TEXT = (
+    "🎬 <b>Добавить субтитры?</b>\n\n"
+    "Субтитры по тексту ролика будут наложены на видео."
+)
+
+ORIENTATION_TEXT = (
+    "🔄 <b>Ориентация персонажа:</b>\n\n"
+    "🖼 <b>Как на фото</b> (макс. 10 сек)\n"
+    "🎬 <b>Как в видео</b> (макс. 30 сек)"
+)
+
+CHOOSE_SOURCE_TEXT = "Выберите способ создания аватара:"
+
+QUALITY_TEXT = "📺 <b>Выберите качество:</b>"
+
+SOURCE_UPLOADED_TEXT = (
+    "✅ <b>Фото загружено!</b>\n\n"
+    "Теперь опишите, что нужно изменить (фон, стиль, одежда и т.д.).\n"
+    "Лицо останется прежним.\n\n"
+    "💡 Примеры:\n"
+    "• <i>студийный фон, деловой костюм</i>\n"
+    "• <i>уличный фон, casual одежда</i>\n\n"
+    "✏️ Введите описание изменений:"
+)
+
+AVATAR_UPLOADED_TEXT = "✅ <b>Фото загружено!</b>\n\nИспользовать как аватар?"
+
 # ============ ВСПОМОГАТЕЛЬНЫЕ ФУНКЦИИ ============
 
-async def wait_for_image_result(task_id: str, timeout: int = 180) -> str:
-    """Ожидание результата генерации изображения"""
-    import json
-    elapsed = 0
+def result_url(data: dict) -> Optional[str]:
+    """URL изображения из data ответа Kie.ai (resultJson.resultUrls, либо imageUrl/url)"""
+    result_json = data.get("resultJson") or {}
+    if isinstance(result_json, str):
+        try:
+            result_json = json_loads(result_json)
+        except ValueError:
+            # JSONDecodeError и orjson, и json — подкласс ValueError
+            result_json = {}
     
-    while elapsed < timeout:
-        result = await kieai_service.get_task_status(task_id)
-        
-        if result.get("code") != 200:
-            await asyncio.sleep(5)
-            elapsed += 5
-            continue
+    urls = result_json.get("resultUrls") or data.get("resultUrls")
+    if urls:
+        return urls[0]
+    return data.get("imageUrl") or data.get("url")
+
+def parse_image_result(result: dict) -> tuple[bool, Optional[str]]:
+    """Разбирает статус задачи изображения: (задача завершена, URL результата)"""
+    if result.get("code") != 200:
+        return False, None
+    
+    data = result.get("data", {})
+    st = data.get("state", "").lower()
+    
+    if st in ("success", "completed", "done"):
+        return True, result_url(data)
+    
+    if st in ("failed", "error"):
+        return True, None
+    
+    return False, None
+
+# Идущие ожидания изображений: task_id -> общий опрос для всех ожидающих
+_image_waits: dict[str, asyncio.Future] = {}
+
+async def wait_for_image_result(task_id: str, timeout: int = 180) -> Optional[str]:
+    """
+    Ожидание результата генерации изображения
+    
+    Повторное ожидание той же задачи (повторное нажатие, перезапуск доставки)
+    не запускает второй опрос, а ждёт результата уже идущего.
+    """
+    waiting = _image_waits.get(task_id)
+    if waiting is None:
+        waiting = asyncio.ensure_future(_poll_image_result(task_id, timeout))
+        _image_waits[task_id] = waiting
+        waiting.add_done_callback(lambda _: _image_waits.pop(task_id, None))
+    # shield: отмена одного ожидающего не отменяет опрос для остальных
+    return await asyncio.shield(waiting)
+
+async def _poll_image_result(task_id: str, timeout: int) -> Optional[str]:
+    """
+    Опрос статуса изображения
+    
+    В режиме webhook колбэк Kie.ai будит ожидание сразу, но результат всегда
+    берётся из get_task_status — тело колбэка ему не доверяется. Без колбэка
+    интервал опроса растёт от 0.5 до 8 секунд со случайной добавкой до POLL_JITTER.
+    """
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + timeout
+    delay = POLL_MIN_DELAY
+    
+    kie_callbacks.watch(task_id)
+    try:
+        while True:
+            result = await kieai_service.get_task_status(task_id)
+            done, url = parse_image_result(result)
+            if done:
+                return url
+            
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                return None
+            jittered = delay * (1 + random.uniform(0, POLL_JITTER))
+            await kie_callbacks.wait(task_id, min(jittered, remaining))
+            delay = min(POLL_MAX_DELAY, delay * 1.5)
+    finally:
+        kie_callbacks.forget(task_id)
+
+async def flow_is_current(state: FSMContext, expected: State, **tags) -> bool:
+    """
+    Фоновая работа всё ещё относится к текущему флоу пользователя
+    
+    Пока она шла, пользователь мог отменить флоу или начать новый: тогда состояние
+    или метка запуска в данных (tags) уже другие, и трогать FSM нельзя.
+    """
+    current_state, current_data = await asyncio.gather(state.get_state(), state.get_data())
+    return current_state == expected.state and all(current_data.get(k) == v for k, v in tags.items())
+
+def start_avatar_delivery(message: Message, state: FSMContext, task_id: str):
+    """Запускает доставку сгенерированного аватара в фоне — хендлер освобождается сразу"""
+    spawn(deliver_generated_avatar(message, state, task_id), name=f"avatar-delivery-{task_id}")
+
+async def hand_off_avatar(message: Message, state: FSMContext, data: dict):
+    """
+    Передаёт созданную задачу Nano Banana на доставку
+    
+    Если Kie.ai вернул картинку сразу в ответе на создание задачи, она отправляется без опроса.
+    """
+    task_id = data.get("taskId")
+    ready_url = result_url(data)
+    if not task_id and not ready_url:
+        raise Exception("Не получен taskId")
+    
+    # task_id в данных привязывает фоновую доставку к этой генерации: результат старой
+    # задачи после отмены и нового запуска флоу не попадёт в новый
+    await transition(state, AvatarVideoStates.generating_avatar, pending_avatar_task=task_id)
+    if ready_url:
+        await deliver_generated_avatar(message, state, task_id, ready_url)
+        return
+    
+    await message.answer("⏳ Аватар генерируется, пришлю его, как только будет готов.")
+    start_avatar_delivery(message, state, task_id)
+
+async def deliver_generated_avatar(message: Message, state: FSMContext, task_id: str, ready_url: Optional[str] = None):
+    """Ждёт результат генерации и присылает аватар с кнопками подтверждения"""
+    try:
+        avatar_url = ready_url or await wait_for_image_result(task_id)
         
-        data = result.get("data", {})
-        st = data.get("state", "").lower()
+        # Пользователь мог отменить флоу (или запустить новую генерацию), пока шла эта
+        if not await flow_is_current(state, AvatarVideoStates.generating_avatar, pending_avatar_task=task_id):
+            return
         
-        if st in ("success", "completed", "done"):
-            result_json = data.get("resultJson", {})
-            if isinstance(result_json, str):
-                try:
-                    result_json = json.loads(result_json)
-                except:
-                    result_json = {}
-            
-            urls = result_json.get("resultUrls", [])
-            if urls:
-                return urls[0]
-            return data.get("imageUrl") or data.get("url")
+        if not avatar_url:
+            raise Exception("Не удалось получить изображение")
         
-        elif st in ("failed", "error"):
-            return None
+        await transition(state, AvatarVideoStates.confirming_avatar, avatar_image_url=avatar_url)
         
-        await asyncio.sleep(5)
-        elapsed += 5
+        # Telegram скачивает картинку по URL сам и отвечает только после загрузки —
+        # FSM уже готов к подтверждению, поэтому отправку не ждём
+        spawn(send_avatar_preview(message, state, avatar_url), name=f"avatar-photo-{task_id}")
+    except Exception as e:
+        logger.error("Avatar delivery error (%s): %s", task_id, e)
+        # Ошибка старой генерации не должна перебивать флоу, начатый после отмены
+        if not await flow_is_current(state, AvatarVideoStates.generating_avatar, pending_avatar_task=task_id):
+            return
+        await message.answer(f"❌ Ошибка: {e}", reply_markup=AVATAR_SOURCE_KB)
+        await state.set_state(AvatarVideoStates.selecting_avatar_source)
+
+async def send_avatar_preview(message: Message, state: FSMContext, avatar_url: str):
+    """
+    Присылает готовый аватар с кнопками подтверждения
     
-    return None
+    Если Telegram не смог скачать картинку по URL, вместо фото уходит ссылка с теми же
+    кнопками; если не ушло и это — флоу, если он всё ещё ждёт подтверждения этого аватара,
+    возвращается к выбору источника.
+    """
+    try:
+        await message.answer_photo(
+            photo=avatar_url,
+            caption="✅ <b>Аватар готов!</b>\n\nИспользовать?",
+            parse_mode="HTML",
+            reply_markup=CONFIRM_AVATAR_KB
+        )
+        return
+    except Exception as e:
+        logger.warning("Avatar photo send failed, falling back to link: %s", e)
+    
+    try:
+        await message.answer(
+            f"✅ <b>Аватар готов!</b>\n\n"
+            f"Превью не загрузилось — <a href=\"{html.escape(avatar_url)}\">открыть изображение</a>\n\n"
+            "Использовать?",
+            parse_mode="HTML",
+            reply_markup=CONFIRM_AVATAR_KB
+        )
+    except Exception as e:
+        logger.error("Avatar preview delivery failed: %s", e)
+        # Пока шли обе попытки, пользователь мог подтвердить, отменить или перезапустить флоу
+        if not await flow_is_current(state, AvatarVideoStates.confirming_avatar, avatar_image_url=avatar_url):
+            return
+        await state.set_state(AvatarVideoStates.selecting_avatar_source)
+        await message.answer("❌ Не удалось отправить аватар. Попробуйте ещё раз.", reply_markup=AVATAR_SOURCE_KB)
 
-# ============ НАЧАЛО ФЛОУ ============
+async def settle_status(status_task: asyncio.Task) -> Optional[Message]:
+    """
+    Дожидается фоновой отправки статуса; её сбой логируется, но не прерывает основную работу
+    
+    Исключение задачи всегда забирается, так что asyncio не пишет "Task exception was never retrieved".
+    """
+    try:
+        return await status_task
+    except Exception as e:
+        logger.warning("Status message failed: %s", e)
+        return None
 
-@router.callback_query(F.data == "menu:avatar")
-async def start_avatar_flow(callback: CallbackQuery, state: FSMContext):
-    if not kling_motion_service.is_available():
-        await callback.message.edit_text(
-            "⚠️ Kie.ai API не настроен.\nДобавьте KIEAI_API_KEY.",
-            reply_markup=back_to_menu_kb()
+async def handle_upload(
+    message: Message,
+    state: FSMContext,
+    bot: Bot,
+    *,
+    file_id: str,
+    file_unique_id: str,
+    filename: str,
+    progress_text: str,
+    next_state: State,
+    url_key: str,
+    ok_text: str,
+    reply_markup: InlineKeyboardMarkup,
+    error_label: str,
+    extra_data: Optional[dict] = None,
+    as_photo: bool = False
+):
+    """
+    Общий путь загрузки файла пользователя: статус, выгрузка по публичной ссылке,
+    переход FSM с URL в данных и ответ (текстом или самим фото)
+    """
+    # Статус уходит параллельно со скачиванием файла из Telegram
+    status_task = asyncio.create_task(message.answer(progress_text))
+    
+    try:
+        url = await file_upload_service.upload_telegram_file(
+            bot=bot, file_id=file_id, filename=filename, unique_id=file_unique_id
         )
-        await callback.answer()
+    except Exception as e:
+        await settle_status(status_task)
+        logger.error("%s: %s", error_label, e)
+        await message.answer(f"❌ Ошибка: {e}", reply_markup=cancel_and_back_kb("menu:main"))
         return
     
-    if not openai_service.is_available():
-        await callback.message.edit_text(
-            "⚠️ OpenAI API не настроен.\nДобавьте OPENAI_API_KEY.",
-            reply_markup=back_to_menu_kb()
-        )
-        await callback.answer()
+    # Статус лишь сопровождает загрузку: его сбой не отменяет переход
+    await settle_status(status_task)
+    
+    try:
+        await transition(state, next_state, **{url_key: url}, **(extra_data or {}))
+        
+        if as_photo:
+            await message.answer_photo(photo=url, caption=ok_text, parse_mode="HTML", reply_markup=reply_markup)
+        else:
+            await message.answer(ok_text, parse_mode="HTML", reply_markup=reply_markup)
+    except Exception as e:
+        logger.error("%s: %s", error_label, e)
+        await message.answer(f"❌ Ошибка: {e}", reply_markup=cancel_and_back_kb("menu:main"))
+
+# ============ НАЧАЛО ФЛОУ ============
+
+@router.callback_query(F.data == "menu:avatar")
+async def start_avatar_flow(callback: CallbackQuery, state: FSMContext):
+    unavailable = _unavailable_text()
+    if unavailable:
+        await callback.message.edit_text(unavailable, reply_markup=back_to_menu_kb())
+        fire_ack(callback)
         return
     
     await state.set_state(AvatarVideoStates.waiting_topic)
     await callback.message.edit_text(
-        "🎭 <b>Создание видео с AI-аватаром</b>\n\n"
-        "Процесс:\n"
-        "1️⃣ Получите сценарий\n"
-        "2️⃣ Запишите видео (3-30 сек)\n"
-        "3️⃣ Загрузите или создайте аватар\n"
-        "4️⃣ Получите готовое видео + субтитры\n\n"
-        "📝 Введите тему для сценария:",
+        START_TEXT,
         parse_mode="HTML",
         reply_markup=cancel_kb()
     )
-    await callback.answer()
+    fire_ack(callback)
 
 # ============ СЦЕНАРИЙ ============
 
-@router.message(AvatarVideoStates.waiting_topic)
+@script_router.message(AvatarVideoStates.waiting_topic)
 async def process_topic(message: Message, state: FSMContext):
     topic = message.text.strip()
-    await message.answer("⏳ Генерирую сценарий...")
+    # Статус отправляется параллельно с запросом к OpenAI — RTT до Telegram прячется под генерацией
+    status_task = asyncio.create_task(message.answer("⏳ Генерирую сценарий..."))
     
     try:
         # ИСПРАВЛЕНИЕ 1: Сценарий на 25 секунд вместо дефолтного
-        script = await openai_service.generate_avatar_script(topic, duration_seconds=25)
-        await state.update_data(topic=topic, script=script)
-        await state.set_state(AvatarVideoStates.waiting_script_confirm)
-        
-        await message.answer(
-            f"📝 <b>Сценарий готов:</b>\n\n{script}\n\nВыберите действие:",
-            parse_mode="HTML",
-            reply_markup=confirm_edit_kb()
-        )
+        async with OPENAI_SEMAPHORE:
+            script = await openai_service.generate_avatar_script(topic, duration_seconds=25)
     except Exception as e:
+        await settle_status(status_task)
         await message.answer(f"❌ Ошибка: {e}", reply_markup=back_to_menu_kb())
+        return
+    
+    # Сценарий уже сгенерирован: сбой статуса не должен его выбросить
+    await settle_status(status_task)
+    await transition(state, AvatarVideoStates.waiting_script_confirm, topic=topic, script=script)
+    
+    await message.answer(
+        f"📝 <b>Сценарий готов:</b>\n\n{script}\n\nВыберите действие:",
+        parse_mode="HTML",
+        reply_markup=confirm_edit_kb()
+    )
 
-@router.callback_query(AvatarVideoStates.waiting_script_confirm, F.data == "edit")
+@script_router.callback_query(AvatarVideoStates.waiting_script_confirm, F.data == "edit")
 async def edit_script(callback: CallbackQuery, state: FSMContext):
     await state.set_state(AvatarVideoStates.waiting_script_edit)
-    await callback.message.edit_text("✏️ Введите отредактированный сценарий:", reply_markup=cancel_and_back_kb("menu:main"))
-    await callback.answer()
+    await safe_edit(callback.message, "✏️ Введите отредактированный сценарий:", reply_markup=cancel_and_back_kb("menu:main"))
+    fire_ack(callback)
 
-@router.message(AvatarVideoStates.waiting_script_edit)
+@script_router.message(AvatarVideoStates.waiting_script_edit)
 async def process_edited_script(message: Message, state: FSMContext):
     script = message.text.strip()
-    await state.update_data(script=script)
-    await state.set_state(AvatarVideoStates.waiting_script_confirm)
+    await transition(state, AvatarVideoStates.waiting_script_confirm, script=script)
     
     await message.answer(
         f"📝 <b>Обновлённый сценарий:</b>\n\n{script}\n\nВыберите действие:",
@@ -178,44 +533,45 @@ async def process_edited_script(message: Message, state: FSMContext):
         reply_markup=confirm_edit_kb()
     )
 
-@router.callback_query(AvatarVideoStates.waiting_script_confirm, F.data == "regenerate")
+@script_router.callback_query(AvatarVideoStates.waiting_script_confirm, F.data == "regenerate")
 async def regenerate_script(callback: CallbackQuery, state: FSMContext):
-    data = await state.get_data()
-    topic = data.get("topic", "")
+    fire_ack(callback)
+    topic = (await state.get_data()).get("topic", "")
     
-    await callback.message.edit_text("⏳ Генерирую новый сценарий...")
+    status_task = asyncio.create_task(callback.message.edit_text("⏳ Генерирую новый сценарий..."))
     
     try:
-        script = await openai_service.generate_avatar_script(topic, duration_seconds=25)
-        await state.update_data(script=script)
-        
-        await callback.message.edit_text(
-            f"📝 <b>Новый сценарий:</b>\n\n{script}\n\nВыберите действие:",
-            parse_mode="HTML",
-            reply_markup=confirm_edit_kb()
-        )
+        async with OPENAI_SEMAPHORE:
+            script = await openai_service.generate_avatar_script(topic, duration_seconds=25, fresh=True)
     except Exception as e:
+        await settle_status(status_task)
         await callback.message.edit_text(f"❌ Ошибка: {e}", reply_markup=back_to_menu_kb())
-    await callback.answer()
+        return
+    
+    await settle_status(status_task)
+    # Снимок с входа устарел за время генерации — дописываем только сценарий
+    await state.update_data(script=script)
+    
+    await callback.message.edit_text(
+        f"📝 <b>Новый сценарий:</b>\n\n{script}\n\nВыберите действие:",
+        parse_mode="HTML",
+        reply_markup=confirm_edit_kb()
+    )
 
-@router.callback_query(AvatarVideoStates.waiting_script_confirm, F.data == "confirm")
+@script_router.callback_query(AvatarVideoStates.waiting_script_confirm, F.data == "confirm")
 async def confirm_script(callback: CallbackQuery, state: FSMContext):
     await state.set_state(AvatarVideoStates.waiting_video)
     
     await callback.message.edit_text(
-        "✅ <b>Сценарий подтверждён!</b>\n\n"
-        "🎬 <b>Отправьте видео:</b>\n"
-        "• Длительность: 3-30 сек\n"
-        "• Форматы: MP4, MOV, MKV\n"
-        "• Размер: до 100 МБ",
+        SEND_VIDEO_TEXT,
         parse_mode="HTML",
         reply_markup=cancel_and_back_kb("menu:main")
     )
-    await callback.answer()
+    fire_ack(callback)
 
 # ============ ЗАГРУЗКА ВИДЕО ============
 
-@router.message(AvatarVideoStates.waiting_video, F.video)
+@video_router.message(AvatarVideoStates.waiting_video, F.video)
 async def process_video(message: Message, state: FSMContext, bot: Bot):
     video = message.video
     duration = video.duration or 0
@@ -227,34 +583,23 @@ async def process_video(message: Message, state: FSMContext, bot: Bot):
         await message.answer("⚠️ Видео слишком длинное (макс. 30 сек).", reply_markup=cancel_and_back_kb("menu:main"))
         return
     
-    await message.answer("⏳ Загружаю видео...")
+    ext = allowed_suffix(video.file_name or "", VIDEO_EXTENSIONS) or ".mp4"
     
-    try:
-        ext = "mp4"
-        if video.file_name:
-            name_ext = os.path.splitext(video.file_name)[1].lower()
-            if name_ext in VIDEO_EXTENSIONS:
-                ext = name_ext[1:]
-        
-        video_url = await file_upload_service.upload_telegram_file(
-            bot=bot,
-            file_id=video.file_id,
-            filename=f"motion_{message.from_user.id}_{datetime.now().timestamp()}.{ext}"
-        )
-        
-        await state.update_data(video_url=video_url, video_duration=duration)
-        await state.set_state(AvatarVideoStates.selecting_avatar_source)
-        
-        await message.answer(
-            f"✅ <b>Видео загружено!</b>\n⏱ {duration} сек\n\nВыберите способ создания аватара:",
-            parse_mode="HTML",
-            reply_markup=avatar_source_kb()
-        )
-    except Exception as e:
-        logger.error(f"Video upload error: {e}")
-        await message.answer(f"❌ Ошибка: {e}", reply_markup=cancel_and_back_kb("menu:main"))
+    await handle_upload(
+        message, state, bot,
+        file_id=video.file_id,
+        file_unique_id=video.file_unique_id,
+        filename=upload_filename("motion", message.from_user.id, ext),
+        progress_text="⏳ Загружаю видео...",
+        next_state=AvatarVideoStates.selecting_avatar_source,
+        url_key="video_url",
+        extra_data={"video_duration": duration},
+        ok_text=f"✅ <b>Видео загружено!</b>\n⏱ {duration} сек\n\nВыберите способ создания аватара:",
+        reply_markup=AVATAR_SOURCE_KB,
+        error_label="Video upload error"
+    )
 
-@router.message(AvatarVideoStates.waiting_video, F.video_note)
+@video_router.message(AvatarVideoStates.waiting_video, F.video_note)
 async def process_video_note(message: Message, state: FSMContext, bot: Bot):
     video_note = message.video_note
     duration = video_note.duration or 0
@@ -266,117 +611,87 @@ async def process_video_note(message: Message, state: FSMContext, bot: Bot):
         await message.answer("⚠️ Кружок слишком длинный (макс. 30 сек).", reply_markup=cancel_and_back_kb("menu:main"))
         return
     
-    await message.answer("⏳ Загружаю кружок...")
-    
-    try:
-        video_url = await file_upload_service.upload_telegram_file(
-            bot=bot,
-            file_id=video_note.file_id,
-            filename=f"videonote_{message.from_user.id}_{datetime.now().timestamp()}.mp4"
-        )
-        
-        await state.update_data(video_url=video_url, video_duration=duration)
-        await state.set_state(AvatarVideoStates.selecting_avatar_source)
-        
-        await message.answer(
-            f"✅ <b>Кружок загружен!</b>\n⏱ {duration} сек\n\nВыберите способ создания аватара:",
-            parse_mode="HTML",
-            reply_markup=avatar_source_kb()
-        )
-    except Exception as e:
-        logger.error(f"Video note error: {e}")
-        await message.answer(f"❌ Ошибка: {e}", reply_markup=cancel_and_back_kb("menu:main"))
+    await handle_upload(
+        message, state, bot,
+        file_id=video_note.file_id,
+        file_unique_id=video_note.file_unique_id,
+        filename=upload_filename("videonote", message.from_user.id, ".mp4"),
+        progress_text="⏳ Загружаю кружок...",
+        next_state=AvatarVideoStates.selecting_avatar_source,
+        url_key="video_url",
+        extra_data={"video_duration": duration},
+        ok_text=f"✅ <b>Кружок загружен!</b>\n⏱ {duration} сек\n\nВыберите способ создания аватара:",
+        reply_markup=AVATAR_SOURCE_KB,
+        error_label="Video note error"
+    )
 
-@router.message(AvatarVideoStates.waiting_video, F.document)
+@video_router.message(AvatarVideoStates.waiting_video, F.document)
 async def process_document_video(message: Message, state: FSMContext, bot: Bot):
     doc = message.document
     filename = doc.file_name or "file"
-    ext = os.path.splitext(filename)[1].lower()
+    ext = allowed_suffix(filename, VIDEO_EXTENSIONS)
     
-    if ext not in VIDEO_EXTENSIONS:
-        await message.answer(f"⚠️ Формат {ext} не поддерживается.", reply_markup=cancel_and_back_kb("menu:main"))
+    if ext is None:
+        await message.answer(UNSUPPORTED_FORMAT_TEXT.format(os.path.splitext(filename)[1].lower()), reply_markup=cancel_and_back_kb("menu:main"))
         return
     
     if doc.file_size and doc.file_size > 100 * 1024 * 1024:
         await message.answer("⚠️ Файл слишком большой (макс. 100 МБ).", reply_markup=cancel_and_back_kb("menu:main"))
         return
     
-    await message.answer("⏳ Загружаю видео...")
-    
-    try:
-        video_url = await file_upload_service.upload_telegram_file(
-            bot=bot,
-            file_id=doc.file_id,
-            filename=f"motion_{message.from_user.id}_{datetime.now().timestamp()}{ext}"
-        )
-        
-        await state.update_data(video_url=video_url, video_duration=15)
-        await state.set_state(AvatarVideoStates.selecting_avatar_source)
-        
-        await message.answer(
-            f"✅ <b>Видео загружено!</b>\n📄 {filename}\n\nВыберите способ создания аватара:",
-            parse_mode="HTML",
-            reply_markup=avatar_source_kb()
-        )
-    except Exception as e:
-        logger.error(f"Document video error: {e}")
-        await message.answer(f"❌ Ошибка: {e}", reply_markup=cancel_and_back_kb("menu:main"))
+    await handle_upload(
+        message, state, bot,
+        file_id=doc.file_id,
+        file_unique_id=doc.file_unique_id,
+        filename=upload_filename("motion", message.from_user.id, ext),
+        progress_text="⏳ Загружаю видео...",
+        next_state=AvatarVideoStates.selecting_avatar_source,
+        url_key="video_url",
+        ok_text=f"✅ <b>Видео загружено!</b>\n📄 {filename}\n\nВыберите способ создания аватара:",
+        reply_markup=AVATAR_SOURCE_KB,
+        error_label="Document video error"
+    )
 
-@router.message(AvatarVideoStates.waiting_video)
+@video_router.message(AvatarVideoStates.waiting_video)
 async def process_video_invalid(message: Message):
     await message.answer("⚠️ Отправьте видео (MP4, MOV, MKV).", reply_markup=cancel_and_back_kb("menu:main"))
 
 # ============ ВЫБОР ИСТОЧНИКА АВАТАРА ============
 
-@router.callback_query(AvatarVideoStates.selecting_avatar_source, F.data == "avatar:source:upload")
-async def select_upload_avatar(callback: CallbackQuery, state: FSMContext):
-    await state.set_state(AvatarVideoStates.waiting_avatar_image)
-    await callback.message.edit_text(
-        "📤 <b>Загрузите фото аватара</b>\n\n"
-        "Форматы: JPEG, PNG, WEBP\nРазмер: до 10 МБ\n\n📷 Отправьте фото:",
-        parse_mode="HTML",
-        reply_markup=cancel_and_back_kb("menu:main")
-    )
-    await callback.answer()
+# Кнопка источника -> (следующее состояние, текст, данные FSM)
+AVATAR_SOURCE_ROUTES = {
+    "upload": (AvatarVideoStates.waiting_avatar_image, UPLOAD_AVATAR_TEXT, None),
+    "generate": (AvatarVideoStates.waiting_avatar_description, GENERATE_AVATAR_TEXT, {"avatar_generation_mode": "text"}),
+    # ИСПРАВЛЕНИЕ 2: Добавляем генерацию из фото через Nano Banana Edit
+    "edit": (AvatarVideoStates.waiting_source_image, EDIT_AVATAR_TEXT, None)
+}
 
-@router.callback_query(AvatarVideoStates.selecting_avatar_source, F.data == "avatar:source:generate")
-async def select_generate_avatar(callback: CallbackQuery, state: FSMContext):
-    await state.update_data(avatar_generation_mode="text")
-    await state.set_state(AvatarVideoStates.waiting_avatar_description)
-    await callback.message.edit_text(
-        "🎨 <b>Генерация аватара по промпту</b>\n\n"
-        "💡 Примеры:\n"
-        "• <i>Мужчина 30 лет, тёмные волосы, деловой портрет</i>\n"
-        "• <i>Женщина со светлыми волосами, улыбка</i>\n\n"
-        "✏️ Введите описание аватара:",
-        parse_mode="HTML",
-        reply_markup=cancel_and_back_kb("menu:main")
-    )
-    await callback.answer()
-
-# ИСПРАВЛЕНИЕ 2: Добавляем генерацию из фото через Nano Banana Edit
-@router.callback_query(AvatarVideoStates.selecting_avatar_source, F.data == "avatar:source:edit")
-async def select_edit_avatar(callback: CallbackQuery, state: FSMContext):
-    await state.set_state(AvatarVideoStates.waiting_source_image)
+@avatar_router.callback_query(
+    AvatarVideoStates.selecting_avatar_source,
+    AvatarCB.filter((F.action == "source") & F.value.in_(AVATAR_SOURCE_ROUTES))
+)
+async def select_avatar_source(callback: CallbackQuery, callback_data: AvatarCB, state: FSMContext):
+    next_state, text, data = AVATAR_SOURCE_ROUTES[callback_data.value]
+    if data:
+        await transition(state, next_state, **data)
+    else:
+        await state.set_state(next_state)
     await callback.message.edit_text(
-        "🖼 <b>Генерация аватара из фото</b>\n\n"
-        "Отправьте фото, которое нужно использовать как основу.\n"
-        "Лицо будет сохранено 1 в 1.\n\n"
-        "📷 Отправьте фото:",
+        text,
         parse_mode="HTML",
         reply_markup=cancel_and_back_kb("menu:main")
     )
-    await callback.answer()
+    fire_ack(callback)
 
 @router.callback_query(F.data == "avatar:back_source")
 async def back_to_avatar_source(callback: CallbackQuery, state: FSMContext):
     await state.set_state(AvatarVideoStates.selecting_avatar_source)
-    await callback.message.edit_text("Выберите способ создания аватара:", reply_markup=avatar_source_kb())
-    await callback.answer()
+    await safe_edit(callback.message, CHOOSE_SOURCE_TEXT, reply_markup=AVATAR_SOURCE_KB)
+    fire_ack(callback)
 
 # ============ ГЕНЕРАЦИЯ ИЗ ТЕКСТА (Nano Banana Pro) ============
 
-@router.message(AvatarVideoStates.waiting_avatar_description)
+@avatar_router.message(AvatarVideoStates.waiting_avatar_description)
 async def process_avatar_description(message: Message, state: FSMContext):
     description = message.text.strip()
     
@@ -385,79 +700,47 @@ async def process_avatar_description(message: Message, state: FSMContext):
     try:
         # ИСПРАВЛЕНИЕ 3: Используем Nano Banana Pro вместо обычного Nano Banana
         # Промпт для портретного фото 9:16
-        full_prompt = f"{description}, professional portrait photo, high quality, realistic face, studio lighting, 9:16 vertical format"
+        full_prompt = description + AVATAR_PROMPT_SUFFIX
         
-        result = await kieai_service.generate_nano_banana_pro_image(
-            prompt=full_prompt,
-            aspect_ratio="9:16"  # ИСПРАВЛЕНИЕ 4: Сразу 9:16
-        )
+        async with KIEAI_SEMAPHORE:
+            result = await kieai_service.generate_nano_banana_pro_image(
+                prompt=full_prompt,
+                aspect_ratio="9:16",  # ИСПРАВЛЕНИЕ 4: Сразу 9:16
+                callback_url=kie_callbacks.callback_url
+            )
         
         if result.get("code") != 200:
             raise Exception(result.get("msg", "Ошибка генерации"))
         
-        task_id = result.get("data", {}).get("taskId")
-        if not task_id:
-            raise Exception("Не получен taskId")
-        
-        await message.answer("⏳ Ожидаю результат...")
-        
-        avatar_url = await wait_for_image_result(task_id)
-        
-        if not avatar_url:
-            raise Exception("Не удалось получить изображение")
-        
-        await state.update_data(avatar_image_url=avatar_url)
-        await state.set_state(AvatarVideoStates.confirming_avatar)
-        
-        await message.answer_photo(
-            photo=avatar_url,
-            caption="✅ <b>Аватар готов!</b>\n\nИспользовать?",
-            parse_mode="HTML",
-            reply_markup=confirm_avatar_kb()
-        )
+        await hand_off_avatar(message, state, result.get("data", {}))
         
     except Exception as e:
-        logger.error(f"Avatar generation error: {e}")
-        await message.answer(f"❌ Ошибка: {e}", reply_markup=avatar_source_kb())
+        logger.error("Avatar generation error: %s", e)
+        await message.answer(f"❌ Ошибка: {e}", reply_markup=AVATAR_SOURCE_KB)
         await state.set_state(AvatarVideoStates.selecting_avatar_source)
 
 # ============ ГЕНЕРАЦИЯ ИЗ ФОТО (Nano Banana Edit) ============
 
-@router.message(AvatarVideoStates.waiting_source_image, F.photo)
+@avatar_router.message(AvatarVideoStates.waiting_source_image, F.photo)
 async def process_source_image(message: Message, state: FSMContext, bot: Bot):
-    photo = message.photo[-1]
-    await message.answer("⏳ Загружаю фото...")
-    
-    try:
-        source_image_url = await file_upload_service.upload_telegram_file(
-            bot=bot,
-            file_id=photo.file_id,
-            filename=f"source_{message.from_user.id}_{datetime.now().timestamp()}.jpg"
-        )
-        
-        await state.update_data(source_image_url=source_image_url)
-        await state.set_state(AvatarVideoStates.waiting_edit_description)
-        
-        await message.answer(
-            "✅ <b>Фото загружено!</b>\n\n"
-            "Теперь опишите, что нужно изменить (фон, стиль, одежда и т.д.).\n"
-            "Лицо останется прежним.\n\n"
-            "💡 Примеры:\n"
-            "• <i>студийный фон, деловой костюм</i>\n"
-            "• <i>уличный фон, casual одежда</i>\n\n"
-            "✏️ Введите описание изменений:",
-            parse_mode="HTML",
-            reply_markup=cancel_and_back_kb("menu:main")
-        )
-    except Exception as e:
-        logger.error(f"Source image upload error: {e}")
-        await message.answer(f"❌ Ошибка: {e}", reply_markup=cancel_and_back_kb("menu:main"))
+    await handle_upload(
+        message, state, bot,
+        file_id=message.photo[-1].file_id,
+        file_unique_id=message.photo[-1].file_unique_id,
+        filename=upload_filename("source", message.from_user.id, ".jpg"),
+        progress_text="⏳ Загружаю фото...",
+        next_state=AvatarVideoStates.waiting_edit_description,
+        url_key="source_image_url",
+        ok_text=SOURCE_UPLOADED_TEXT,
+        reply_markup=cancel_and_back_kb("menu:main"),
+        error_label="Source image upload error"
+    )
 
-@router.message(AvatarVideoStates.waiting_source_image)
+@avatar_router.message(AvatarVideoStates.waiting_source_image)
 async def process_source_image_invalid(message: Message):
     await message.answer("⚠️ Отправьте фотографию.", reply_markup=cancel_and_back_kb("menu:main"))
 
-@router.message(AvatarVideoStates.waiting_edit_description)
+@avatar_router.message(AvatarVideoStates.waiting_edit_description)
 async def process_edit_description(message: Message, state: FSMContext):
     description = message.text.strip()
     data = await state.get_data()
@@ -470,125 +753,90 @@ async def process_edit_description(message: Message, state: FSMContext):
     await message.answer("🎨 Генерирую аватар через Nano Banana Edit... (1-2 мин)")
     
     try:
-        full_prompt = f"CRITICAL: Preserve the face and facial features EXACTLY as shown in the original image - DO NOT modify face, skin tone, eyes, nose, mouth, or any facial characteristics. ONLY change: {description}. Professional portrait photo, 9:16 vertical format, high quality, photorealistic"
+        full_prompt = EDIT_PROMPT_PREFIX + description + EDIT_PROMPT_SUFFIX
 
-        result = await kieai_service.generate_nano_banana_edit(
-            prompt=full_prompt,
-            image_urls=[source_image_url],
-            aspect_ratio="9:16"  # ИСПРАВЛЕНИЕ 4: Сразу 9:16
-        )
+        async with KIEAI_SEMAPHORE:
+            result = await kieai_service.generate_nano_banana_edit(
+                prompt=full_prompt,
+                image_urls=[source_image_url],
+                aspect_ratio="9:16",  # ИСПРАВЛЕНИЕ 4: Сразу 9:16
+                callback_url=kie_callbacks.callback_url
+            )
         
         if result.get("code") != 200:
             raise Exception(result.get("msg", "Ошибка генерации"))
         
-        task_id = result.get("data", {}).get("taskId")
-        if not task_id:
-            raise Exception("Не получен taskId")
-        
-        await message.answer("⏳ Ожидаю результат...")
-        
-        avatar_url = await wait_for_image_result(task_id)
-        
-        if not avatar_url:
-            raise Exception("Не удалось получить изображение")
-        
-        await state.update_data(avatar_image_url=avatar_url)
-        await state.set_state(AvatarVideoStates.confirming_avatar)
-        
-        await message.answer_photo(
-            photo=avatar_url,
-            caption="✅ <b>Аватар готов!</b>\n\nИспользовать?",
-            parse_mode="HTML",
-            reply_markup=confirm_avatar_kb()
-        )
+        await hand_off_avatar(message, state, result.get("data", {}))
         
     except Exception as e:
-        logger.error(f"Avatar edit error: {e}")
-        await message.answer(f"❌ Ошибка: {e}", reply_markup=avatar_source_kb())
+        logger.error("Avatar edit error: %s", e)
+        await message.answer(f"❌ Ошибка: {e}", reply_markup=AVATAR_SOURCE_KB)
         await state.set_state(AvatarVideoStates.selecting_avatar_source)
 
 # ============ ЗАГРУЗКА ГОТОВОГО ФОТО ============
 
-@router.message(AvatarVideoStates.waiting_avatar_image, F.photo)
+@avatar_router.message(AvatarVideoStates.waiting_avatar_image, F.photo)
 async def process_avatar_photo(message: Message, state: FSMContext, bot: Bot):
-    photo = message.photo[-1]
-    await message.answer("⏳ Загружаю фото...")
-    
-    try:
-        avatar_url = await file_upload_service.upload_telegram_file(
-            bot=bot,
-            file_id=photo.file_id,
-            filename=f"avatar_{message.from_user.id}_{datetime.now().timestamp()}.jpg"
-        )
-        
-        await state.update_data(avatar_image_url=avatar_url)
-        await state.set_state(AvatarVideoStates.confirming_avatar)
-        
-        await message.answer_photo(
-            photo=avatar_url,
-            caption="✅ <b>Фото загружено!</b>\n\nИспользовать как аватар?",
-            parse_mode="HTML",
-            reply_markup=confirm_avatar_kb()
-        )
-    except Exception as e:
-        logger.error(f"Photo upload error: {e}")
-        await message.answer(f"❌ Ошибка: {e}", reply_markup=cancel_and_back_kb("menu:main"))
+    await handle_upload(
+        message, state, bot,
+        file_id=message.photo[-1].file_id,
+        file_unique_id=message.photo[-1].file_unique_id,
+        filename=upload_filename("avatar", message.from_user.id, ".jpg"),
+        progress_text="⏳ Загружаю фото...",
+        next_state=AvatarVideoStates.confirming_avatar,
+        url_key="avatar_image_url",
+        ok_text=AVATAR_UPLOADED_TEXT,
+        reply_markup=CONFIRM_AVATAR_KB,
+        as_photo=True,
+        error_label="Photo upload error"
+    )
 
-@router.message(AvatarVideoStates.waiting_avatar_image, F.document)
+@avatar_router.message(AvatarVideoStates.waiting_avatar_image, F.document)
 async def process_avatar_document(message: Message, state: FSMContext, bot: Bot):
     doc = message.document
     filename = doc.file_name or "file"
-    ext = os.path.splitext(filename)[1].lower()
+    ext = allowed_suffix(filename, IMAGE_EXTENSIONS)
     
-    if ext not in IMAGE_EXTENSIONS:
-        await message.answer(f"⚠️ Формат {ext} не поддерживается.", reply_markup=cancel_and_back_kb("menu:main"))
+    if ext is None:
+        await message.answer(UNSUPPORTED_FORMAT_TEXT.format(os.path.splitext(filename)[1].lower()), reply_markup=cancel_and_back_kb("menu:main"))
         return
     
     if doc.file_size and doc.file_size > 10 * 1024 * 1024:
         await message.answer("⚠️ Файл слишком большой (макс. 10 МБ).", reply_markup=cancel_and_back_kb("menu:main"))
         return
     
-    await message.answer("⏳ Загружаю фото...")
-    
-    try:
-        avatar_url = await file_upload_service.upload_telegram_file(
-            bot=bot,
-            file_id=doc.file_id,
-            filename=f"avatar_{message.from_user.id}_{datetime.now().timestamp()}{ext}"
-        )
-        
-        await state.update_data(avatar_image_url=avatar_url)
-        await state.set_state(AvatarVideoStates.confirming_avatar)
-        
-        await message.answer_photo(
-            photo=avatar_url,
-            caption="✅ <b>Фото загружено!</b>\n\nИспользовать как аватар?",
-            parse_mode="HTML",
-            reply_markup=confirm_avatar_kb()
-        )
-    except Exception as e:
-        logger.error(f"Avatar document upload error: {e}")
-        await message.answer(f"❌ Ошибка: {e}", reply_markup=cancel_and_back_kb("menu:main"))
+    await handle_upload(
+        message, state, bot,
+        file_id=doc.file_id,
+        file_unique_id=doc.file_unique_id,
+        filename=upload_filename("avatar", message.from_user.id, ext),
+        progress_text="⏳ Загружаю фото...",
+        next_state=AvatarVideoStates.confirming_avatar,
+        url_key="avatar_image_url",
+        ok_text=AVATAR_UPLOADED_TEXT,
+        reply_markup=CONFIRM_AVATAR_KB,
+        as_photo=True,
+        error_label="Avatar document upload error"
+    )
 
-@router.message(AvatarVideoStates.waiting_avatar_image)
+@avatar_router.message(AvatarVideoStates.waiting_avatar_image)
 async def process_avatar_invalid(message: Message):
     await message.answer("⚠️ Отправьте фотографию.", reply_markup=cancel_and_back_kb("menu:main"))
 
 # ============ ПОДТВЕРЖДЕНИЕ И НАСТРОЙКИ ============
 
-@router.callback_query(AvatarVideoStates.confirming_avatar, F.data == "avatar:confirm_image")
+@avatar_router.callback_query(AvatarVideoStates.confirming_avatar, F.data == "avatar:confirm_image")
 async def confirm_avatar_ask_subtitles(callback: CallbackQuery, state: FSMContext):
     await state.set_state(AvatarVideoStates.selecting_subtitles)
     
     await callback.message.answer(
-        "🎬 <b>Добавить субтитры?</b>\n\n"
-        "Субтитры будут извлечены через Whisper и наложены на видео.",
+        SUBTITLES_QUESTION_TEXT,
         parse_mode="HTML",
-        reply_markup=subtitles_confirm_kb()
+        reply_markup=SUBTITLES_CONFIRM_KB
     )
-    await callback.answer()
+    fire_ack(callback)
 
-@router.callback_query(AvatarVideoStates.confirming_avatar, F.data == "avatar:regenerate_image")
+@avatar_router.callback_query(AvatarVideoStates.confirming_avatar, F.data == "avatar:regenerate_image")
 async def regenerate_avatar_image(callback: CallbackQuery, state: FSMContext):
     data = await state.get_data()
     avatar_mode = data.get("avatar_generation_mode")
@@ -603,18 +851,18 @@ async def regenerate_avatar_image(callback: CallbackQuery, state: FSMContext):
     else:
         await state.set_state(AvatarVideoStates.selecting_avatar_source)
         await callback.message.answer(
-            "Выберите способ создания аватара:",
-            reply_markup=avatar_source_kb()
+            CHOOSE_SOURCE_TEXT,
+            reply_markup=AVATAR_SOURCE_KB
         )
-    await callback.answer()
+    fire_ack(callback)
 
-@router.callback_query(AvatarVideoStates.confirming_avatar, F.data == "avatar:source:upload")
+@avatar_router.callback_query(AvatarVideoStates.confirming_avatar, AvatarCB.filter((F.action == "source") & (F.value == "upload")))
 async def switch_to_upload(callback: CallbackQuery, state: FSMContext):
     await state.set_state(AvatarVideoStates.waiting_avatar_image)
     await callback.message.answer("📤 <b>Загрузите фото аватара:</b>", parse_mode="HTML", reply_markup=cancel_and_back_kb("menu:main"))
-    await callback.answer()
+    fire_ack(callback)
 
-@router.callback_query(AvatarVideoStates.selecting_subtitles, F.data == "avatar:back_avatar")
+@settings_router.callback_query(AvatarVideoStates.selecting_subtitles, F.data == "avatar:back_avatar")
 async def back_to_avatar_confirm(callback: CallbackQuery, state: FSMContext):
     data = await state.get_data()
     avatar_url = data.get("avatar_image_url")
@@ -626,62 +874,55 @@ async def back_to_avatar_confirm(callback: CallbackQuery, state: FSMContext):
             photo=avatar_url,
             caption="✅ <b>Аватар</b>\n\nИспользовать?",
             parse_mode="HTML",
-            reply_markup=confirm_avatar_kb()
+            reply_markup=CONFIRM_AVATAR_KB
         )
     else:
-        await callback.message.answer("Выберите аватар:", reply_markup=avatar_source_kb())
-    await callback.answer()
+        await callback.message.answer("Выберите аватар:", reply_markup=AVATAR_SOURCE_KB)
+    fire_ack(callback)
 
-@router.callback_query(AvatarVideoStates.selecting_subtitles, F.data.startswith("avatar:sub:"))
-async def process_subtitles_choice(callback: CallbackQuery, state: FSMContext):
-    choice = callback.data.split(":")[2]
-    add_subtitles = choice == "yes"
+@settings_router.callback_query(AvatarVideoStates.selecting_subtitles, AvatarCB.filter(F.action == "sub"))
+async def process_subtitles_choice(callback: CallbackQuery, callback_data: AvatarCB, state: FSMContext):
+    add_subtitles = callback_data.value == "yes"
     
-    await state.update_data(add_subtitles=add_subtitles)
-    await state.set_state(AvatarVideoStates.selecting_quality)
+    await transition(state, AvatarVideoStates.selecting_quality, add_subtitles=add_subtitles)
     
-    await callback.message.edit_text("📺 <b>Выберите качество:</b>", parse_mode="HTML", reply_markup=video_quality_kb())
-    await callback.answer()
+    await callback.message.edit_text(QUALITY_TEXT, parse_mode="HTML", reply_markup=VIDEO_QUALITY_KB)
+    fire_ack(callback)
 
-@router.callback_query(AvatarVideoStates.selecting_quality, F.data == "avatar:back_subs")
+@settings_router.callback_query(AvatarVideoStates.selecting_quality, F.data == "avatar:back_subs")
 async def back_to_subtitles(callback: CallbackQuery, state: FSMContext):
     await state.set_state(AvatarVideoStates.selecting_subtitles)
-    await callback.message.edit_text("🎬 <b>Добавить субтитры?</b>", parse_mode="HTML", reply_markup=subtitles_confirm_kb())
-    await callback.answer()
+    await safe_edit(callback.message, "🎬 <b>Добавить субтитры?</b>", parse_mode="HTML", reply_markup=SUBTITLES_CONFIRM_KB)
+    fire_ack(callback)
 
-@router.callback_query(AvatarVideoStates.selecting_quality, F.data.startswith("avatar:quality:"))
-async def select_quality(callback: CallbackQuery, state: FSMContext):
-    quality = callback.data.split(":")[2]
-    await state.update_data(video_quality=quality)
-    await state.set_state(AvatarVideoStates.selecting_orientation)
+@settings_router.callback_query(AvatarVideoStates.selecting_quality, AvatarCB.filter(F.action == "quality"))
+async def select_quality(callback: CallbackQuery, callback_data: AvatarCB, state: FSMContext):
+    quality = callback_data.value
+    await transition(state, AvatarVideoStates.selecting_orientation, video_quality=quality)
     
     await callback.message.edit_text(
-        "🔄 <b>Ориентация персонажа:</b>\n\n"
-        "🖼 <b>Как на фото</b> (макс. 10 сек)\n"
-        "🎬 <b>Как в видео</b> (макс. 30 сек)",
+        ORIENTATION_TEXT,
         parse_mode="HTML",
-        reply_markup=orientation_kb()
+        reply_markup=ORIENTATION_KB
     )
-    await callback.answer()
+    fire_ack(callback)
 
-@router.callback_query(AvatarVideoStates.selecting_orientation, F.data == "avatar:back_quality")
+@settings_router.callback_query(AvatarVideoStates.selecting_orientation, F.data == "avatar:back_quality")
 async def back_to_quality(callback: CallbackQuery, state: FSMContext):
     await state.set_state(AvatarVideoStates.selecting_quality)
-    await callback.message.edit_text("📺 <b>Выберите качество:</b>", parse_mode="HTML", reply_markup=video_quality_kb())
-    await callback.answer()
+    await safe_edit(callback.message, QUALITY_TEXT, parse_mode="HTML", reply_markup=VIDEO_QUALITY_KB)
+    fire_ack(callback)
 
 # ============ ЗАПУСК ГЕНЕРАЦИИ ============
 
-@router.callback_query(AvatarVideoStates.selecting_orientation, F.data.startswith("avatar:orient:"))
-async def process_orientation_and_generate(callback: CallbackQuery, state: FSMContext):
-    orientation = callback.data.split(":")[2]
+@settings_router.callback_query(AvatarVideoStates.selecting_orientation, AvatarCB.filter(F.action == "orient"))
+async def process_orientation_and_generate(callback: CallbackQuery, callback_data: AvatarCB, state: FSMContext):
+    orientation = callback_data.value
     
     data = await state.get_data()
     video_url = data.get("video_url")
     avatar_url = data.get("avatar_image_url")
     video_duration = data.get("video_duration", 15)
-    add_subtitles = data.get("add_subtitles", False)
-    quality = data.get("video_quality", "720p")
     
     if orientation == "image" and video_duration > 10:
         await callback.answer("⚠️ Для 'как на фото' видео должно быть до 10 сек!", show_alert=True)
@@ -689,49 +930,79 @@ async def process_orientation_and_generate(callback: CallbackQuery, state: FSMCo
     
     if not video_url or not avatar_url:
         await callback.message.answer("❌ Ошибка: не найдены данные.", reply_markup=back_to_menu_kb())
-        await callback.answer()
+        fire_ack(callback)
         return
     
-    await state.update_data(character_orientation=orientation)
-    await state.set_state(AvatarVideoStates.generating)
+    # id нажатия метит этот запуск: задача в очереди чата очистит FSM, только если флоу не сменился
+    await transition(state, AvatarVideoStates.generating, data, character_orientation=orientation, pending_launch=callback.id)
+    # Отвечаем на нажатие сразу: дальше субтитры и запуск Kling занимают десятки секунд
+    fire_ack(callback)
     
-    srt_content = None
-    ass_content = None
+    # Субтитры и запуск Kling идут в очереди чата: хендлер освобождается сразу,
+    # а порядок «субтитры -> видео» сохраняется только внутри этого чата
+    chat_queues.enqueue(
+        callback.message.chat.id,
+        functools.partial(launch_motion_video, callback, state, data, orientation)
+    )
+
+async def prepare_subtitles(data: dict) -> tuple[Optional[str], Optional[str], str]:
+    """
+    Субтитры и SRT/ASS для видео: (srt, ass, строка для итогового сообщения)
     
-    if add_subtitles:
-        await callback.message.answer("📝 Генерирую субтитры...")
-        
-        try:
-            if subtitles_service.is_available():
-                subtitles_result = await subtitles_service.transcribe_audio(audio_url=video_url, language="ru")
-                srt_content = subtitles_service.generate_srt(subtitles_result)
-                ass_content = subtitles_service.generate_ass(subtitles_result)
-                await state.update_data(srt_content=srt_content, ass_content=ass_content)
-                await callback.message.answer(f"✅ Субтитры готовы! ({len(subtitles_result.segments)} сегментов)")
-            else:
-                await callback.message.answer("⚠️ Whisper недоступен.")
-                add_subtitles = False
-        except Exception as e:
-            logger.error(f"Subtitles error: {e}")
-            await callback.message.answer(f"⚠️ Ошибка субтитров: {e}")
-            add_subtitles = False
+    Видео, совпадающее по длительности со сценарием, подписывается текстом сценария,
+    остальные транскрибируются. Ошибка не прерывает запуск — видео просто генерируется без субтитров.
+    """
+    try:
+        # OPENAI_SEMAPHORE берёт сам сервис вокруг запроса к Whisper — скачивание и FFmpeg его не держат
+        subtitles_result = await subtitles_service.subtitles_for_video(
+            video_url=data["video_url"],
+            script=data.get("script"),
+            duration=data.get("video_duration"),
+            language="ru"
+        )
+        # Форматирование SRT/ASS — чистый CPU: уводим его из event loop, оба файла сразу
+        srt_content, ass_content = await asyncio.gather(
+            asyncio.to_thread(subtitles_service.generate_srt, subtitles_result),
+            asyncio.to_thread(subtitles_service.generate_ass, subtitles_result)
+        )
+        return srt_content, ass_content, f"📝 Субтитры: будут наложены ({len(subtitles_result.segments)} сегментов)"
+    except Exception as e:
+        logger.error("Subtitles error: %s", e)
+        return None, None, f"⚠️ Ошибка субтитров: {html.escape(str(e))}"
+
+async def launch_motion_video(callback: CallbackQuery, state: FSMContext, data: dict, orientation: str):
+    """Ставит задачу в Kling Motion Control, параллельно готовя субтитры"""
+    video_url = data["video_url"]
+    avatar_url = data["avatar_image_url"]
+    add_subtitles = data.get("add_subtitles", False)
+    quality = data.get("video_quality", "720p")
     
-    await callback.message.answer(
+    # Субтитры нужны только к готовому видео (через 5-15 минут), поэтому транскрибация
+    # идёт одновременно с постановкой задачи в Kling, а не перед ней
+    subtitles_task = asyncio.create_task(prepare_subtitles(data)) if add_subtitles else None
+    subtitles_line = "📝 Субтитры готовятся параллельно\n" if subtitles_task else ""
+    
+    launch_text = (
         f"🎬 <b>Запускаю генерацию...</b>\n\n"
         f"📺 Качество: {quality}\n"
-        f"🔄 Ориентация: {'как на фото' if orientation == 'image' else 'как в видео'}\n\n"
-        "⏳ Ожидайте 5-15 минут.",
-        parse_mode="HTML"
+        f"🔄 Ориентация: {'как на фото' if orientation == 'image' else 'как в видео'}\n"
+        f"{subtitles_line}\n"
+        "⏳ Ожидайте 5-15 минут."
     )
     
+    # Сообщение о запуске уходит параллельно с постановкой задачи в Kling
+    status_task = asyncio.create_task(callback.message.answer(launch_text, parse_mode="HTML"))
+    
     try:
-        result = await kling_motion_service.create_motion_video(
-            image_url=avatar_url,
-            video_url=video_url,
-            prompt=data.get("topic", ""),
-            character_orientation=orientation,
-            mode=quality
-        )
+        async with KIEAI_SEMAPHORE:
+            result = await kling_motion_service.create_motion_video(
+                image_url=avatar_url,
+                video_url=video_url,
+                prompt=data.get("topic", ""),
+                character_orientation=orientation,
+                mode=quality,
+                callback_url=kie_callbacks.callback_url
+            )
         
         if result.get("code") != 200:
             raise Exception(result.get("msg", "Ошибка API"))
@@ -739,25 +1010,41 @@ async def process_orientation_and_generate(callback: CallbackQuery, state: FSMCo
         task_id = result.get("data", {}).get("taskId")
         if not task_id:
             raise Exception("Не получен taskId")
-        
-        video_task = VideoTask(
-            task_id=task_id,
-            chat_id=callback.message.chat.id,
-            user_id=callback.from_user.id,
-            model="kling_motion",
-            created_at=datetime.now(),
-            prompt=data.get("topic", "Motion Control video"),
-            avatar_image_url=avatar_url
-        )
-        task_tracker.add_task(video_task)
-        
-        if add_subtitles and (srt_content or ass_content):
-            task_tracker.tasks[task_id].subtitles_data = {"srt": srt_content, "ass": ass_content}
-        
-        subtitle_info = "\n📝 Субтитры: будут наложены" if add_subtitles else ""
-        
-        # ИСПРАВЛЕНИЕ 5: Добавляем главное меню после генерации
-        await callback.message.answer(
+    except Exception as e:
+        if subtitles_task:
+            subtitles_task.cancel()
+        await settle_status(status_task)
+        logger.error("Motion Control error: %s", e)
+        await callback.message.answer(f"❌ Ошибка: {e}", reply_markup=back_to_menu_kb())
+        if await flow_is_current(state, AvatarVideoStates.generating, pending_launch=callback.id):
+            await state.clear()
+        return
+    
+    # Задача Kling уже создана и оплачена: ставим её на отслеживание сразу,
+    # чтобы сбой субтитров или сообщения о запуске не потерял готовое видео
+    await task_tracker.add_task(VideoTask(
+        task_id=task_id,
+        chat_id=callback.message.chat.id,
+        user_id=callback.from_user.id,
+        model="kling_motion",
+        prompt=data.get("topic", "Motion Control video"),
+        avatar_image_url=avatar_url
+    ))
+    if await flow_is_current(state, AvatarVideoStates.generating, pending_launch=callback.id):
+        await state.clear()
+    
+    subtitle_info = ""
+    if subtitles_task:
+        srt_content, ass_content, subtitles_note = await subtitles_task
+        if srt_content or ass_content:
+            await task_tracker.attach_subtitles(task_id, {"srt": srt_content, "ass": ass_content})
+        subtitle_info = f"\n{subtitles_note}"
+    
+    # ИСПРАВЛЕНИЕ 5: Добавляем главное меню после генерации
+    # Сообщение о запуске превращается в итоговое — без второй отправки
+    try:
+        status_message = await status_task
+        await status_message.edit_text(
             f"✅ <b>Генерация запущена!</b>\n\n"
             f"🆔 <code>{task_id}</code>\n"
             f"📺 {quality}{subtitle_info}\n\n"
@@ -765,11 +1052,5 @@ async def process_orientation_and_generate(callback: CallbackQuery, state: FSMCo
             parse_mode="HTML",
             reply_markup=back_to_menu_kb()
         )
-        await state.clear()
-        
     except Exception as e:
-        logger.error(f"Motion Control error: {e}")
-        await callback.message.answer(f"❌ Ошибка: {e}", reply_markup=back_to_menu_kb())
-        await state.clear()
-    
-    await callback.answer()
\ No newline at end of file
+        logger.warning("Launch status message failed for %s: %s", task_id, e)
\ No newline at end of file
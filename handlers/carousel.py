@@ -1,5 +1,7 @@
 import asyncio
+import functools
 import logging
+import re
 from aiogram import Router, F
 from aiogram.types import Message, CallbackQuery, BufferedInputFile, InputMediaPhoto
 from aiogram.fsm.context import FSMContext
@@ -9,23 +11,26 @@ from aiogram.types import InlineKeyboardButton
 from states.generation_states import CarouselStates
 from keyboards.menus import cancel_kb, back_to_menu_kb, cancel_and_back_kb
 from services.carousel_service import carousel_service, CarouselContent, CarouselSlide
+from utils.ffmpeg import ffmpeg_available
+from utils.fsm import transition
 
 logger = logging.getLogger(__name__)
 router = Router()
 
-# Маппинг цветовых схем
-COLOR_MAP = {
-    "dark": "dark",
-    "light": "light",
-    "gradient": "gradient"
+# Цветовые схемы: код из кнопки -> (схема для рендера, название для пользователя)
+COLOR_TABLE = {
+    "dark": ("dark", "🌙 Тёмная"),
+    "light": ("light", "☀️ Светлая"),
+    "gradient": ("gradient", "🌈 Градиент")
 }
 
-COLOR_NAMES = {
-    "dark": "🌙 Тёмная",
-    "light": "☀️ Светлая",
-    "gradient": "🌈 Градиент"
-}
+# Количество слайдов из кнопки: callback_data -> число
+SLIDES_COUNT_TABLE = {f"crs:sl:{n}": n for n in (5, 7, 9, 10)}
+
+# Эмодзи типов слайдов (раньше словарь собирался заново на каждый слайд)
+SLIDE_TYPE_EMOJI = {"cover": "🏠", "content": "📄", "cta": "🎯"}
 
+@functools.cache
 def slides_count_kb():
     """Выбор количества слайдов"""
     builder = InlineKeyboardBuilder()
@@ -41,6 +46,7 @@ def slides_count_kb():
     builder.row(InlineKeyboardButton(text="❌ Отмена", callback_data="cancel"))
     return builder.as_markup()
 
+@functools.cache
 def color_scheme_kb():
     """Выбор цветовой схемы"""
     builder = InlineKeyboardBuilder()
@@ -53,6 +59,7 @@ def color_scheme_kb():
     builder.row(InlineKeyboardButton(text="❌ Отмена", callback_data="cancel"))
     return builder.as_markup()
 
+@functools.cache
 def content_actions_kb():
     """Действия с контентом карусели"""
     builder = InlineKeyboardBuilder()
@@ -71,7 +78,7 @@ async def start_carousel_flow(callback: CallbackQuery, state: FSMContext):
         from services.openai_service import openai_service
         if not openai_service.is_available():
             missing.append("OPENAI_API_KEY")
-        if not carousel_service._check_ffmpeg():
+        if not ffmpeg_available():
             missing.append("FFmpeg")
         
         await callback.message.edit_text(
@@ -95,8 +102,7 @@ async def start_carousel_flow(callback: CallbackQuery, state: FSMContext):
 async def process_topic(message: Message, state: FSMContext):
     """Получение темы карусели"""
     topic = message.text.strip()
-    await state.update_data(topic=topic)
-    await state.set_state(CarouselStates.selecting_slides_count)
+    await transition(state, CarouselStates.selecting_slides_count, topic=topic)
     
     await message.answer(
         f"📝 Тема: <b>{topic}</b>\n\n"
@@ -118,12 +124,11 @@ async def back_to_topic(callback: CallbackQuery, state: FSMContext):
     )
     await callback.answer()
 
-@router.callback_query(CarouselStates.selecting_slides_count, F.data.startswith("crs:sl:"))
+@router.callback_query(CarouselStates.selecting_slides_count, F.data.in_(SLIDES_COUNT_TABLE))
 async def select_slides_count(callback: CallbackQuery, state: FSMContext):
     """Выбор количества слайдов"""
-    slides_count = int(callback.data.split(":")[2])
-    await state.update_data(slides_count=slides_count)
-    await state.set_state(CarouselStates.selecting_color)
+    slides_count = SLIDES_COUNT_TABLE[callback.data]
+    await transition(state, CarouselStates.selecting_color, slides_count=slides_count)
     
     await callback.message.edit_text(
         f"📊 Слайдов: <b>{slides_count}</b>\n\n"
@@ -153,9 +158,8 @@ async def back_to_slides_from_color(callback: CallbackQuery, state: FSMContext):
 @router.callback_query(CarouselStates.selecting_color, F.data.startswith("crs:clr:"))
 async def select_color_and_generate_content(callback: CallbackQuery, state: FSMContext):
     """Выбор цвета и генерация контента"""
-    color_code = callback.data.split(":")[2]
-    color = COLOR_MAP.get(color_code, "dark")
-    color_name = COLOR_NAMES.get(color_code, color)
+    color_code = callback.data.removeprefix("crs:clr:")
+    color, color_name = COLOR_TABLE.get(color_code, COLOR_TABLE["dark"])
     
     data = await state.get_data()
     await state.update_data(color_scheme=color)
@@ -176,7 +180,9 @@ async def select_color_and_generate_content(callback: CallbackQuery, state: FSMC
         content.color_scheme = color
         
         # Сохраняем контент
-        await state.update_data(
+        await transition(
+            state,
+            CarouselStates.reviewing_content,
             carousel_content={
                 "topic": content.topic,
                 "style": content.style,
@@ -193,7 +199,6 @@ async def select_color_and_generate_content(callback: CallbackQuery, state: FSMC
                 ]
             }
         )
-        await state.set_state(CarouselStates.reviewing_content)
         
         await show_carousel_content(callback.message, content)
         
@@ -238,7 +243,7 @@ async def show_carousel_content(message, content):
     text += f"🎨 Стиль: {style}\n\n"
     
     for slide in slides:
-        type_emoji = {"cover": "🏠", "content": "📄", "cta": "🎯"}.get(slide.slide_type, "📄")
+        type_emoji = SLIDE_TYPE_EMOJI.get(slide.slide_type, "📄")
         text += f"<b>{slide.slide_number}/{slide.total_slides} {type_emoji} {slide.title}</b>\n"
         
         # Форматируем контент
@@ -298,7 +303,7 @@ async def show_edit_menu(callback: CallbackQuery, state: FSMContext):
     
     builder = InlineKeyboardBuilder()
     for s in slides:
-        type_emoji = {"cover": "🏠", "content": "📄", "cta": "🎯"}.get(s.get("slide_type"), "📄")
+        type_emoji = SLIDE_TYPE_EMOJI.get(s.get("slide_type"), "📄")
         title = s.get("title", "")[:20]
         builder.row(InlineKeyboardButton(
             text=f"{s.get('slide_number')}. {type_emoji} {title}",
@@ -321,12 +326,21 @@ async def back_to_review(callback: CallbackQuery, state: FSMContext):
     await show_carousel_content(callback.message, content)
     await callback.answer()
 
+@functools.cache
 def edit_slide_kb():
     """Кнопки при редактировании слайда"""
     builder = InlineKeyboardBuilder()
     builder.row(InlineKeyboardButton(text="⬅️ Назад к просмотру", callback_data="crs:back_from_edit"))
     return builder.as_markup()
 
+@functools.cache
+def result_actions_kb():
+    """Кнопки под готовой каруселью"""
+    builder = InlineKeyboardBuilder()
+    builder.row(InlineKeyboardButton(text="🔄 Сгенерировать заново", callback_data="crs:retry"))
+    builder.row(InlineKeyboardButton(text="⬅️ Главное меню", callback_data="menu:main"))
+    return builder.as_markup()
+
 @router.callback_query(CarouselStates.reviewing_content, F.data.startswith("crs:ed:"))
 async def start_edit_slide(callback: CallbackQuery, state: FSMContext):
     """Начало редактирования конкретного слайда"""
@@ -345,8 +359,7 @@ async def start_edit_slide(callback: CallbackQuery, state: FSMContext):
         await callback.answer("Слайд не найден", show_alert=True)
         return
     
-    await state.update_data(editing_slide=slide_num)
-    await state.set_state(CarouselStates.editing_slide)
+    await transition(state, CarouselStates.editing_slide, editing_slide=slide_num)
     
     await callback.message.edit_text(
         f"✏️ <b>Редактирование слайда {slide_num}</b>\n\n"
@@ -363,8 +376,6 @@ async def start_edit_slide(callback: CallbackQuery, state: FSMContext):
 @router.message(CarouselStates.editing_slide)
 async def process_slide_edit(message: Message, state: FSMContext):
     """Обработка редактирования слайда"""
-    import re
-    
     text = message.text.strip()
     data = await state.get_data()
     slide_num = data.get("editing_slide")
@@ -393,8 +404,7 @@ async def process_slide_edit(message: Message, state: FSMContext):
             break
     
     content["slides"] = slides
-    await state.update_data(carousel_content=content)
-    await state.set_state(CarouselStates.reviewing_content)
+    await transition(state, CarouselStates.reviewing_content, carousel_content=content)
     
     await message.answer("✅ Слайд обновлён!")
     
@@ -404,7 +414,7 @@ async def process_slide_edit(message: Message, state: FSMContext):
     text += f"🎨 Стиль: {content.get('style', '')}\n\n"
     
     for slide in slides:
-        type_emoji = {"cover": "🏠", "content": "📄", "cta": "🎯"}.get(slide.get("slide_type"), "📄")
+        type_emoji = SLIDE_TYPE_EMOJI.get(slide.get("slide_type"), "📄")
         text += f"<b>{slide.get('slide_number')}/{slide.get('total_slides')} {type_emoji} {slide.get('title')}</b>\n"
         content_preview = slide.get("content", "")[:150]
         if len(slide.get("content", "")) > 150:
@@ -462,8 +472,7 @@ async def generate_carousel_images(callback: CallbackQuery, state: FSMContext):
         )
         
         # Сохраняем результаты
-        await state.update_data(generated_images=successful)
-        await state.set_state(CarouselStates.viewing_result)
+        await transition(state, CarouselStates.viewing_result, generated_images=successful)
         
         # Отправляем карусель
         await send_carousel(callback.message, successful, content)
@@ -522,19 +531,14 @@ async def send_carousel(message, images: list[dict], content: dict):
     text_content += f"🎯 Тема: {content.get('topic', '')}\n\n"
     
     for slide in slides:
-        type_emoji = {"cover": "🏠", "content": "📄", "cta": "🎯"}.get(slide.get("slide_type"), "📄")
+        type_emoji = SLIDE_TYPE_EMOJI.get(slide.get("slide_type"), "📄")
         text_content += f"<b>{type_emoji} Слайд {slide.get('slide_number')}: {slide.get('title')}</b>\n"
         text_content += f"{slide.get('content', '')}\n\n"
     
-    # Кнопки действий
-    builder = InlineKeyboardBuilder()
-    builder.row(InlineKeyboardButton(text="🔄 Сгенерировать заново", callback_data="crs:retry"))
-    builder.row(InlineKeyboardButton(text="⬅️ Главное меню", callback_data="menu:main"))
-    
     await message.answer(
         text_content,
         parse_mode="HTML",
-        reply_markup=builder.as_markup()
+        reply_markup=result_actions_kb()
     )
 
 @router.callback_query(CarouselStates.viewing_result, F.data == "crs:retry")
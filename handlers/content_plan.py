@@ -1,17 +1,24 @@
+import functools
+import json
+import os
 from aiogram import Router, F
 from aiogram.types import Message, CallbackQuery, BufferedInputFile
 from aiogram.fsm.context import FSMContext
 from aiogram.utils.keyboard import InlineKeyboardBuilder
 from aiogram.types import InlineKeyboardButton, InlineKeyboardMarkup
 
-from states.generation_states import ContentPlanStates
+from states.generation_states import ContentPlanStates, AvatarVideoStates
 from keyboards.menus import cancel_kb, back_to_menu_kb, confirm_edit_kb, cancel_and_back_kb
 from services.content_plan_service import content_plan_service, ContentIdea
 from services.openai_service import openai_service
 from services.google_service import google_service
+from utils.fsm import transition
+from utils.telegram import safe_edit
 
 router = Router()
 
+COMPETITORS_FILE = os.path.join("knowledge_base", "competitors.json")
+
 # Маппинг форматов на категории
 FORMAT_TO_CATEGORY = {
     "video": "видео от сора/вео",
@@ -28,6 +35,26 @@ PLATFORM_MAPPING = {
     "blog": "блог"
 }
 
+# Эмодзи для страницы плана
+PLATFORM_EMOJI = {"tiktok": "🎵", "instagram": "📸", "youtube": "📺"}
+FORMAT_EMOJI = {"video": "🎬", "reel": "📱", "carousel": "🖼", "article": "📝"}
+
+# Кнопки с фиксированным набором значений: callback_data -> разобранное значение
+PERIOD_TABLE = {
+    "plan:period:week": ("week", "неделю"),
+    "plan:period:month": ("month", "месяц")
+}
+POSTS_PER_DAY_TABLE = {f"plan:posts:{n}": n for n in (1, 2, 3)}
+
+# Постоянные строки под страницей плана
+PLAN_ACTIONS_ROWS = [
+    [InlineKeyboardButton(text="📥 Скачать план", callback_data="plan:download")],
+    [InlineKeyboardButton(text="📝 Сценарий для идеи", callback_data="plan:script")],
+    [InlineKeyboardButton(text="🔄 Перегенерировать", callback_data="plan:regenerate")],
+    [InlineKeyboardButton(text="⬅️ Главное меню", callback_data="menu:main")]
+]
+
+@functools.cache
 def period_kb():
     """Выбор периода"""
     builder = InlineKeyboardBuilder()
@@ -38,18 +65,24 @@ def period_kb():
     builder.row(InlineKeyboardButton(text="❌ Отмена", callback_data="cancel"))
     return builder.as_markup()
 
+PLATFORM_BUTTONS = (
+    ("tiktok", "🎵 TikTok"),
+    ("instagram", "📸 Instagram"),
+    ("youtube", "📺 YouTube")
+)
+PLATFORM_IDS = frozenset(pid for pid, _ in PLATFORM_BUTTONS)
+
 def platforms_kb(selected: list = None):
     """Выбор платформ (мультивыбор)"""
-    selected = selected or []
+    # Неизвестные id не влияют на разметку — отбрасываем их, чтобы кэш оставался конечным
+    return _platforms_kb(PLATFORM_IDS.intersection(selected or ()))
+
+@functools.cache
+def _platforms_kb(selected: frozenset):
+    # Вариантов выбора всего восемь — каждая клавиатура собирается один раз
     builder = InlineKeyboardBuilder()
     
-    platforms = [
-        ("tiktok", "🎵 TikTok"),
-        ("instagram", "📸 Instagram"),
-        ("youtube", "📺 YouTube")
-    ]
-    
-    for pid, name in platforms:
+    for pid, name in PLATFORM_BUTTONS:
         mark = "✅ " if pid in selected else ""
         builder.row(InlineKeyboardButton(
             text=f"{mark}{name}",
@@ -61,6 +94,7 @@ def platforms_kb(selected: list = None):
     builder.row(InlineKeyboardButton(text="❌ Отмена", callback_data="cancel"))
     return builder.as_markup()
 
+@functools.cache
 def posts_per_day_kb():
     """Количество постов в день"""
     builder = InlineKeyboardBuilder()
@@ -96,8 +130,7 @@ async def start_content_plan_flow(callback: CallbackQuery, state: FSMContext):
 async def process_niche(message: Message, state: FSMContext):
     """Получение ниши"""
     niche = message.text.strip()
-    await state.update_data(niche=niche)
-    await state.set_state(ContentPlanStates.selecting_period)
+    await transition(state, ContentPlanStates.selecting_period, niche=niche)
     
     await message.answer(
         f"📝 Ниша: <b>{niche}</b>\n\n"
@@ -106,14 +139,12 @@ async def process_niche(message: Message, state: FSMContext):
         reply_markup=period_kb()
     )
 
-@router.callback_query(ContentPlanStates.selecting_period, F.data.startswith("plan:period:"))
+@router.callback_query(ContentPlanStates.selecting_period, F.data.in_(PERIOD_TABLE))
 async def select_period(callback: CallbackQuery, state: FSMContext):
     """Выбор периода"""
-    period = callback.data.split(":")[2]
-    await state.update_data(period=period, selected_platforms=[])
-    await state.set_state(ContentPlanStates.selecting_platforms)
+    period, period_name = PERIOD_TABLE[callback.data]
+    await transition(state, ContentPlanStates.selecting_platforms, period=period, selected_platforms=[])
     
-    period_name = "неделю" if period == "week" else "месяц"
     await callback.message.edit_text(
         f"📆 План на <b>{period_name}</b>\n\n"
         "Выберите платформы (можно несколько):",
@@ -174,18 +205,17 @@ async def back_to_platforms(callback: CallbackQuery, state: FSMContext):
     )
     await callback.answer()
 
-@router.callback_query(ContentPlanStates.selecting_frequency, F.data.startswith("plan:posts:"))
+@router.callback_query(ContentPlanStates.selecting_frequency, F.data.in_(POSTS_PER_DAY_TABLE))
 async def generate_plan(callback: CallbackQuery, state: FSMContext):
     """Генерация контент-плана"""
-    posts_per_day = int(callback.data.split(":")[2])
+    posts_per_day = POSTS_PER_DAY_TABLE[callback.data]
     data = await state.get_data()
     
     niche = data["niche"]
     period = data["period"]
     platforms = data["selected_platforms"]
     
-    await state.update_data(posts_per_day=posts_per_day)
-    await state.set_state(ContentPlanStates.generating)
+    await transition(state, ContentPlanStates.generating, posts_per_day=posts_per_day)
     
     await callback.answer()
     
@@ -193,10 +223,6 @@ async def generate_plan(callback: CallbackQuery, state: FSMContext):
     total_posts = days * posts_per_day * len(platforms)
     
     # Проверяем наличие контента конкурентов
-    import os
-    import json
-    COMPETITORS_FILE = os.path.join("knowledge_base", "competitors.json")
-    
     has_competitors = False
     if os.path.exists(COMPETITORS_FILE):
         try:
@@ -240,13 +266,12 @@ async def generate_plan(callback: CallbackQuery, state: FSMContext):
             )
         
         # Сохраняем план
-        await state.update_data(content_plan={
+        await transition(state, ContentPlanStates.viewing_plan, content_plan={
             "topic": plan.topic,
             "period": plan.period,
             "created_at": plan.created_at,
             "ideas": [idea.__dict__ for idea in plan.ideas]
         })
-        await state.set_state(ContentPlanStates.viewing_plan)
         
         await show_content_plan(callback.message, plan, page=0)
         
@@ -255,7 +280,12 @@ async def generate_plan(callback: CallbackQuery, state: FSMContext):
         await state.clear()
 
 async def show_content_plan(message, plan, page: int = 0):
-    """Показывает контент-план постранично"""
+    """
+    Показывает контент-план постранично
+    
+    Через safe_edit: если страница уже отрисована в сообщении (повторное нажатие ⬅️/➡️),
+    запрос в Telegram не уходит.
+    """
     ideas = plan.ideas if hasattr(plan, 'ideas') else plan.get("ideas", [])
     if ideas and isinstance(ideas[0], dict):
         ideas = [ContentIdea(**i) for i in ideas]
@@ -273,12 +303,9 @@ async def show_content_plan(message, plan, page: int = 0):
     text += f"🎯 Ниша: {topic}\n"
     text += f"📊 Всего идей: {len(ideas)}\n\n"
     
-    platform_emoji = {"tiktok": "🎵", "instagram": "📸", "youtube": "📺"}
-    format_emoji = {"video": "🎬", "reel": "📱", "carousel": "🖼", "article": "📝"}
-    
     for i, idea in enumerate(page_ideas, start + 1):
-        p_emoji = platform_emoji.get(idea.platform, "📱")
-        f_emoji = format_emoji.get(idea.format, "🎬")
+        p_emoji = PLATFORM_EMOJI.get(idea.platform, "📱")
+        f_emoji = FORMAT_EMOJI.get(idea.format, "🎬")
         category = FORMAT_TO_CATEGORY.get(idea.format, "пост")
         
         text += f"<b>{i}. {idea.title}</b>\n"
@@ -288,23 +315,16 @@ async def show_content_plan(message, plan, page: int = 0):
     
     text += f"📄 Страница {page + 1}/{total_pages}"
     
-    # Клавиатура навигации
-    builder = InlineKeyboardBuilder()
-    
+    # Клавиатура навигации: строки собираем списком сразу, без InlineKeyboardBuilder
     nav_buttons = []
     if page > 0:
         nav_buttons.append(InlineKeyboardButton(text="⬅️", callback_data=f"plan:page:{page-1}"))
     if end < len(ideas):
         nav_buttons.append(InlineKeyboardButton(text="➡️", callback_data=f"plan:page:{page+1}"))
-    if nav_buttons:
-        builder.row(*nav_buttons)
     
-    builder.row(InlineKeyboardButton(text="📥 Скачать план", callback_data="plan:download"))
-    builder.row(InlineKeyboardButton(text="📝 Сценарий для идеи", callback_data="plan:script"))
-    builder.row(InlineKeyboardButton(text="🔄 Перегенерировать", callback_data="plan:regenerate"))
-    builder.row(InlineKeyboardButton(text="⬅️ Главное меню", callback_data="menu:main"))
+    rows = [nav_buttons, *PLAN_ACTIONS_ROWS] if nav_buttons else PLAN_ACTIONS_ROWS
     
-    await message.edit_text(text, parse_mode="HTML", reply_markup=builder.as_markup())
+    await safe_edit(message, text, parse_mode="HTML", reply_markup=InlineKeyboardMarkup(inline_keyboard=rows))
 
     
 
@@ -335,13 +355,15 @@ async def download_plan(callback: CallbackQuery, state: FSMContext):
     md_content += "---\n\n"
     
     for i, idea in enumerate(ideas, 1):
-        category = FORMAT_TO_CATEGORY.get(idea.get('format', ''), 'пост')
-        platform = PLATFORM_MAPPING.get(idea.get('platform', ''), idea.get('platform', ''))
+        idea_format = idea.get('format') or ''
+        idea_platform = idea.get('platform') or ''
+        category = FORMAT_TO_CATEGORY.get(idea_format, 'пост')
+        platform = PLATFORM_MAPPING.get(idea_platform) or idea_platform
         
         md_content += f"## {i}. {idea.get('title', '')}\n\n"
         md_content += f"- **Платформа:** {platform.title()}\n"
         md_content += f"- **Категория:** {category}\n"
-        md_content += f"- **Формат:** {idea.get('format', '')}\n"
+        md_content += f"- **Формат:** {idea_format}\n"
         md_content += f"- **Длительность:** {idea.get('estimated_duration', '')}\n"
         md_content += f"- **Статус:** Не сгенерировано\n\n"
         md_content += f"### Хук\n{idea.get('hook', '')}\n\n"
@@ -378,19 +400,15 @@ async def select_idea_for_script(callback: CallbackQuery, state: FSMContext):
     plan = data.get("content_plan", {})
     ideas = plan.get("ideas", [])
     
-    builder = InlineKeyboardBuilder()
-    for i, idea in enumerate(ideas[:15]):
-        title = idea.get("title", "")[:30]
-        builder.row(InlineKeyboardButton(
-            text=f"{i+1}. {title}",
-            callback_data=f"plan:gen_script:{i}"
-        ))
-    
-    builder.row(InlineKeyboardButton(text="⬅️ Назад к плану", callback_data="plan:back_to_plan"))
+    rows = [
+        [InlineKeyboardButton(text=f"{i+1}. {idea.get('title', '')[:30]}", callback_data=f"plan:gen_script:{i}")]
+        for i, idea in enumerate(ideas[:15])
+    ]
+    rows.append([InlineKeyboardButton(text="⬅️ Назад к плану", callback_data="plan:back_to_plan")])
     
     await callback.message.edit_text(
         "📝 Выберите идею для генерации сценария:",
-        reply_markup=builder.as_markup()
+        reply_markup=InlineKeyboardMarkup(inline_keyboard=rows)
     )
     await callback.answer()
 
@@ -481,8 +499,6 @@ async def download_script(callback: CallbackQuery, state: FSMContext):
 @router.callback_query(ContentPlanStates.viewing_plan, F.data.startswith("plan:to_avatar:"))
 async def go_to_avatar_with_script(callback: CallbackQuery, state: FSMContext):
     """Переход к созданию видео с аватаром с готовым сценарием"""
-    from states.generation_states import AvatarVideoStates
-    
     idx = int(callback.data.split(":")[2])
     data = await state.get_data()
     plan = data.get("content_plan", {})
@@ -500,8 +516,7 @@ async def go_to_avatar_with_script(callback: CallbackQuery, state: FSMContext):
         return
     
     # Устанавливаем состояние для видео с аватаром
-    await state.update_data(topic=idea.get("title", ""), script=script)
-    await state.set_state(AvatarVideoStates.waiting_script_confirm)
+    await transition(state, AvatarVideoStates.waiting_script_confirm, topic=idea.get("title", ""), script=script)
     
     await callback.message.edit_text(
         f"📝 <b>Сценарий для видео:</b>\n\n{script[:2000]}{'...' if len(script) > 2000 else ''}\n\n"
@@ -557,13 +572,12 @@ async def regenerate_plan(callback: CallbackQuery, state: FSMContext):
                 status="Не сгенерировано"
             )
         
-        await state.update_data(content_plan={
+        await transition(state, ContentPlanStates.viewing_plan, content_plan={
             "topic": plan.topic,
             "period": plan.period,
             "created_at": plan.created_at,
             "ideas": [idea.__dict__ for idea in plan.ideas]
         })
-        await state.set_state(ContentPlanStates.viewing_plan)
         
         await show_content_plan(callback.message, plan, page=0)
         
@@ -1,5 +1,7 @@
+import functools
 from aiogram import Router, F
-from aiogram.types import CallbackQuery, Message
+from aiogram.types import CallbackQuery, Message, InlineKeyboardButton
+from aiogram.utils.keyboard import InlineKeyboardBuilder
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import State, StatesGroup
 
@@ -12,6 +14,31 @@ router = Router()
 class GoogleAuthStates(StatesGroup):
     waiting_auth_code = State()
 
+# Клавиатуры статичны — собираются один раз и переиспользуются
+
+@functools.cache
+def authorize_kb():
+    builder = InlineKeyboardBuilder()
+    builder.row(InlineKeyboardButton(text="🔐 Авторизовать Google", callback_data="google:authorize"))
+    builder.row(InlineKeyboardButton(text="⬅️ Главное меню", callback_data="menu:main"))
+    return builder.as_markup()
+
+@functools.cache
+def connected_kb():
+    builder = InlineKeyboardBuilder()
+    builder.row(InlineKeyboardButton(text="🔓 Отозвать доступ", callback_data="google:revoke"))
+    builder.row(InlineKeyboardButton(text="⬅️ Главное меню", callback_data="menu:main"))
+    return builder.as_markup()
+
+@functools.cache
+def revoke_confirm_kb():
+    builder = InlineKeyboardBuilder()
+    builder.row(
+        InlineKeyboardButton(text="✅ Да, отозвать", callback_data="google:revoke_confirm"),
+        InlineKeyboardButton(text="❌ Отмена", callback_data="menu:google")
+    )
+    return builder.as_markup()
+
 @router.callback_query(F.data == "menu:google")
 async def show_google_status(callback: CallbackQuery, state: FSMContext):
     """Показывает статус Google интеграции и управление авторизацией"""
@@ -39,19 +66,12 @@ async def show_google_status(callback: CallbackQuery, state: FSMContext):
     
     if not is_authorized:
         # Не авторизован - показываем кнопку авторизации
-        from aiogram.utils.keyboard import InlineKeyboardBuilder
-        from aiogram.types import InlineKeyboardButton
-        
-        builder = InlineKeyboardBuilder()
-        builder.row(InlineKeyboardButton(text="🔐 Авторизовать Google", callback_data="google:authorize"))
-        builder.row(InlineKeyboardButton(text="⬅️ Главное меню", callback_data="menu:main"))
-        
         await callback.message.edit_text(
             "🔐 <b>Google не авторизован</b>\n\n"
             "Для работы с Google Drive и Sheets нужно авторизовать доступ.\n\n"
             "Нажмите кнопку ниже для начала авторизации.",
             parse_mode="HTML",
-            reply_markup=builder.as_markup()
+            reply_markup=authorize_kb()
         )
         await callback.answer()
         return
@@ -66,13 +86,6 @@ async def show_google_status(callback: CallbackQuery, state: FSMContext):
         sheet_url = f"https://docs.google.com/spreadsheets/d/{google_service.spreadsheet_id}" if google_service.spreadsheet_id else "Не указан"
         drive_url = f"https://drive.google.com/drive/folders/{google_service.drive_folder_id}" if google_service.drive_folder_id else "Не указана"
         
-        from aiogram.utils.keyboard import InlineKeyboardBuilder
-        from aiogram.types import InlineKeyboardButton
-        
-        builder = InlineKeyboardBuilder()
-        builder.row(InlineKeyboardButton(text="🔓 Отозвать доступ", callback_data="google:revoke"))
-        builder.row(InlineKeyboardButton(text="⬅️ Главное меню", callback_data="menu:main"))
-        
         await callback.message.edit_text(
             "✅ <b>Google подключён!</b>\n\n"
             "Контент будет автоматически:\n"
@@ -81,7 +94,7 @@ async def show_google_status(callback: CallbackQuery, state: FSMContext):
             f"📋 <a href='{sheet_url}'>Таблица</a>\n"
             f"📁 <a href='{drive_url}'>Папка Drive</a>",
             parse_mode="HTML",
-            reply_markup=builder.as_markup(),
+            reply_markup=connected_kb(),
             disable_web_page_preview=True
         )
     else:
@@ -168,21 +181,12 @@ async def process_auth_code(message: Message, state: FSMContext):
 @router.callback_query(F.data == "google:revoke")
 async def revoke_google_access(callback: CallbackQuery):
     """Отзывает доступ к Google"""
-    from aiogram.utils.keyboard import InlineKeyboardBuilder
-    from aiogram.types import InlineKeyboardButton
-    
-    builder = InlineKeyboardBuilder()
-    builder.row(
-        InlineKeyboardButton(text="✅ Да, отозвать", callback_data="google:revoke_confirm"),
-        InlineKeyboardButton(text="❌ Отмена", callback_data="menu:google")
-    )
-    
     await callback.message.edit_text(
         "⚠️ <b>Подтверждение</b>\n\n"
         "Отозвать доступ к Google Drive и Sheets?\n"
         "Вам придётся авторизоваться заново.",
         parse_mode="HTML",
-        reply_markup=builder.as_markup()
+        reply_markup=revoke_confirm_kb()
     )
     await callback.answer()
 
@@ -1,3 +1,4 @@
+import functools
 import os
 import json
 from aiogram import Router, F
@@ -9,11 +10,27 @@ from aiogram.types import InlineKeyboardButton
 from states.generation_states import KnowledgeBaseStates, CompetitorsStates
 from keyboards.menus import knowledge_base_kb, cancel_kb, back_to_menu_kb, cancel_and_back_kb
 from config import config
+from utils.fsm import transition
 
 router = Router()
 
 COMPETITORS_FILE = os.path.join(config.KNOWLEDGE_BASE_DIR, "competitors.json")
 
+# Форматы файлов, которые принимает база знаний
+KB_EXTENSIONS = (".txt", ".md", ".docx")
+# Ответ на неподдерживаемый файл: список форматов склеивается один раз
+UNSUPPORTED_FORMAT_TEXT = "⚠️ Формат {} не поддерживается.\nПоддерживаемые: " + ", ".join(KB_EXTENSIONS)
+
+@functools.cache
+def delete_file_confirm_kb():
+    """Подтверждение удаления файла (клавиатура статична — собирается один раз)"""
+    builder = InlineKeyboardBuilder()
+    builder.row(
+        InlineKeyboardButton(text="✅ Да, удалить", callback_data="kb:confirm_del"),
+        InlineKeyboardButton(text="❌ Отмена", callback_data="menu:knowledge")
+    )
+    return builder.as_markup()
+
 def get_kb_files() -> list[str]:
     """Возвращает список файлов в базе знаний"""
     kb_dir = config.KNOWLEDGE_BASE_DIR
@@ -172,8 +189,7 @@ async def start_adding_link(callback: CallbackQuery, state: FSMContext):
         "tiktok": "https://www.tiktok.com/@username"
     }
     
-    await state.set_state(CompetitorsStates.waiting_link)
-    await state.update_data(platform=platform)
+    await transition(state, CompetitorsStates.waiting_link, platform=platform)
     
     await callback.message.edit_text(
         f"➕ <b>Добавление ссылки</b>\n\n"
@@ -393,13 +409,10 @@ async def process_file_upload(message: Message, state: FSMContext):
     doc = message.document
     filename = doc.file_name or "unknown_file"
     
-    allowed_ext = {".txt", ".md", ".docx"}
-    ext = os.path.splitext(filename)[1].lower()
-    
-    if ext not in allowed_ext:
+    if not filename.lower().endswith(KB_EXTENSIONS):
+        ext = os.path.splitext(filename)[1].lower()
         await message.answer(
-            f"⚠️ Формат {ext} не поддерживается.\n"
-            f"Поддерживаемые: {', '.join(allowed_ext)}",
+            UNSUPPORTED_FORMAT_TEXT.format(ext),
             reply_markup=cancel_and_back_kb("menu:main")
         )
         return
@@ -450,8 +463,7 @@ async def show_delete_menu(callback: CallbackQuery, state: FSMContext):
     
     builder.row(InlineKeyboardButton(text="⬅️ Назад", callback_data="menu:knowledge"))
     
-    await state.update_data(files_list=files)
-    await state.set_state(KnowledgeBaseStates.confirming_delete)
+    await transition(state, KnowledgeBaseStates.confirming_delete, files_list=files)
     
     await callback.message.edit_text(
         "🗑 <b>Выберите файл для удаления:</b>",
@@ -479,16 +491,10 @@ async def confirm_delete(callback: CallbackQuery, state: FSMContext):
     filename = files[idx]
     await state.update_data(delete_file=filename)
     
-    builder = InlineKeyboardBuilder()
-    builder.row(
-        InlineKeyboardButton(text="✅ Да, удалить", callback_data="kb:confirm_del"),
-        InlineKeyboardButton(text="❌ Отмена", callback_data="menu:knowledge")
-    )
-    
     await callback.message.edit_text(
         f"⚠️ Удалить файл <b>{filename}</b>?",
         parse_mode="HTML",
-        reply_markup=builder.as_markup()
+        reply_markup=delete_file_confirm_kb()
     )
     await callback.answer()
 
@@ -1,4 +1,5 @@
-from datetime import datetime
+import json
+import os
 from aiogram import Router, F
 from aiogram.types import Message, CallbackQuery
 from aiogram.fsm.context import FSMContext
@@ -12,12 +13,50 @@ from keyboards.menus import (
 from services.kieai_service import kieai_service
 from services.openai_service import openai_service
 from services.task_tracker import task_tracker, VideoTask
+from services.file_upload_service import file_upload_service
+from services.kie_callbacks import kie_callbacks
+from utils.fsm import transition
 
 router = Router()
 
+COMPETITORS_FILE = os.path.join("knowledge_base", "competitors.json")
+
 # Платформы для анализа конкурентов (для коротких видео используем TikTok, Instagram, YouTube)
 VIDEO_PLATFORMS = ["tiktok", "instagram", "youtube"]
 
+# Кнопки выбора -> значение, сохраняемое в FSM
+MODEL_TABLE = {f"model:{m}": m for m in ("sora2", "veo3_fast", "veo3")}
+MODE_TABLE = {"mode:t2v": "t2v", "mode:i2v": "i2v"}
+ASPECT_TABLE = {"aspect:16:9": "16:9", "aspect:9:16": "9:16"}
+
+# ============ ТЕКСТЫ ============
+
+MODEL_TEXT = (
+    "🎬 <b>Генерация короткого видео</b>\n\n"
+    "Выберите модель:\n\n"
+    "🎥 <b>Sora 2</b> — модель от OpenAI\n"
+    "⚡ <b>Veo 3.1 Fast</b> — быстрая генерация\n"
+    "💎 <b>Veo 3.1 Quality</b> — максимальное качество"
+)
+
+MODE_TEXT = (
+    "📹 <b>Выберите режим генерации:</b>\n\n"
+    "📝 <b>Текст → Видео</b>\n"
+    "🖼 <b>Изображение → Видео</b>"
+)
+
+MODE_BACK_TEXT = "📹 <b>Выберите режим генерации:</b>"
+
+PROMPT_TEXT = (
+    "✍️ <b>Опишите идею видео кратко</b>\n\n"
+    "Опишите суть — промпт будет автоматически улучшен\n"
+)
+
+IMAGE_TEXT = (
+    "🖼 <b>Отправьте изображение</b>\n\n"
+    "Загрузите фото, которое нужно анимировать."
+)
+
 @router.callback_query(F.data == "menu:short_video")
 async def start_video_flow(callback: CallbackQuery, state: FSMContext):
     """Начало создания короткого видео"""
@@ -31,27 +70,20 @@ async def start_video_flow(callback: CallbackQuery, state: FSMContext):
     
     await state.set_state(ShortVideoStates.selecting_model)
     await callback.message.edit_text(
-        "🎬 <b>Генерация короткого видео</b>\n\n"
-        "Выберите модель:\n\n"
-        "🎥 <b>Sora 2</b> — модель от OpenAI\n"
-        "⚡ <b>Veo 3.1 Fast</b> — быстрая генерация\n"
-        "💎 <b>Veo 3.1 Quality</b> — максимальное качество",
+        MODEL_TEXT,
         parse_mode="HTML",
         reply_markup=video_model_kb()
     )
     await callback.answer()
 
-@router.callback_query(ShortVideoStates.selecting_model, F.data.startswith("model:"))
+@router.callback_query(ShortVideoStates.selecting_model, F.data.in_(MODEL_TABLE))
 async def select_model(callback: CallbackQuery, state: FSMContext):
     """Выбор модели"""
-    model = callback.data.split(":")[1]
-    await state.update_data(model=model)
-    await state.set_state(ShortVideoStates.selecting_mode)
+    model = MODEL_TABLE[callback.data]
+    await transition(state, ShortVideoStates.selecting_mode, model=model)
     
     await callback.message.edit_text(
-        "📹 <b>Выберите режим генерации:</b>\n\n"
-        "📝 <b>Текст → Видео</b>\n"
-        "🖼 <b>Изображение → Видео</b>",
+        MODE_TEXT,
         parse_mode="HTML",
         reply_markup=video_mode_kb()
     )
@@ -67,25 +99,22 @@ async def back_to_model(callback: CallbackQuery, state: FSMContext):
     )
     await callback.answer()
 
-@router.callback_query(ShortVideoStates.selecting_mode, F.data.startswith("mode:"))
+@router.callback_query(ShortVideoStates.selecting_mode, F.data.in_(MODE_TABLE))
 async def select_mode(callback: CallbackQuery, state: FSMContext):
     """Выбор режима (t2v или i2v)"""
-    mode = callback.data.split(":")[1]
-    await state.update_data(mode=mode)
+    mode = MODE_TABLE[callback.data]
     
     if mode == "t2v":
-        await state.set_state(ShortVideoStates.waiting_prompt)
+        await transition(state, ShortVideoStates.waiting_prompt, mode=mode)
         await callback.message.edit_text(
-            "✍️ <b>Опишите идею видео кратко</b>\n\n"
-            "Опишите суть — промпт будет автоматически улучшен\n",
+            PROMPT_TEXT,
             parse_mode="HTML",
             reply_markup=cancel_and_back_kb("back:mode")
         )
     else:  # i2v
-        await state.set_state(ShortVideoStates.waiting_image)
+        await transition(state, ShortVideoStates.waiting_image, mode=mode)
         await callback.message.edit_text(
-            "🖼 <b>Отправьте изображение</b>\n\n"
-            "Загрузите фото, которое нужно анимировать.",
+            IMAGE_TEXT,
             parse_mode="HTML",
             reply_markup=cancel_and_back_kb("back:mode")
         )
@@ -96,7 +125,7 @@ async def back_from_prompt(callback: CallbackQuery, state: FSMContext):
     """Возврат к выбору режима из ввода промпта"""
     await state.set_state(ShortVideoStates.selecting_mode)
     await callback.message.edit_text(
-        "📹 <b>Выберите режим генерации:</b>",
+        MODE_BACK_TEXT,
         parse_mode="HTML",
         reply_markup=video_mode_kb()
     )
@@ -107,7 +136,7 @@ async def back_from_image(callback: CallbackQuery, state: FSMContext):
     """Возврат к выбору режима из загрузки изображения"""
     await state.set_state(ShortVideoStates.selecting_mode)
     await callback.message.edit_text(
-        "📹 <b>Выберите режим генерации:</b>",
+        MODE_BACK_TEXT,
         parse_mode="HTML",
         reply_markup=video_mode_kb()
     )
@@ -117,13 +146,8 @@ async def back_from_image(callback: CallbackQuery, state: FSMContext):
 async def process_prompt(message: Message, state: FSMContext):
     """Получение промпта и его улучшение на основе базы знаний и конкурентов"""
     user_idea = message.text.strip()
-    await state.update_data(original_prompt=user_idea)
     
     # Проверяем наличие базы конкурентов
-    import os
-    import json
-    COMPETITORS_FILE = os.path.join("knowledge_base", "competitors.json")
-    
     has_competitors = False
     if os.path.exists(COMPETITORS_FILE):
         try:
@@ -150,8 +174,7 @@ async def process_prompt(message: Message, state: FSMContext):
                 user_prompt=user_idea,
                 platforms=VIDEO_PLATFORMS
             )
-            await state.update_data(prompt=enhanced)
-            await state.set_state(ShortVideoStates.selecting_aspect)
+            await transition(state, ShortVideoStates.selecting_aspect, prompt=enhanced, original_prompt=user_idea)
             
             # Показываем улучшенный промпт с информацией об источниках
             info_text = "✨ <b>Промпт улучшен!</b>\n\n"
@@ -168,8 +191,7 @@ async def process_prompt(message: Message, state: FSMContext):
             )
         except Exception as e:
             # Fallback на исходный промпт
-            await state.update_data(prompt=user_idea)
-            await state.set_state(ShortVideoStates.selecting_aspect)
+            await transition(state, ShortVideoStates.selecting_aspect, prompt=user_idea, original_prompt=user_idea)
             await message.answer(
                 f"⚠️ Не удалось улучшить промпт: {e}\n\n"
                 "Использую исходную идею. Выберите соотношение сторон:",
@@ -177,8 +199,7 @@ async def process_prompt(message: Message, state: FSMContext):
             )
     else:
         # Если OpenAI недоступен, используем исходный промпт
-        await state.update_data(prompt=user_idea)
-        await state.set_state(ShortVideoStates.selecting_aspect)
+        await transition(state, ShortVideoStates.selecting_aspect, prompt=user_idea, original_prompt=user_idea)
         await message.answer(
             "⚠️ OpenAI недоступен - промпт не будет улучшен.\n\n"
             "Выберите соотношение сторон:",
@@ -189,11 +210,9 @@ async def process_prompt(message: Message, state: FSMContext):
 async def process_image(message: Message, state: FSMContext):
     """Получение изображения"""
     photo = message.photo[-1]  # Берём максимальное разрешение
-    file = await message.bot.get_file(photo.file_id)
-    file_url = f"https://api.telegram.org/file/bot{message.bot.token}/{file.file_path}"
+    file_url = await file_upload_service.get_file_url(message.bot, photo.file_id)
     
-    await state.update_data(image_url=file_url)
-    await state.set_state(ShortVideoStates.waiting_prompt)
+    await transition(state, ShortVideoStates.waiting_prompt, image_url=file_url)
     
     await message.answer(
         "✅ Изображение получено!\n\n"
@@ -207,8 +226,7 @@ async def back_to_image_upload(callback: CallbackQuery, state: FSMContext):
     """Возврат к загрузке изображения"""
     await state.set_state(ShortVideoStates.waiting_image)
     await callback.message.edit_text(
-        "🖼 <b>Отправьте изображение</b>\n\n"
-        "Загрузите фото, которое нужно анимировать.",
+        IMAGE_TEXT,
         parse_mode="HTML",
         reply_markup=cancel_and_back_kb("back:mode")
     )
@@ -243,10 +261,10 @@ async def back_to_mode_from_aspect(callback: CallbackQuery, state: FSMContext):
         )
     await callback.answer()
 
-@router.callback_query(ShortVideoStates.selecting_aspect, F.data.startswith("aspect:"))
+@router.callback_query(ShortVideoStates.selecting_aspect, F.data.in_(ASPECT_TABLE))
 async def select_aspect_and_generate(callback: CallbackQuery, state: FSMContext):
     """Выбор соотношения сторон и запуск генерации"""
-    aspect = callback.data.split(":", 1)[1]  # "16:9" или "9:16"
+    aspect = ASPECT_TABLE[callback.data]
     data = await state.get_data()
     
     model = data["model"]
@@ -273,7 +291,8 @@ async def select_aspect_and_generate(callback: CallbackQuery, state: FSMContext)
                 prompt=prompt,
                 mode="image" if image_url else "text",
                 image_urls=[image_url] if image_url else None,
-                aspect_ratio=sora_aspect
+                aspect_ratio=sora_aspect,
+                callback_url=kie_callbacks.callback_url
             )
         else:
             # Veo 3.1
@@ -281,7 +300,8 @@ async def select_aspect_and_generate(callback: CallbackQuery, state: FSMContext)
                 prompt=prompt,
                 model=model,
                 image_urls=[image_url] if image_url else None,
-                aspect_ratio=aspect
+                aspect_ratio=aspect,
+                callback_url=kie_callbacks.callback_url
             )
         
         if result.get("code") != 200:
@@ -297,10 +317,9 @@ async def select_aspect_and_generate(callback: CallbackQuery, state: FSMContext)
             chat_id=callback.message.chat.id,
             user_id=callback.from_user.id,
             model=model,
-            created_at=datetime.now(),
             prompt=original_idea  # Сохраняем оригинальную идею для логирования
         )
-        task_tracker.add_task(video_task)
+        await task_tracker.add_task(video_task)
         
         model_name = {"sora2": "Sora 2", "veo3_fast": "Veo 3.1 Fast", "veo3": "Veo 3.1 Quality"}
         
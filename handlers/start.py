@@ -1,3 +1,4 @@
+import time
 from aiogram import Router, F
 from aiogram.types import Message, CallbackQuery
 from aiogram.filters import Command, CommandStart
@@ -9,6 +10,52 @@ from services.task_tracker import task_tracker
 
 router = Router()
 
+# ============ ТЕКСТЫ ============
+
+START_TEXT = (
+    "👋 Привет! Я бот для генерации контента.\n\n"
+    "📌 <b>Возможности:</b>\n"
+    "• 🎭 Видео с AI-аватаром (Kling Motion Control)\n"
+    "• 📝 SEO-статьи (ChatGPT)\n"
+    "• 🎬 Короткие видео (Sora 2 / Veo 3)\n"
+    "• 🖼 Карусели изображений\n"
+    "• 📅 Генерация контент-плана\n\n"
+)
+
+MAIN_MENU_TEXT = "📌 Главное меню\n\nВыберите действие:"
+
+CANCELLED_TEXT = "❌ Действие отменено.\n\nВыберите новое действие:"
+
+HELP_TEXT = (
+    "📖 <b>Справка по боту</b>\n\n"
+    "<b>Команды:</b>\n"
+    "/start — Перезапуск бота\n"
+    "/menu — Главное меню\n"
+    "/cancel — Отмена текущего действия\n"
+    "/status — Проверить активные задачи\n"
+    "/check &lt;task_id&gt; — Проверить статус задачи\n"
+    "/help — Эта справка\n\n"
+    "<b>Функции:</b>\n"
+    "🎭 <b>Видео с аватаром (Motion Control)</b>\n"
+    "   1. Получите сценарий\n"
+    "   2. Запишите видео (3-30 сек)\n"
+    "   3. Загрузите фото аватара\n"
+    "   4. Получите видео с движениями аватара + субтитры\n\n"
+    "📝 <b>SEO-статьи</b> — генерация оптимизированных статей\n\n"
+    "🎬 <b>Короткие видео</b> — генерация через Sora 2 / Veo 3.1\n\n"
+    "🖼 <b>Карусели</b> — генерация каруселей изображений\n\n"
+    "📅 <b>Контент-план</b> — генерация плана на основе базы знаний\n\n"
+    "📚 <b>База знаний</b> — файлы для персонализации контента"
+)
+
+STATUS_MODEL_NAMES = {
+    "sora2": "Sora 2",
+    "veo3_fast": "Veo 3.1 Fast",
+    "veo3": "Veo 3.1 Quality",
+    "kling_motion": "Kling Motion Control",
+    "nano_banana": "Nano Banana Pro"
+}
+
 @router.message(CommandStart())
 async def cmd_start(message: Message, state: FSMContext):
     """Команда /start"""
@@ -19,26 +66,13 @@ async def cmd_start(message: Message, state: FSMContext):
     if missing:
         warning = f"\n\n⚠️ Не настроены API: {', '.join(missing)}"
     
-    await message.answer(
-        f"👋 Привет! Я бот для генерации контента.\n\n"
-        f"📌 <b>Возможности:</b>\n"
-        f"• 🎭 Видео с AI-аватаром (Kling Motion Control)\n"
-        f"• 📝 SEO-статьи (ChatGPT)\n"
-        f"• 🎬 Короткие видео (Sora 2 / Veo 3)\n"
-        f"• 🖼 Карусели изображений\n"
-        f"• 📅 Генерация контент-плана\n\n"
-        f"{warning}",
-        reply_markup=main_menu_kb()
-    )
+    await message.answer(START_TEXT + warning, reply_markup=main_menu_kb())
 
 @router.message(Command("menu"))
 async def cmd_menu(message: Message, state: FSMContext):
     """Команда /menu"""
     await state.clear()
-    await message.answer(
-        "📌 Главное меню\n\nВыберите действие:",
-        reply_markup=main_menu_kb()
-    )
+    await message.answer(MAIN_MENU_TEXT, reply_markup=main_menu_kb())
 
 @router.message(Command("cancel"))
 async def cmd_cancel(message: Message, state: FSMContext):
@@ -47,10 +81,7 @@ async def cmd_cancel(message: Message, state: FSMContext):
     await state.clear()
     
     if current_state:
-        await message.answer(
-            "❌ Действие отменено.\n\nВыберите новое действие:",
-            reply_markup=main_menu_kb()
-        )
+        await message.answer(CANCELLED_TEXT, reply_markup=main_menu_kb())
     else:
         await message.answer(
             "Нечего отменять. Выберите действие:",
@@ -61,48 +92,20 @@ async def cmd_cancel(message: Message, state: FSMContext):
 async def callback_cancel(callback: CallbackQuery, state: FSMContext):
     """Обработка кнопки отмены"""
     await state.clear()
-    await callback.message.edit_text(
-        "❌ Действие отменено.\n\nВыберите новое действие:",
-        reply_markup=main_menu_kb()
-    )
+    await callback.message.edit_text(CANCELLED_TEXT, reply_markup=main_menu_kb())
     await callback.answer()
 
 @router.callback_query(F.data == "menu:main")
 async def callback_main_menu(callback: CallbackQuery, state: FSMContext):
     """Возврат в главное меню"""
     await state.clear()
-    await callback.message.edit_text(
-        "📌 Главное меню\n\nВыберите действие:",
-        reply_markup=main_menu_kb()
-    )
+    await callback.message.edit_text(MAIN_MENU_TEXT, reply_markup=main_menu_kb())
     await callback.answer()
 
 @router.message(Command("help"))
 async def cmd_help(message: Message):
     """Команда /help"""
-    await message.answer(
-        "📖 <b>Справка по боту</b>\n\n"
-        "<b>Команды:</b>\n"
-        "/start — Перезапуск бота\n"
-        "/menu — Главное меню\n"
-        "/cancel — Отмена текущего действия\n"
-        "/status — Проверить активные задачи\n"
-        "/check &lt;task_id&gt; — Проверить статус задачи\n"
-        "/help — Эта справка\n\n"
-        "<b>Функции:</b>\n"
-        "🎭 <b>Видео с аватаром (Motion Control)</b>\n"
-        "   1. Получите сценарий\n"
-        "   2. Запишите видео (3-30 сек)\n"
-        "   3. Загрузите фото аватара\n"
-        "   4. Получите видео с движениями аватара + субтитры\n\n"
-        "📝 <b>SEO-статьи</b> — генерация оптимизированных статей\n\n"
-        "🎬 <b>Короткие видео</b> — генерация через Sora 2 / Veo 3.1\n\n"
-        "🖼 <b>Карусели</b> — генерация каруселей изображений\n\n"
-        "📅 <b>Контент-план</b> — генерация плана на основе базы знаний\n\n"
-        "📚 <b>База знаний</b> — файлы для персонализации контента",
-        parse_mode="HTML",
-        reply_markup=back_to_menu_kb()
-    )
+    await message.answer(HELP_TEXT, parse_mode="HTML", reply_markup=back_to_menu_kb())
 
 @router.message(Command("status"))
 async def cmd_status(message: Message):
@@ -117,18 +120,10 @@ async def cmd_status(message: Message):
         return
     
     text = "📋 <b>Ваши активные задачи:</b>\n\n"
-    model_names = {
-        "sora2": "Sora 2", 
-        "veo3_fast": "Veo 3.1 Fast", 
-        "veo3": "Veo 3.1 Quality",
-        "kling_motion": "Kling Motion Control",
-        "nano_banana": "Nano Banana Pro"
-    }
-    
     for task in user_tasks:
-        elapsed = (message.date.replace(tzinfo=None) - task.created_at).total_seconds() / 60
+        elapsed = (time.time() - task.created_at) / 60
         text += (
-            f"🎬 {model_names.get(task.model, task.model)}\n"
+            f"🎬 {STATUS_MODEL_NAMES.get(task.model, task.model)}\n"
             f"🆔 <code>{task.task_id}</code>\n"
             f"⏱ {elapsed:.0f} мин назад\n\n"
         )
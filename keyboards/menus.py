@@ -1,6 +1,10 @@
+import functools
 from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton
 from aiogram.utils.keyboard import InlineKeyboardBuilder
 
+# Клавиатуры неизменяемы и зависят только от аргументов — каждая собирается один раз
+
+@functools.cache
 def main_menu_kb() -> InlineKeyboardMarkup:
     """Главное меню"""
     builder = InlineKeyboardBuilder()
@@ -20,6 +24,7 @@ def main_menu_kb() -> InlineKeyboardMarkup:
     )
     return builder.as_markup()
 
+@functools.cache
 def knowledge_base_kb(has_files: bool = False) -> InlineKeyboardMarkup:
     """Меню базы знаний с разделом конкурентов"""
     builder = InlineKeyboardBuilder()
@@ -30,16 +35,19 @@ def knowledge_base_kb(has_files: bool = False) -> InlineKeyboardMarkup:
     builder.row(InlineKeyboardButton(text="⬅️ Главное меню", callback_data="menu:main"))
     return builder.as_markup()
 
+@functools.cache
 def back_to_menu_kb() -> InlineKeyboardMarkup:
     return InlineKeyboardMarkup(inline_keyboard=[
         [InlineKeyboardButton(text="⬅️ Главное меню", callback_data="menu:main")]
     ])
 
+@functools.cache
 def cancel_kb() -> InlineKeyboardMarkup:
     return InlineKeyboardMarkup(inline_keyboard=[
         [InlineKeyboardButton(text="❌ Отмена", callback_data="cancel")]
     ])
 
+@functools.cache
 def cancel_and_back_kb(back_callback: str) -> InlineKeyboardMarkup:
     """Клавиатура с кнопками Назад и Отмена"""
     return InlineKeyboardMarkup(inline_keyboard=[
@@ -47,6 +55,7 @@ def cancel_and_back_kb(back_callback: str) -> InlineKeyboardMarkup:
         [InlineKeyboardButton(text="❌ Отмена", callback_data="cancel")]
     ])
 
+@functools.cache
 def confirm_edit_kb() -> InlineKeyboardMarkup:
     builder = InlineKeyboardBuilder()
     builder.row(
@@ -57,6 +66,7 @@ def confirm_edit_kb() -> InlineKeyboardMarkup:
     builder.row(InlineKeyboardButton(text="❌ Отмена", callback_data="cancel"))
     return builder.as_markup()
 
+@functools.cache
 def video_model_kb() -> InlineKeyboardMarkup:
     builder = InlineKeyboardBuilder()
     builder.row(InlineKeyboardButton(text="🎥 Sora 2", callback_data="model:sora2"))
@@ -67,6 +77,7 @@ def video_model_kb() -> InlineKeyboardMarkup:
     builder.row(InlineKeyboardButton(text="❌ Отмена", callback_data="cancel"))
     return builder.as_markup()
 
+@functools.cache
 def video_mode_kb() -> InlineKeyboardMarkup:
     builder = InlineKeyboardBuilder()
     builder.row(
@@ -77,6 +88,7 @@ def video_mode_kb() -> InlineKeyboardMarkup:
     builder.row(InlineKeyboardButton(text="❌ Отмена", callback_data="cancel"))
     return builder.as_markup()
 
+@functools.cache
 def aspect_ratio_kb() -> InlineKeyboardMarkup:
     builder = InlineKeyboardBuilder()
     builder.row(
@@ -1,3 +1,5 @@
 from .auth import AuthMiddleware
+from .rate_limit import RateLimitMiddleware
+from .throttling import ThrottlingMiddleware
 
-__all__ = ["AuthMiddleware"]
\ No newline at end of file
+__all__ = ["AuthMiddleware", "RateLimitMiddleware", "ThrottlingMiddleware"]
\ No newline at end of file
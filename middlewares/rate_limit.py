@@ -0,0 +1,104 @@
+import asyncio
+import logging
+import time
+from typing import Any
+from aiogram import Bot
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware, NextRequestMiddlewareType
+from aiogram.exceptions import TelegramRetryAfter
+from aiogram.methods import TelegramMethod
+from aiogram.methods.base import Response, TelegramType
+
+logger = logging.getLogger(__name__)
+
+class RateLimitMiddleware(BaseRequestMiddleware):
+    """
+    Request-middleware сессии бота: выравнивает исходящие сообщения под лимиты Telegram
+    
+    Каждый лимит — token bucket (GCRA): короткая пачка сообщений уходит сразу,
+    дальше темп ограничивается скоростью пополнения.
+    """
+    
+    def __init__(
+        self,
+        global_rate: float = 30,
+        chat_rate: float = 1,
+        group_rate: float = 20 / 60,
+        chat_burst: int = 3,
+        max_retries: int = 3,
+        max_entries: int = 10_000
+    ):
+        """
+        Args:
+            global_rate: Сообщений в секунду на весь бот (он же размер пачки)
+            chat_rate: Сообщений в секунду в личный чат
+            group_rate: Сообщений в секунду в группу
+            chat_burst: Сколько сообщений в один чат можно отправить подряд без паузы
+            max_retries: Сколько раз повторять запрос после 429 RetryAfter
+            max_entries: При превышении из таблицы чатов вычищаются неактивные
+        """
+        self.global_interval = 1 / global_rate
+        self.global_tolerance = (global_rate - 1) * self.global_interval
+        self.chat_interval = 1 / chat_rate
+        self.group_interval = 1 / group_rate
+        self.chat_burst = chat_burst
+        self.max_retries = max_retries
+        self.max_entries = max_entries
+        # Теоретическое время прибытия следующего сообщения (TAT) для бота и для каждого чата
+        self._global_tat = 0.0
+        self._chat_tat: dict[Any, float] = {}
+    
+    def _chat_interval(self, chat_id: Any) -> float:
+        """У групп (отрицательный id) лимит строже, чем у личных чатов"""
+        if isinstance(chat_id, int) and chat_id < 0:
+            return self.group_interval
+        return self.chat_interval
+    
+    def _reserve_chat(self, chat_id: Any) -> float:
+        """Резервирует ближайший разрешённый момент отправки в чат и возвращает, сколько до него ждать"""
+        now = time.monotonic()
+        interval = self._chat_interval(chat_id)
+        tat = self._chat_tat.get(chat_id, 0.0)
+        
+        slot = max(now, tat - (self.chat_burst - 1) * interval)
+        self._chat_tat[chat_id] = max(tat, slot) + interval
+        
+        if len(self._chat_tat) > self.max_entries:
+            self._chat_tat = {k: t for k, t in self._chat_tat.items() if t > now}
+        
+        return slot - now
+    
+    def _reserve_global(self) -> float:
+        """
+        То же для общего лимита бота; берётся только когда подошла очередь чата,
+        чтобы ожидание одного чата не занимало общую полосу остальных
+        """
+        now = time.monotonic()
+        slot = max(now, self._global_tat - self.global_tolerance)
+        self._global_tat = max(self._global_tat, slot) + self.global_interval
+        return slot - now
+    
+    async def __call__(
+        self,
+        make_request: NextRequestMiddlewareType[TelegramType],
+        bot: Bot,
+        method: TelegramMethod[TelegramType]
+    ) -> Response[TelegramType]:
+        # Лимиты Telegram касаются сообщений в чаты; getUpdates, getFile, answerCallbackQuery идут без очереди
+        chat_id = getattr(method, "chat_id", None)
+        if chat_id is None:
+            return await make_request(bot, method)
+        
+        for attempt in range(self.max_retries + 1):
+            delay = self._reserve_chat(chat_id)
+            if delay > 0:
+                await asyncio.sleep(delay)
+            delay = self._reserve_global()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            try:
+                return await make_request(bot, method)
+            except TelegramRetryAfter as e:
+                if attempt == self.max_retries:
+                    raise
+                logger.warning(f"Flood control в чате {chat_id}: ждём {e.retry_after} с")
+                await asyncio.sleep(e.retry_after)
\ No newline at end of file
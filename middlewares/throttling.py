@@ -0,0 +1,37 @@
+import time
+from typing import Callable, Dict, Any, Awaitable
+from aiogram import BaseMiddleware
+from aiogram.types import CallbackQuery
+
+class ThrottlingMiddleware(BaseMiddleware):
+    """Middleware, отбрасывающий повторное нажатие той же кнопки тем же пользователем"""
+    
+    def __init__(self, window: float = 1.5, max_entries: int = 100_000):
+        """
+        Args:
+            window: Сколько секунд повторное нажатие считается дублем
+            max_entries: При превышении из таблицы вычищаются устаревшие записи
+        """
+        self.window = window
+        self.max_entries = max_entries
+        self._last_seen: dict[tuple[int, str], float] = {}
+    
+    async def __call__(
+        self,
+        handler: Callable[[CallbackQuery, Dict[str, Any]], Awaitable[Any]],
+        event: CallbackQuery,
+        data: Dict[str, Any]
+    ) -> Any:
+        key = (event.from_user.id, event.data or "")
+        now = time.monotonic()
+        
+        # Двойной тап: второй вызов дорогих API (OpenAI, Kie.ai) не запускаем
+        if now - self._last_seen.get(key, 0.0) < self.window:
+            await event.answer("⏳")
+            return
+        
+        self._last_seen[key] = now
+        if len(self._last_seen) > self.max_entries:
+            self._last_seen = {k: t for k, t in self._last_seen.items() if now - t < self.window}
+        
+        return await handler(event, data)
\ No newline at end of file
@@ -8,6 +8,8 @@ from .content_plan_service import content_plan_service
 from .task_tracker import task_tracker
 from .file_upload_service import file_upload_service
 from .subtitles_service import subtitles_service
+from .http_client import http_client
+from .kie_callbacks import kie_callbacks
 
 __all__ = [
     "openai_service",
@@ -19,5 +21,7 @@ __all__ = [
     "content_plan_service",
     "task_tracker",
     "file_upload_service",
-    "subtitles_service"
+    "subtitles_service",
+    "http_client",
+    "kie_callbacks"
 ]
\ No newline at end of file
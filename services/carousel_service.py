@@ -2,15 +2,19 @@ import asyncio
 import json
 import os
 import tempfile
-import subprocess
 import logging
 from typing import Optional
 from dataclasses import dataclass
 from config import config
 from services.openai_service import openai_service
+from utils.ffmpeg import communicate_or_kill, ffmpeg_available, ffmpeg_slots
+from utils.files import read_file, remove_files
 
 logger = logging.getLogger(__name__)
 
+# Предел на отрисовку одного слайда FFmpeg'ом, сек
+FFMPEG_RENDER_TIMEOUT = 60
+
 @dataclass
 class CarouselSlide:
     slide_number: int
@@ -95,15 +99,7 @@ class CarouselService:
         pass
     
     def is_available(self) -> bool:
-        return openai_service.is_available() and self._check_ffmpeg()
-    
-    def _check_ffmpeg(self) -> bool:
-        """Проверяет доступность FFmpeg"""
-        try:
-            subprocess.run(["ffmpeg", "-version"], capture_output=True, check=True)
-            return True
-        except (subprocess.CalledProcessError, FileNotFoundError):
-            return False
+        return openai_service.is_available() and ffmpeg_available()
     
     def _truncate_text(self, text: str, max_chars: int) -> str:
         """Обрезает текст до максимального количества символов"""
@@ -349,28 +345,24 @@ class CarouselService:
                 output_path
             ]
             
-            process = await asyncio.create_subprocess_exec(
-                *cmd,
-                stdout=asyncio.subprocess.PIPE,
-                stderr=asyncio.subprocess.PIPE
-            )
-            
-            stdout, stderr = await process.communicate()
+            async with ffmpeg_slots:
+                process = await asyncio.create_subprocess_exec(
+                    *cmd,
+                    stdout=asyncio.subprocess.PIPE,
+                    stderr=asyncio.subprocess.PIPE
+                )
+                
+                stdout, stderr = await communicate_or_kill(process, FFMPEG_RENDER_TIMEOUT)
             
             if process.returncode != 0:
                 error_msg = stderr.decode()[:1000]
                 raise Exception(f"FFmpeg error: {error_msg}")
             
-            # Читаем результат
-            with open(output_path, 'rb') as f:
-                return f.read()
+            # Читаем результат (в потоке — не блокируя event loop)
+            return await asyncio.to_thread(read_file, output_path)
         
         finally:
-            if os.path.exists(output_path):
-                try:
-                    os.unlink(output_path)
-                except:
-                    pass
+            await asyncio.to_thread(remove_files, output_path)
     
     async def generate_carousel_images(
         self,
@@ -1,4 +1,5 @@
 import json
+from datetime import datetime
 from typing import Optional
 from dataclasses import dataclass, asdict
 from services.openai_service import openai_service
@@ -201,7 +202,6 @@ class ContentPlanService:
                     inspiration_source=item.get("inspiration_source", "")
                 ))
             
-            from datetime import datetime
             return ContentPlan(
                 topic=niche,
                 period=period,
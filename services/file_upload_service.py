@@ -1,10 +1,24 @@
+import asyncio
 import aiohttp
 import base64
 import tempfile
 import os
-from typing import Optional
+import time
+from typing import Optional, AsyncIterable, Union
 from aiogram import Bot
 
+from config import config
+from services.http_client import http_client
+
+# Telegram гарантирует работу ссылки на файл не меньше часа — держим чуть меньше
+FILE_PATH_TTL = 3300
+FILE_PATH_CACHE_SIZE = 10_000
+# Размер куска при потоковой перекачке Telegram -> хостинг
+STREAM_CHUNK_SIZE = 512 * 1024
+# tmpfiles.org хранит файл час — повторно отправленный файл берём из кэша чуть меньше
+HOSTED_URL_TTL = 3000
+HOSTED_URL_CACHE_SIZE = 10_000
+
 class FileUploadService:
     """Сервис для загрузки файлов на внешний хостинг"""
     
@@ -15,60 +29,76 @@ class FileUploadService:
             self._upload_to_tmpfiles,
             self._upload_to_fileio,
         ]
+        # file_id -> (истекает, URL для скачивания)
+        self._file_urls: dict[str, tuple[float, str]] = {}
+        # file_unique_id -> (истекает, публичный URL на хостинге)
+        self._hosted_urls: dict[str, tuple[float, str]] = {}
+        self._upload_slots = asyncio.Semaphore(config.UPLOAD_CONCURRENCY)
+    
+    async def get_file_url(self, bot: Bot, file_id: str) -> str:
+        """URL файла Telegram; getFile вызывается только при промахе кэша"""
+        now = time.monotonic()
+        cached = self._file_urls.get(file_id)
+        if cached and cached[0] > now:
+            return cached[1]
+        
+        file = await bot.get_file(file_id)
+        url = f"https://api.telegram.org/file/bot{bot.token}/{file.file_path}"
+        
+        if len(self._file_urls) >= FILE_PATH_CACHE_SIZE:
+            # Словарь упорядочен по вставке — выбрасываем самую старую запись
+            self._file_urls.pop(next(iter(self._file_urls)))
+        self._file_urls[file_id] = (now + FILE_PATH_TTL, url)
+        return url
     
     async def download_telegram_file(self, bot: Bot, file_id: str) -> bytes:
         """Скачивает файл из Telegram"""
-        file = await bot.get_file(file_id)
-        file_path = file.file_path
+        url = await self.get_file_url(bot, file_id)
         
         # Скачиваем файл
-        async with aiohttp.ClientSession() as session:
-            url = f"https://api.telegram.org/file/bot{bot.token}/{file_path}"
-            async with session.get(url) as resp:
-                if resp.status != 200:
-                    raise Exception(f"Failed to download file: {resp.status}")
-                return await resp.read()
+        async with http_client.session.get(url, timeout=aiohttp.ClientTimeout(total=300)) as resp:
+            if resp.status != 200:
+                raise Exception(f"Failed to download file: {resp.status}")
+            return await resp.read()
     
-    async def _upload_to_tmpfiles(self, file_content: bytes, filename: str) -> Optional[str]:
-        """Загрузка на tmpfiles.org (хранится 1 час)"""
+    async def _upload_to_tmpfiles(self, file_content: Union[bytes, AsyncIterable[bytes]], filename: str) -> Optional[str]:
+        """Загрузка на tmpfiles.org (хранится 1 час); принимает байты или поток кусков"""
         try:
-            async with aiohttp.ClientSession() as session:
-                data = aiohttp.FormData()
-                data.add_field('file', file_content, filename=filename)
-                
-                async with session.post(
-                    'https://tmpfiles.org/api/v1/upload',
-                    data=data,
-                    timeout=aiohttp.ClientTimeout(total=60)
-                ) as resp:
-                    if resp.status == 200:
-                        result = await resp.json()
-                        url = result.get('data', {}).get('url', '')
-                        # Преобразуем URL для прямого доступа
-                        if url:
-                            # tmpfiles.org/123/file.jpg -> tmpfiles.org/dl/123/file.jpg
-                            url = url.replace('tmpfiles.org/', 'tmpfiles.org/dl/')
-                            return url
+            data = aiohttp.FormData()
+            data.add_field('file', file_content, filename=filename)
+            
+            async with http_client.session.post(
+                'https://tmpfiles.org/api/v1/upload',
+                data=data,
+                timeout=aiohttp.ClientTimeout(total=60)
+            ) as resp:
+                if resp.status == 200:
+                    result = await resp.json()
+                    url = result.get('data', {}).get('url', '')
+                    # Преобразуем URL для прямого доступа
+                    if url:
+                        # tmpfiles.org/123/file.jpg -> tmpfiles.org/dl/123/file.jpg
+                        url = url.replace('tmpfiles.org/', 'tmpfiles.org/dl/')
+                        return url
         except Exception as e:
             print(f"tmpfiles upload error: {e}")
         return None
     
-    async def _upload_to_fileio(self, file_content: bytes, filename: str) -> Optional[str]:
-        """Загрузка на file.io (одноразовая ссылка)"""
+    async def _upload_to_fileio(self, file_content: Union[bytes, AsyncIterable[bytes]], filename: str) -> Optional[str]:
+        """Загрузка на file.io (одноразовая ссылка); принимает байты или поток кусков"""
         try:
-            async with aiohttp.ClientSession() as session:
-                data = aiohttp.FormData()
-                data.add_field('file', file_content, filename=filename)
-                
-                async with session.post(
-                    'https://file.io',
-                    data=data,
-                    timeout=aiohttp.ClientTimeout(total=60)
-                ) as resp:
-                    if resp.status == 200:
-                        result = await resp.json()
-                        if result.get('success'):
-                            return result.get('link')
+            data = aiohttp.FormData()
+            data.add_field('file', file_content, filename=filename)
+            
+            async with http_client.session.post(
+                'https://file.io',
+                data=data,
+                timeout=aiohttp.ClientTimeout(total=60)
+            ) as resp:
+                if resp.status == 200:
+                    result = await resp.json()
+                    if result.get('success'):
+                        return result.get('link')
         except Exception as e:
             print(f"file.io upload error: {e}")
         return None
@@ -82,9 +112,56 @@ class FileUploadService:
         
         raise Exception("Не удалось загрузить файл ни на один хостинг")
     
-    async def upload_telegram_file(self, bot: Bot, file_id: str, filename: str) -> str:
-        """Скачивает файл из Telegram и загружает на хостинг"""
-        file_content = await self.download_telegram_file(bot, file_id)
-        return await self.upload_file(file_content, filename)
+    async def upload_telegram_file(
+        self,
+        bot: Bot,
+        file_id: str,
+        filename: str,
+        unique_id: Optional[str] = None
+    ) -> str:
+        """
+        Перекачивает файл из Telegram на хостинг
+        
+        Тело ответа Telegram передаётся в multipart-загрузку кусками по STREAM_CHUNK_SIZE,
+        так что видео не собирается целиком в памяти. Если хостинг не принял файл —
+        поток из Telegram открывается заново и так же кусками идёт на следующий.
+        
+        unique_id — file_unique_id из Telegram: тот же файл, отправленный повторно
+        (новый аватар к тому же видео, повтор после ошибки), не перекачивается заново.
+        """
+        now = time.monotonic()
+        cached = self._hosted_urls.get(unique_id) if unique_id else None
+        if cached and cached[0] > now:
+            return cached[1]
+        
+        # Не больше UPLOAD_CONCURRENCY перекачек одновременно: остальные ждут в очереди,
+        # а не делят канал и TLS между сотней параллельных потоков
+        async with self._upload_slots:
+            hosted_url, reusable = await self._transfer_telegram_file(bot, file_id, filename)
+        
+        if unique_id and reusable:
+            if len(self._hosted_urls) >= HOSTED_URL_CACHE_SIZE:
+                self._hosted_urls.pop(next(iter(self._hosted_urls)))
+            self._hosted_urls[unique_id] = (now + HOSTED_URL_TTL, hosted_url)
+        return hosted_url
+    
+    async def _transfer_telegram_file(self, bot: Bot, file_id: str, filename: str) -> tuple[str, bool]:
+        """(URL на хостинге, можно ли отдавать его повторно) — ссылки file.io одноразовые"""
+        for upload_fn in self.upload_services:
+            try:
+                url = await self.get_file_url(bot, file_id)
+                async with http_client.session.get(url, timeout=aiohttp.ClientTimeout(total=300)) as resp:
+                    if resp.status != 200:
+                        # Ссылка из кэша могла протухнуть — следующая попытка запросит getFile заново,
+                        # а не скачает по той же мёртвой ссылке второй раз
+                        self._file_urls.pop(file_id, None)
+                        raise Exception(f"Failed to download file: {resp.status}")
+                    hosted_url = await upload_fn(resp.content.iter_chunked(STREAM_CHUNK_SIZE), filename)
+                if hosted_url:
+                    return hosted_url, upload_fn == self._upload_to_tmpfiles
+            except Exception as e:
+                print(f"streamed upload error: {e}")
+        
+        raise Exception("Не удалось загрузить файл ни на один хостинг")
 
 file_upload_service = FileUploadService()
@@ -25,22 +25,39 @@ class GoogleOAuth:
         self.credentials_file = credentials_file
         self.token_file = token_file
         self.creds: Optional[Credentials] = None
+        # (mtime, размер) файла токена, из которого загружены creds
+        self._token_signature: Optional[tuple[int, int]] = None
     
     def is_configured(self) -> bool:
         """Проверяет наличие credentials.json"""
         return os.path.exists(self.credentials_file)
     
+    def _read_token_signature(self) -> Optional[tuple[int, int]]:
+        try:
+            st = os.stat(self.token_file)
+        except OSError:
+            return None
+        return (st.st_mtime_ns, st.st_size)
+    
     def is_authorized(self) -> bool:
-        """Проверяет наличие валидного токена"""
-        if not os.path.exists(self.token_file):
-            return False
+        """
+        Проверяет наличие валидного токена
         
-        try:
-            with open(self.token_file, 'rb') as token:
-                self.creds = pickle.load(token)
-            return self.creds and self.creds.valid
-        except:
+        Файл токена распаковывается заново только если он изменился с прошлой загрузки;
+        иначе проверяется срок действия уже загруженных creds.
+        """
+        signature = self._read_token_signature()
+        if signature is None:
             return False
+        
+        if signature != self._token_signature:
+            try:
+                with open(self.token_file, 'rb') as token:
+                    self.creds = pickle.load(token)
+            except:
+                return False
+            self._token_signature = signature
+        return bool(self.creds and self.creds.valid)
     
     async def refresh_token(self) -> bool:
         """Обновляет токен если он истёк"""
@@ -114,6 +131,8 @@ class GoogleOAuth:
         """Сохраняет токен в файл"""
         with open(self.token_file, 'wb') as token:
             pickle.dump(self.creds, token)
+        # Свежие creds уже в памяти — перечитывать только что записанный файл незачем
+        self._token_signature = self._read_token_signature()
     
     def get_credentials(self) -> Optional[Credentials]:
         """Возвращает credentials для использования в API"""
@@ -129,6 +148,7 @@ class GoogleOAuth:
                 os.remove(self.token_file)
             
             self.creds = None
+            self._token_signature = None
             return True
         except Exception as e:
             print(f"Revoke error: {e}")
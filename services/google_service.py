@@ -11,6 +11,7 @@ from googleapiclient.http import MediaIoBaseUpload
 
 from config import config
 from services.google_oauth import google_oauth
+from services.http_client import http_client
 
 @dataclass
 class UploadResult:
@@ -129,11 +130,10 @@ class GoogleService:
     ) -> UploadResult:
         """Скачивает файл по URL и загружает на Drive"""
         try:
-            async with aiohttp.ClientSession() as session:
-                async with session.get(url, timeout=aiohttp.ClientTimeout(total=300)) as resp:
-                    if resp.status != 200:
-                        return UploadResult(success=False, error=f"Download failed: {resp.status}")
-                    content = await resp.read()
+            async with http_client.session.get(url, timeout=aiohttp.ClientTimeout(total=300)) as resp:
+                if resp.status != 200:
+                    return UploadResult(success=False, error=f"Download failed: {resp.status}")
+                content = await resp.read()
             
             return await self.upload_file_to_drive(content, file_name, mime_type, folder_id=folder_id)
         except Exception as e:
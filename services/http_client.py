@@ -0,0 +1,65 @@
+import asyncio
+import logging
+import aiohttp
+from typing import Optional
+
+from config import config
+
+logger = logging.getLogger(__name__)
+
+class HttpClient:
+    """Общая aiohttp-сессия для всех сервисов: keep-alive и пул соединений вместо сессии на каждый запрос"""
+    
+    def __init__(self):
+        self._session: Optional[aiohttp.ClientSession] = None
+    
+    def open(self) -> aiohttp.ClientSession:
+        """Создаёт сессию с пулом соединений (вызывается при старте бота)"""
+        if self._session is None or self._session.closed:
+            connector = aiohttp.TCPConnector(
+                limit=100,
+                limit_per_host=20,
+                ttl_dns_cache=300,
+                keepalive_timeout=75,
+                enable_cleanup_closed=True
+            )
+            # Общий таймаут по умолчанию; скачивания крупных файлов задают свой
+            self._session = aiohttp.ClientSession(
+                connector=connector,
+                timeout=aiohttp.ClientTimeout(total=60)
+            )
+        return self._session
+    
+    async def start(self):
+        """Хук запуска диспетчера: сессия готова до первого апдейта"""
+        self.open()
+        if config.KIEAI_API_KEY:
+            await self.warm_up(config.KIEAI_BASE_URL)
+    
+    async def warm_up(self, *urls: str):
+        """
+        Заранее открывает соединения к API, чтобы первый запрос не платил за TCP+TLS
+        
+        Ответ не важен: соединение остаётся в пуле keep-alive, ошибки только логируются.
+        """
+        async def touch(url: str):
+            async with self.session.head(url, timeout=aiohttp.ClientTimeout(total=5)) as resp:
+                await resp.release()
+        
+        results = await asyncio.gather(*(touch(url) for url in urls), return_exceptions=True)
+        for url, result in zip(urls, results):
+            if isinstance(result, Exception):
+                logger.warning(f"HTTP warm-up failed for {url}: {result}")
+    
+    @property
+    def session(self) -> aiohttp.ClientSession:
+        """Текущая сессия (создаётся лениво, если бот её ещё не открыл)"""
+        return self.open()
+    
+    async def close(self):
+        """Закрывает сессию и все соединения пула"""
+        if self._session and not self._session.closed:
+            await self._session.close()
+        self._session = None
+
+http_client = HttpClient()
\ No newline at end of file
@@ -0,0 +1,112 @@
+import asyncio
+import logging
+from collections import OrderedDict
+from typing import Optional
+from aiohttp import web
+from config import config
+
+# orjson быстрее разбирает колбэки Kie.ai; без него — стандартный json
+try:
+    from orjson import loads as json_loads
+except ImportError:
+    from json import loads as json_loads
+
+logger = logging.getLogger(__name__)
+
+# Сколько непрочитанных сигналов колбэков держать (например, пришедших между проходами трекера)
+PENDING_SIGNALS_SIZE = 1000
+
+class KieCallbacks:
+    """
+    Приём колбэков Kie.ai: ожидающая корутина просыпается сразу, без очередного опроса
+    
+    Тело колбэка не используется как результат — это лишь сигнал, сам статус
+    всегда читается запросом к Kie.ai. Так поддельный POST может разве что
+    разбудить опрос раньше времени, но не подменить результат.
+    """
+    
+    def __init__(self):
+        self._events: dict[str, asyncio.Event] = {}
+        self._signals: OrderedDict[str, None] = OrderedDict()
+        # Взводится на любой колбэк — будит фоновый опрос трекера задач
+        self._arrived = asyncio.Event()
+    
+    @property
+    def enabled(self) -> bool:
+        """Колбэки принимаются только по секретному пути: без WEBHOOK_SECRET маршрут не подключается"""
+        return bool(config.CALLBACK_BASE_URL and config.WEBHOOK_SECRET)
+    
+    @property
+    def path(self) -> str:
+        """Путь обработчика на webhook-сервере бота (секрет в пути отсекает чужие запросы)"""
+        return f"/kie/callback/{config.WEBHOOK_SECRET}"
+    
+    @property
+    def callback_url(self) -> Optional[str]:
+        """callBackUrl для задач Kie.ai; None без публичного адреса или секрета — тогда только опрос"""
+        if not self.enabled:
+            return None
+        return f"{config.CALLBACK_BASE_URL}{self.path}"
+    
+    def register(self, app: web.Application):
+        """Подключает обработчик к aiohttp-приложению webhook-сервера"""
+        if not self.enabled:
+            logger.warning("WEBHOOK_SECRET не задан: колбэки Kie.ai отключены, статусы только опросом")
+            return
+        app.router.add_post(self.path, self.handle)
+    
+    async def handle(self, request: web.Request) -> web.Response:
+        """Колбэк приходит в том же формате, что и ответ recordInfo: {code, data: {taskId, state, resultJson}}"""
+        try:
+            payload = await request.json(loads=json_loads)
+            task_id = payload["data"]["taskId"]
+        except Exception as e:
+            logger.warning(f"Некорректный колбэк Kie.ai: {e}")
+            return web.json_response({"ok": False}, status=400)
+        
+        self._signals[task_id] = None
+        if len(self._signals) > PENDING_SIGNALS_SIZE:
+            self._signals.popitem(last=False)
+        # Будим только тех, кто уже ждёт: поздний или чужой колбэк событий не создаёт
+        event = self._events.get(task_id)
+        if event:
+            event.set()
+        self._arrived.set()
+        return web.json_response({"ok": True})
+    
+    def pop_signal(self, task_id: str) -> bool:
+        """Забирает сигнал колбэка задачи; True если он приходил"""
+        if task_id not in self._signals:
+            return False
+        del self._signals[task_id]
+        return True
+    
+    def watch(self, task_id: str):
+        """Начинает ждать колбэк задачи — пришедший до первого wait() не потеряется"""
+        self._events.setdefault(task_id, asyncio.Event())
+    
+    async def wait(self, task_id: str, timeout: float) -> bool:
+        """Ждёт колбэк не дольше timeout секунд; True если он пришёл"""
+        event = self._events.setdefault(task_id, asyncio.Event())
+        try:
+            await asyncio.wait_for(event.wait(), timeout)
+        except asyncio.TimeoutError:
+            return False
+        event.clear()
+        return True
+    
+    async def wait_any(self, timeout: float) -> bool:
+        """Ждёт колбэк по любой задаче не дольше timeout секунд; True если он пришёл"""
+        try:
+            await asyncio.wait_for(self._arrived.wait(), timeout)
+        except asyncio.TimeoutError:
+            return False
+        self._arrived.clear()
+        return True
+    
+    def forget(self, task_id: str):
+        """Снимает ожидание задачи"""
+        self._events.pop(task_id, None)
+        self._signals.pop(task_id, None)
+
+kie_callbacks = KieCallbacks()
\ No newline at end of file
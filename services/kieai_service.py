@@ -1,6 +1,12 @@
-import aiohttp
 from typing import Optional, Literal
 from config import config
+from services.http_client import http_client
+
+# orjson быстрее разбирает ответы Kie.ai; без него — стандартный json
+try:
+    from orjson import loads as json_loads
+except ImportError:
+    from json import loads as json_loads
 
 class KieAIService:
     """Сервис для работы с Sora2, Veo3, 4o Image и Nano Banana через kie.ai"""
@@ -49,13 +55,12 @@ class KieAIService:
         if callback_url:
             payload["callBackUrl"] = callback_url
         
-        async with aiohttp.ClientSession() as session:
-            async with session.post(
-                f"{self.base_url}/api/v1/jobs/createTask",
-                headers=self._headers(),
-                json=payload
-            ) as resp:
-                return await resp.json()
+        async with http_client.session.post(
+            f"{self.base_url}/api/v1/jobs/createTask",
+            headers=self._headers(),
+            json=payload
+        ) as resp:
+            return await resp.json(loads=json_loads)
     
     async def generate_veo3_video(
         self,
@@ -88,39 +93,36 @@ class KieAIService:
         if callback_url:
             payload["callBackUrl"] = callback_url
         
-        async with aiohttp.ClientSession() as session:
-            async with session.post(
-                f"{self.base_url}/api/v1/veo/generate",
-                headers=self._headers(),
-                json=payload
-            ) as resp:
-                return await resp.json()
+        async with http_client.session.post(
+            f"{self.base_url}/api/v1/veo/generate",
+            headers=self._headers(),
+            json=payload
+        ) as resp:
+            return await resp.json(loads=json_loads)
     
     async def get_task_status(self, task_id: str) -> dict:
         """Статус задачи Sora2/Nano Banana (unified endpoint)"""
         if not self.is_available():
             raise RuntimeError("Kie.ai API недоступен")
         
-        async with aiohttp.ClientSession() as session:
-            async with session.get(
-                f"{self.base_url}/api/v1/jobs/recordInfo",
-                headers=self._headers(),
-                params={"taskId": task_id}
-            ) as resp:
-                return await resp.json()
+        async with http_client.session.get(
+            f"{self.base_url}/api/v1/jobs/recordInfo",
+            headers=self._headers(),
+            params={"taskId": task_id}
+        ) as resp:
+            return await resp.json(loads=json_loads)
     
     async def get_veo_status(self, task_id: str) -> dict:
         """Статус задачи Veo3"""
         if not self.is_available():
             raise RuntimeError("Kie.ai API недоступен")
         
-        async with aiohttp.ClientSession() as session:
-            async with session.get(
-                f"{self.base_url}/api/v1/veo/record-info",
-                headers=self._headers(),
-                params={"taskId": task_id}
-            ) as resp:
-                return await resp.json()
+        async with http_client.session.get(
+            f"{self.base_url}/api/v1/veo/record-info",
+            headers=self._headers(),
+            params={"taskId": task_id}
+        ) as resp:
+            return await resp.json(loads=json_loads)
     
     async def generate_nano_banana_image(
         self,
@@ -145,13 +147,12 @@ class KieAIService:
         if callback_url:
             payload["callBackUrl"] = callback_url
         
-        async with aiohttp.ClientSession() as session:
-            async with session.post(
-                f"{self.base_url}/api/v1/jobs/createTask",
-                headers=self._headers(),
-                json=payload
-            ) as resp:
-                return await resp.json()
+        async with http_client.session.post(
+            f"{self.base_url}/api/v1/jobs/createTask",
+            headers=self._headers(),
+            json=payload
+        ) as resp:
+            return await resp.json(loads=json_loads)
     
     async def generate_nano_banana_pro_image(
         self,
@@ -193,13 +194,12 @@ class KieAIService:
         if callback_url:
             payload["callBackUrl"] = callback_url
         
-        async with aiohttp.ClientSession() as session:
-            async with session.post(
-                f"{self.base_url}/api/v1/jobs/createTask",
-                headers=self._headers(),
-                json=payload
-            ) as resp:
-                return await resp.json()
+        async with http_client.session.post(
+            f"{self.base_url}/api/v1/jobs/createTask",
+            headers=self._headers(),
+            json=payload
+        ) as resp:
+            return await resp.json(loads=json_loads)
     
     async def generate_nano_banana_edit(
         self,
@@ -238,13 +238,12 @@ class KieAIService:
         if callback_url:
             payload["callBackUrl"] = callback_url
         
-        async with aiohttp.ClientSession() as session:
-            async with session.post(
-                f"{self.base_url}/api/v1/jobs/createTask",
-                headers=self._headers(),
-                json=payload
-            ) as resp:
-                return await resp.json()
+        async with http_client.session.post(
+            f"{self.base_url}/api/v1/jobs/createTask",
+            headers=self._headers(),
+            json=payload
+        ) as resp:
+            return await resp.json(loads=json_loads)
     
     async def generate_4o_image(
         self,
@@ -296,26 +295,24 @@ class KieAIService:
             payload["enableFallback"] = True
             payload["fallbackModel"] = "FLUX_MAX"
         
-        async with aiohttp.ClientSession() as session:
-            async with session.post(
-                f"{self.base_url}/api/v1/gpt4o-image/generate",
-                headers=self._headers(),
-                json=payload
-            ) as resp:
-                return await resp.json()
+        async with http_client.session.post(
+            f"{self.base_url}/api/v1/gpt4o-image/generate",
+            headers=self._headers(),
+            json=payload
+        ) as resp:
+            return await resp.json(loads=json_loads)
     
     async def get_4o_image_status(self, task_id: str) -> dict:
         """Статус задачи 4o Image API"""
         if not self.is_available():
             raise RuntimeError("Kie.ai API недоступен")
         
-        async with aiohttp.ClientSession() as session:
-            async with session.get(
-                f"{self.base_url}/api/v1/gpt4o-image/record-info",
-                headers=self._headers(),
-                params={"taskId": task_id}
-            ) as resp:
-                return await resp.json()
+        async with http_client.session.get(
+            f"{self.base_url}/api/v1/gpt4o-image/record-info",
+            headers=self._headers(),
+            params={"taskId": task_id}
+        ) as resp:
+            return await resp.json(loads=json_loads)
     
     async def get_4o_image_download_url(self, task_id: str, image_url: str) -> dict:
         """Получает прямую ссылку для скачивания 4o Image (действует 20 минут)"""
@@ -327,12 +324,11 @@ class KieAIService:
             "url": image_url
         }
         
-        async with aiohttp.ClientSession() as session:
-            async with session.post(
-                f"{self.base_url}/api/v1/gpt4o-image/download-url",
-                headers=self._headers(),
-                json=payload
-            ) as resp:
-                return await resp.json()
+        async with http_client.session.post(
+            f"{self.base_url}/api/v1/gpt4o-image/download-url",
+            headers=self._headers(),
+            json=payload
+        ) as resp:
+            return await resp.json(loads=json_loads)
 
 kieai_service = KieAIService()
\ No newline at end of file
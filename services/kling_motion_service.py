@@ -1,9 +1,15 @@
 import aiohttp
 import asyncio
-import json
 from typing import Optional
 from dataclasses import dataclass
 from config import config
+from services.http_client import http_client
+
+# orjson быстрее разбирает resultJson; без него — стандартный json
+try:
+    from orjson import loads as json_loads
+except ImportError:
+    from json import loads as json_loads
 
 @dataclass
 class MotionTask:
@@ -71,28 +77,26 @@ class KlingMotionService:
         if callback_url:
             payload["callBackUrl"] = callback_url
         
-        async with aiohttp.ClientSession() as session:
-            async with session.post(
-                f"{self.base_url}/api/v1/jobs/createTask",
-                headers=self._headers(),
-                json=payload,
-                timeout=aiohttp.ClientTimeout(total=60)
-            ) as resp:
-                result = await resp.json()
-                return result
+        async with http_client.session.post(
+            f"{self.base_url}/api/v1/jobs/createTask",
+            headers=self._headers(),
+            json=payload,
+            timeout=aiohttp.ClientTimeout(total=60)
+        ) as resp:
+            result = await resp.json(loads=json_loads)
+            return result
     
     async def get_task_status(self, task_id: str) -> dict:
         """Проверяет статус задачи через unified endpoint"""
         if not self.is_available():
             raise RuntimeError("Kie.ai API недоступен")
         
-        async with aiohttp.ClientSession() as session:
-            async with session.get(
-                f"{self.base_url}/api/v1/jobs/recordInfo",
-                headers=self._headers(),
-                params={"taskId": task_id}
-            ) as resp:
-                return await resp.json()
+        async with http_client.session.get(
+            f"{self.base_url}/api/v1/jobs/recordInfo",
+            headers=self._headers(),
+            params={"taskId": task_id}
+        ) as resp:
+            return await resp.json(loads=json_loads)
     
     async def wait_for_result(
         self,
@@ -118,8 +122,8 @@ class KlingMotionService:
                 result_json = data.get("resultJson", {})
                 if isinstance(result_json, str):
                     try:
-                        result_json = json.loads(result_json)
-                    except:
+                        result_json = json_loads(result_json)
+                    except ValueError:
                         result_json = {}
                 
                 urls = result_json.get("resultUrls", [])
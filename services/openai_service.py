@@ -1,14 +1,112 @@
+import asyncio
 import os
 import json
+import hashlib
+import logging
+import operator
+import re
+from collections import OrderedDict, deque
+from typing import Optional
 from openai import AsyncOpenAI
 from config import config
+from utils.result_cache import result_cache
+
+logger = logging.getLogger(__name__)
 
 COMPETITORS_FILE = os.path.join(config.KNOWLEDGE_BASE_DIR, "competitors.json")
 
+# Сколько сценариев держать в памяти
+SCRIPT_CACHE_SIZE = 512
+# Сколько сценарий живёт в общем кэше (Redis) — переживает перезапуск бота, сек
+SCRIPT_CACHE_TTL = 86400
+# Сколько эмбеддингов тем хранить для поиска похожих (перебор линейный)
+SEMANTIC_CACHE_SIZE = 256
+
+# Промпты сценария без подстановок: меняющиеся тема и длительность идут отдельным
+# последним сообщением, чтобы префикс запроса был одинаковым и кэшировался OpenAI
+AVATAR_SCRIPT_CACHE_KEY = "avatar_script_v1"
+
+AVATAR_SCRIPT_PROMPT = """Ты — профессиональный копирайтер для видеосценариев.
+
+ТВОЯ ЗАДАЧА: Написать КОРОТКИЙ сценарий для видео на заданную тему.
+
+ПРАВИЛА:
+1. Пиши сценарий на ЛЮБУЮ тему, которую запросит пользователь
+2. Если тема связана с продуктом/услугой из базы знаний — активно используй эту информацию
+3. Если тема НЕ связана напрямую с базой знаний — всё равно пиши качественный сценарий, но можешь:
+   - Упомянуть продукт/бренд в контексте темы (если уместно)
+   - Использовать tone of voice из базы знаний
+   - Добавить CTA (призыв к действию) связанный с продуктом в конце
+4. Пиши естественным разговорным языком для озвучки
+5. КРИТИЧЕСКИ ВАЖНО: Сценарий должен укладываться в длительность из запроса (примерно 60-80 слов МАКСИМУМ)
+
+СТРУКТУРА СЦЕНАРИЯ:
+- Хук (первые 3 секунды) — зацепи внимание одним предложением
+- Основная часть — 2-3 предложения по теме
+- Завершение — короткий вывод или призыв к действию"""
+
+AVATAR_SCRIPT_PROMPT_NO_KB = """Ты — профессиональный копирайтер для видеосценариев.
+
+ТВОЯ ЗАДАЧА: Написать КОРОТКИЙ сценарий для видео на заданную тему.
+
+ПРАВИЛА:
+1. Пиши качественный, вовлекающий сценарий
+2. Пиши естественным разговорным языком для озвучки
+3. КРИТИЧЕСКИ ВАЖНО: Сценарий должен укладываться в длительность из запроса (примерно 60-80 слов МАКСИМУМ)
+
+СТРУКТУРА СЦЕНАРИЯ:
+- Хук (первые 3 секунды) — зацепи внимание одним предложением
+- Основная часть — 2-3 предложения по теме
+- Завершение — короткий вывод или призыв к действию
+
+ПРИМЕЧАНИЕ: База знаний пуста. Напиши общий информативный сценарий по теме."""
+
+# SEO-промпты: инструкции неизменны, база знаний идёт следующим системным сообщением
+SEO_KEYWORDS_PROMPT = """Ты — эксперт по SEO с опытом 10+ лет.
+
+Твоя задача — подобрать SEO-ключевые слова по заданной теме.
+Учитывай контекст из базы знаний при подборе ключей.
+
+📦 Output в формате JSON:
+```json
+{
+  "topic": "Название темы",
+  "keywords": "ключ1, ключ2, ключ3, ключ4, ключ5",
+  "seo_title": "Качественный SEO-заголовок"
+}
+```
+
+Отвечай ТОЛЬКО валидным JSON без дополнительного текста."""
+
+SEO_OUTLINE_PROMPT = """Ты — SEO-специалист и копирайтер.
+
+ЗАДАЧА: Создай структуру SEO-статьи с H2/H3 заголовками.
+- Если тема связана с базой знаний — используй эту информацию
+- Если тема общая — создай качественную структуру, но можешь добавить раздел о продукте/услуге из базы знаний (если уместно)"""
+
+SEO_ARTICLE_PROMPT = """Ты — профессиональный SEO-копирайтер.
+
+ПРАВИЛА:
+1. Пиши информативную, структурированную статью с учётом SEO
+2. Если тема напрямую связана с базой знаний — используй факты и данные из неё
+3. Если тема общая — пиши качественную статью, но можешь органично упомянуть продукт/услугу из базы знаний
+4. НЕ ВЫДУМЫВАЙ конкретные факты, цифры, исследования — если их нет в базе знаний
+5. Пиши на русском языке"""
+
 class OpenAIService:
     def __init__(self):
         self.client = AsyncOpenAI(api_key=config.OPENAI_API_KEY) if config.OPENAI_API_KEY else None
         self.model = config.OPENAI_MODEL
+        # Кэш базы знаний: (снимок файлов, склеенный текст)
+        self._kb_cache: tuple[tuple, str] = ((), "")
+        # Стабильный между перезапусками отпечаток содержимого базы знаний (hash() строк солится)
+        self._kb_digest = ""
+        # LRU готовых сценариев: ключ — нормализованная тема + длительность + версия базы знаний
+        self._script_cache: OrderedDict[tuple, str] = OrderedDict()
+        # Генерации, которые сейчас идут: повторный запрос той же темы ждёт их результата
+        self._script_inflight: dict[tuple, asyncio.Future] = {}
+        # Эмбеддинги тем для близких формулировок: (вектор, длительность + версия базы знаний, сценарий)
+        self._semantic_cache: deque[tuple[list[float], tuple, str]] = deque(maxlen=SEMANTIC_CACHE_SIZE)
     
     def is_available(self) -> bool:
         return self.client is not None
@@ -55,18 +153,36 @@ class OpenAIService:
         
         return files_content
     
+    def _kb_signature(self) -> tuple:
+        """Снимок базы знаний (имя, mtime, размер) — меняется при любой правке файлов"""
+        if not os.path.exists(config.KNOWLEDGE_BASE_DIR):
+            return ()
+        
+        signature = []
+        with os.scandir(config.KNOWLEDGE_BASE_DIR) as entries:
+            for entry in entries:
+                if entry.is_file():
+                    st = entry.stat()
+                    signature.append((entry.name, st.st_mtime_ns, st.st_size))
+        return tuple(sorted(signature))
+    
     def _load_knowledge_base(self) -> str:
-        """Загружает все файлы из базы знаний"""
-        files = self._load_files_from_dir(config.KNOWLEDGE_BASE_DIR)
+        """Загружает все файлы из базы знаний (перечитывает только при изменениях)"""
+        signature = self._kb_signature()
+        cached_signature, cached_content = self._kb_cache
+        if signature == cached_signature:
+            return cached_content
         
-        if not files:
-            return ""
+        files = self._load_files_from_dir(config.KNOWLEDGE_BASE_DIR)
         
         content_parts = []
         for filename, content in files:
             content_parts.append(f"=== {filename} ===\n{content}")
         
-        return "\n\n".join(content_parts)
+        content = "\n\n".join(content_parts)
+        self._kb_cache = (signature, content)
+        self._kb_digest = hashlib.blake2b(content.encode(), digest_size=16).hexdigest()
+        return content
     
     def _load_competitors_content(self, platforms: list[str] = None) -> str:
         """
@@ -107,92 +223,151 @@ class OpenAIService:
         
         return "\n\n".join(content_parts) if content_parts else ""
     
-    async def generate_avatar_script(self, topic: str, duration_seconds: int = 25) -> str:
-        """Генерирует сценарий для видео с аватаром (короткий для влезания в 30 сек)"""
+    def _kb_context_message(self, limit: int) -> dict:
+        """Системное сообщение с началом базы знаний — идёт после статичного промпта"""
+        kb_content = self._load_knowledge_base()
+        return {
+            "role": "system",
+            "content": f"КОНТЕКСТ (база знаний о продукте/компании):\n{kb_content[:limit] if kb_content else 'База знаний пуста.'}"
+        }
+    
+    @staticmethod
+    def _topic_key(topic: str) -> str:
+        """Ключ темы: регистр и лишние пробелы не влияют"""
+        normalized = " ".join(topic.lower().split())
+        return hashlib.blake2b(normalized.encode(), digest_size=16).hexdigest()
+    
+    def _remember_script(self, cache_key: tuple, script: str):
+        """Кладёт сценарий в LRU, вытесняя самый давний"""
+        self._script_cache[cache_key] = script
+        self._script_cache.move_to_end(cache_key)
+        if len(self._script_cache) > SCRIPT_CACHE_SIZE:
+            self._script_cache.popitem(last=False)
+    
+    async def _embed_topic(self, topic: str) -> Optional[list[float]]:
+        """Эмбеддинг темы; None если поиск похожих выключен или запрос не удался"""
+        if config.SCRIPT_SIMILARITY_THRESHOLD <= 0:
+            return None
+        try:
+            response = await self.client.embeddings.create(
+                model=config.OPENAI_EMBEDDING_MODEL,
+                input=" ".join(topic.lower().split())
+            )
+            return response.data[0].embedding
+        except Exception as e:
+            logger.warning(f"Эмбеддинг темы не получен: {e}")
+            return None
+    
+    def _find_similar_script(self, embedding: list[float], context: tuple) -> Optional[str]:
+        """Сценарий самой близкой темы, если сходство выше порога (эмбеддинги OpenAI нормированы — косинус равен скалярному произведению)"""
+        best_score, best_script = config.SCRIPT_SIMILARITY_THRESHOLD, None
+        for vector, entry_context, script in self._semantic_cache:
+            if entry_context != context:
+                continue
+            score = sum(map(operator.mul, vector, embedding))
+            if score >= best_score:
+                best_score, best_script = score, script
+        return best_script
+    
+    async def generate_avatar_script(self, topic: str, duration_seconds: int = 25, fresh: bool = False) -> str:
+        """
+        Генерирует сценарий для видео с аватаром (короткий для влезания в 30 сек)
+        
+        Повторный запрос той же темы отдаётся из кэша без обращения к OpenAI
+        (из памяти, а после перезапуска — из общего кэша). Если задан
+        SCRIPT_SIMILARITY_THRESHOLD, близкая по смыслу тема тоже берётся из кэша
+        по сходству эмбеддингов.
+        fresh=True (кнопка "Перегенерировать") всегда запрашивает новый вариант и кладёт его в кэш.
+        """
         if not self.client:
             raise RuntimeError("OpenAI API недоступен")
         
         kb_content = self._load_knowledge_base()
         
+        cache_key = (self._topic_key(topic), duration_seconds, self._kb_digest)
+        if fresh:
+            return await self._compose_avatar_script(topic, duration_seconds, kb_content, cache_key, fresh=True)
+        
+        if cache_key in self._script_cache:
+            self._script_cache.move_to_end(cache_key)
+            return self._script_cache[cache_key]
+        
+        # Одинаковые темы, пришедшие одновременно, обслуживает один запрос к OpenAI
+        inflight = self._script_inflight.get(cache_key)
+        if inflight is None:
+            inflight = asyncio.ensure_future(
+                self._compose_avatar_script(topic, duration_seconds, kb_content, cache_key)
+            )
+            self._script_inflight[cache_key] = inflight
+            inflight.add_done_callback(lambda _: self._script_inflight.pop(cache_key, None))
+        # shield: отмена одного ожидающего не отменяет генерацию для остальных
+        return await asyncio.shield(inflight)
+    
+    async def _compose_avatar_script(
+        self,
+        topic: str,
+        duration_seconds: int,
+        kb_content: str,
+        cache_key: tuple,
+        fresh: bool = False
+    ) -> str:
+        """Поиск похожей темы и, если её нет, генерация сценария в OpenAI"""
+        context = cache_key[1:]
+        store_key = "script:" + ":".join(map(str, cache_key))
+        embedding = None
+        if not fresh:
+            script = await result_cache.get(store_key)
+            if script is not None:
+                self._remember_script(cache_key, script)
+                return script
+            
+            embedding = await self._embed_topic(topic)
+            if embedding is not None:
+                script = self._find_similar_script(embedding, context)
+                if script is not None:
+                    self._remember_script(cache_key, script)
+                    return script
+        
+        # Статичные инструкции идут первыми, база знаний — следом, тема и длительность — в конце:
+        # общий префикс запросов совпадает побайтно и попадает в кэш промптов OpenAI
         if kb_content.strip():
-            system = f"""Ты — профессиональный копирайтер для видеосценариев.
-
-ТВОЯ ЗАДАЧА: Написать КОРОТКИЙ сценарий для видео на заданную тему.
-
-КОНТЕКСТ ИЗ БАЗЫ ЗНАНИЙ (информация о продукте/компании/бренде):
-{kb_content}
-
-ПРАВИЛА:
-1. Пиши сценарий на ЛЮБУЮ тему, которую запросит пользователь
-2. Если тема связана с продуктом/услугой из базы знаний — активно используй эту информацию
-3. Если тема НЕ связана напрямую с базой знаний — всё равно пиши качественный сценарий, но можешь:
-   - Упомянуть продукт/бренд в контексте темы (если уместно)
-   - Использовать tone of voice из базы знаний
-   - Добавить CTA (призыв к действию) связанный с продуктом в конце
-4. Пиши естественным разговорным языком для озвучки
-5. КРИТИЧЕСКИ ВАЖНО: Сценарий должен быть на ~{duration_seconds} секунд (примерно 60-80 слов МАКСИМУМ)
-
-СТРУКТУРА СЦЕНАРИЯ:
-- Хук (первые 3 секунды) — зацепи внимание одним предложением
-- Основная часть — 2-3 предложения по теме
-- Завершение — короткий вывод или призыв к действию"""
+            messages = [
+                {"role": "system", "content": AVATAR_SCRIPT_PROMPT},
+                {"role": "system", "content": f"КОНТЕКСТ ИЗ БАЗЫ ЗНАНИЙ (информация о продукте/компании/бренде):\n{kb_content}"}
+            ]
         else:
-            system = f"""Ты — профессиональный копирайтер для видеосценариев.
-
-ТВОЯ ЗАДАЧА: Написать КОРОТКИЙ сценарий для видео на заданную тему.
-
-ПРАВИЛА:
-1. Пиши качественный, вовлекающий сценарий
-2. Пиши естественным разговорным языком для озвучки
-3. КРИТИЧЕСКИ ВАЖНО: Сценарий должен быть на ~{duration_seconds} секунд (примерно 60-80 слов МАКСИМУМ)
-
-СТРУКТУРА СЦЕНАРИЯ:
-- Хук (первые 3 секунды) — зацепи внимание одним предложением
-- Основная часть — 2-3 предложения по теме
-- Завершение — короткий вывод или призыв к действию
-
-ПРИМЕЧАНИЕ: База знаний пуста. Напиши общий информативный сценарий по теме."""
-
+            messages = [{"role": "system", "content": AVATAR_SCRIPT_PROMPT_NO_KB}]
+        messages.append({
+            "role": "user",
+            "content": f"Напиши сценарий на тему: {topic}\nДлительность: ~{duration_seconds} секунд"
+        })
+        
         response = await self.client.chat.completions.create(
             model=self.model,
-            messages=[
-                {"role": "system", "content": system},
-                {"role": "user", "content": f"Напиши сценарий на тему: {topic}"}
-            ],
+            messages=messages,
+            # Привязка к одному ключу держит запросы с общим префиксом на том же узле кэша
+            extra_body={"prompt_cache_key": AVATAR_SCRIPT_CACHE_KEY},
             max_tokens=500
         )
-        return response.choices[0].message.content
+        script = response.choices[0].message.content
+        
+        self._remember_script(cache_key, script)
+        await result_cache.set(store_key, script, SCRIPT_CACHE_TTL)
+        if embedding is not None:
+            self._semantic_cache.append((embedding, context, script))
+        
+        return script
     
     async def generate_seo_keywords(self, topic: str) -> dict:
         """Генерирует SEO-ключи и заголовок по теме"""
         if not self.client:
             raise RuntimeError("OpenAI API недоступен")
         
-        kb_content = self._load_knowledge_base()
-        
-        system = f"""Ты — эксперт по SEO с опытом 10+ лет.
-
-КОНТЕКСТ (база знаний о продукте/компании):
-{kb_content[:3000] if kb_content else 'База знаний пуста.'}
-
-Твоя задача — подобрать SEO-ключевые слова по заданной теме.
-Учитывай контекст из базы знаний при подборе ключей.
-
-📦 Output в формате JSON:
-```json
-{{
-  "topic": "Название темы",
-  "keywords": "ключ1, ключ2, ключ3, ключ4, ключ5",
-  "seo_title": "Качественный SEO-заголовок"
-}}
-```
-
-Отвечай ТОЛЬКО валидным JSON без дополнительного текста."""
-
         response = await self.client.chat.completions.create(
             model=self.model,
             messages=[
-                {"role": "system", "content": system},
+                {"role": "system", "content": SEO_KEYWORDS_PROMPT},
+                self._kb_context_message(3000),
                 {"role": "user", "content": f"Тема: {topic}"}
             ],
             max_tokens=1000,
@@ -203,7 +378,6 @@ class OpenAIService:
         try:
             return json.loads(result_text)
         except json.JSONDecodeError:
-            import re
             match = re.search(r'\{[^{}]*\}', result_text, re.DOTALL)
             if match:
                 return json.loads(match.group())
@@ -214,24 +388,14 @@ class OpenAIService:
         if not self.client:
             raise RuntimeError("OpenAI API недоступен")
         
-        kb_content = self._load_knowledge_base()
-        
-        system = f"""Ты — SEO-специалист и копирайтер.
-
-КОНТЕКСТ (база знаний о продукте/компании):
-{kb_content[:4000] if kb_content else 'База знаний пуста.'}
-
-ЗАДАЧА: Создай структуру SEO-статьи с H2/H3 заголовками.
-- Если тема связана с базой знаний — используй эту информацию
-- Если тема общая — создай качественную структуру, но можешь добавить раздел о продукте/услуге из базы знаний (если уместно)"""
-
         kw_str = ", ".join(keywords) if keywords else "не указаны"
         title_str = f"\nSEO-заголовок: {seo_title}" if seo_title else ""
         
         response = await self.client.chat.completions.create(
             model=self.model,
             messages=[
-                {"role": "system", "content": system},
+                {"role": "system", "content": SEO_OUTLINE_PROMPT},
+                self._kb_context_message(4000),
                 {"role": "user", "content": f"Тема: {topic}\nКлючи: {kw_str}{title_str}\n\nСоздай структуру статьи."}
             ],
             max_tokens=1500
@@ -243,27 +407,14 @@ class OpenAIService:
         if not self.client:
             raise RuntimeError("OpenAI API недоступен")
         
-        kb_content = self._load_knowledge_base()
-        
-        system = f"""Ты — профессиональный SEO-копирайтер.
-
-КОНТЕКСТ (база знаний о продукте/компании):
-{kb_content[:5000] if kb_content else 'База знаний пуста.'}
-
-ПРАВИЛА:
-1. Пиши информативную, структурированную статью с учётом SEO
-2. Если тема напрямую связана с базой знаний — используй факты и данные из неё
-3. Если тема общая — пиши качественную статью, но можешь органично упомянуть продукт/услугу из базы знаний
-4. НЕ ВЫДУМЫВАЙ конкретные факты, цифры, исследования — если их нет в базе знаний
-5. Пиши на русском языке"""
-
         kw_str = ", ".join(keywords) if keywords else "не указаны"
         title_instruction = f"\nИспользуй заголовок H1: {seo_title}" if seo_title else ""
         
         response = await self.client.chat.completions.create(
             model=self.model,
             messages=[
-                {"role": "system", "content": system},
+                {"role": "system", "content": SEO_ARTICLE_PROMPT},
+                self._kb_context_message(5000),
                 {"role": "user", "content": f"Тема: {topic}\nКлючи: {kw_str}{title_instruction}\nСтруктура:\n{outline}\n\nНапиши полную статью."}
             ],
             max_tokens=4000
@@ -301,8 +452,7 @@ class OpenAIService:
                 if insights_parts:
                     competitors_insights = "\n\nИНСАЙТЫ ИЗ АНАЛИЗА КОНКУРЕНТОВ:\n" + "\n".join(f"- {i}" for i in insights_parts)
             except Exception as e:
-                import logging
-                logging.getLogger(__name__).error(f"Failed to analyze competitors: {e}")
+                logger.error(f"Failed to analyze competitors: {e}")
         
         system = f"""Ты — эксперт по созданию вирусного видеоконтента для TikTok, Instagram Reels, YouTube Shorts.
 
@@ -1,12 +1,43 @@
 import asyncio
 import aiohttp
+import hashlib
+import importlib.util
+import io
+import logging
 import tempfile
-import subprocess
+import threading
 import os
+import re
 from typing import Optional
-from dataclasses import dataclass
+from dataclasses import dataclass, asdict
 from openai import AsyncOpenAI
 from config import config
+from services.http_client import http_client
+from utils.ffmpeg import communicate_or_kill, ffmpeg_available, ffmpeg_slots
+from utils.files import read_file, remove_files, write_temp_file
+from utils.limits import OPENAI_SEMAPHORE
+from utils.result_cache import result_cache
+
+logger = logging.getLogger(__name__)
+
+# Сколько держать транскрибацию в кэше по хэшу аудио, сек
+TRANSCRIPTION_CACHE_TTL = 86400
+# Конвейер извлечения аудио: размер куска видео и сколько кусков ждут FFmpeg
+PIPELINE_CHUNK_SIZE = 1024 * 1024
+PIPELINE_QUEUE_SIZE = 4
+# FFmpeg по URL: сколько ждать данных от хоста (сек) и сколько всего на извлечение аудио
+FFMPEG_RW_TIMEOUT = 30
+FFMPEG_AUDIO_TIMEOUT = 300
+# Предел на наложение субтитров (перекодирование ролика до 30 сек), сек
+FFMPEG_BURN_TIMEOUT = 600
+# Расширения в URL, по которым выбирается путь транскрибации (берётся первое совпадение)
+VIDEO_EXTENSIONS = (".mp4", ".mov", ".mkv", ".webm", ".avi")
+AUDIO_EXTENSIONS = (".ogg", ".wav", ".m4a", ".flac", ".mpeg", ".mpga")
+# Сверка видео со сценарием: темп начитки (слов в секунду) и допустимое отклонение длительности
+SCRIPT_WORDS_PER_SECOND = 2.5
+SCRIPT_DURATION_TOLERANCE = 0.35
+# Разметка, которую LLM оставляет в сценарии и которая не произносится: **, #, _, [ремарки]
+SCRIPT_MARKUP_RE = re.compile(r"\[[^\]]*\]|[*#_]")
 
 @dataclass
 class WordTiming:
@@ -34,6 +65,25 @@ class SubtitlesResult:
     full_text: str
     language: str
     duration: float
+    
+    @classmethod
+    def from_dict(cls, data: dict) -> "SubtitlesResult":
+        """Восстанавливает результат из asdict() (для кэша)"""
+        segments = [
+            SubtitleSegment(
+                index=seg["index"],
+                start_time=seg["start_time"],
+                end_time=seg["end_time"],
+                words=[WordTiming(**w) for w in seg["words"]]
+            )
+            for seg in data["segments"]
+        ]
+        return cls(
+            segments=segments,
+            full_text=data["full_text"],
+            language=data["language"],
+            duration=data["duration"]
+        )
 
 class SubtitlesService:
     """Сервис для генерации субтитров с эффектом караоке через FFmpeg + Whisper"""
@@ -41,60 +91,229 @@ class SubtitlesService:
     def __init__(self):
         self.client = AsyncOpenAI(api_key=config.OPENAI_API_KEY) if config.OPENAI_API_KEY else None
         self.WORDS_PER_SEGMENT = 3  # Строго 3 слова
+        # Локальная модель faster-whisper загружается при первой транскрибации
+        self.local_backend = config.WHISPER_BACKEND == "faster" and self._has_faster_whisper()
+        self._local_model = None
+        self._local_model_lock = threading.Lock()
     
     def is_available(self) -> bool:
-        return self.client is not None
+        return self.local_backend or self.client is not None
     
-    def _check_ffmpeg(self) -> bool:
-        """Проверяет доступность FFmpeg"""
-        try:
-            subprocess.run(["ffmpeg", "-version"], capture_output=True, check=True)
-            return True
-        except (subprocess.CalledProcessError, FileNotFoundError):
+    @staticmethod
+    def _has_faster_whisper() -> bool:
+        """faster-whisper — необязательная зависимость: без неё остаётся Whisper API"""
+        if importlib.util.find_spec("faster_whisper") is None:
+            logger.warning("WHISPER_BACKEND=faster, но faster-whisper не установлен — используется Whisper API")
             return False
+        return True
+    
+    def _get_local_model(self):
+        """WhisperModel создаётся один раз (в рабочем потоке — загрузка модели блокирующая)"""
+        with self._local_model_lock:
+            if self._local_model is None:
+                from faster_whisper import WhisperModel
+                self._local_model = WhisperModel(
+                    config.WHISPER_MODEL_SIZE,
+                    device="cpu",
+                    compute_type=config.WHISPER_COMPUTE_TYPE
+                )
+            return self._local_model
+    
+    def _transcribe_local(self, audio_data: bytes, language: str) -> SubtitlesResult:
+        """Транскрибация через faster-whisper (блокирующая, вызывается через to_thread)"""
+        raw_segments, info = self._get_local_model().transcribe(
+            io.BytesIO(audio_data),
+            language=language,
+            word_timestamps=True
+        )
+        
+        word_timings = []
+        text_parts = []
+        for segment in raw_segments:
+            text_parts.append(segment.text.strip())
+            for w in segment.words or []:
+                word_timings.append(WordTiming(
+                    word=w.word.strip(),
+                    start_time=float(w.start),
+                    end_time=float(w.end)
+                ))
+        
+        segments = self._group_words_into_segments(word_timings)
+        return SubtitlesResult(
+            segments=segments,
+            full_text=" ".join(text_parts),
+            language=info.language or language,
+            duration=segments[-1].end_time if segments else 0
+        )
     
     async def _download_file(self, url: str) -> bytes:
         """Скачивает файл по URL"""
-        async with aiohttp.ClientSession() as session:
-            async with session.get(url, timeout=aiohttp.ClientTimeout(total=300)) as resp:
-                if resp.status != 200:
-                    raise Exception(f"Не удалось скачать файл: {resp.status}")
-                return await resp.read()
+        async with http_client.session.get(url, timeout=aiohttp.ClientTimeout(total=300)) as resp:
+            if resp.status != 200:
+                raise Exception(f"Не удалось скачать файл: {resp.status}")
+            return await resp.read()
     
-    async def _extract_audio_from_video_url(self, video_url: str) -> str:
-        """Скачивает видео и извлекает аудио через FFmpeg"""
-        video_data = await self._download_file(video_url)
+    async def _extract_audio_from_video_url(self, video_url: str, suffix: str = ".mp4") -> bytes:
+        """
+        Извлекает аудиодорожку из видео по URL через FFmpeg
+        
+        FFmpeg читает видео прямо по HTTP (с Range-запросами, так что moov в конце файла
+        не мешает) и отдаёт MP3 в stdout: видео не скачивается в память бота и не пишется
+        на диск. Если источник не отдался FFmpeg'у напрямую — видео скачивается
+        во временный файл, как раньше.
+        """
+        audio_data = await self._ffmpeg_audio(video_url)
+        if audio_data:
+            return audio_data
+        
+        audio_data = await self._extract_audio_streamed(video_url, suffix)
+        if not audio_data:
+            raise Exception("Не удалось извлечь аудио из видео")
+        return audio_data
+    
+    async def _extract_audio_streamed(self, video_url: str, suffix: str) -> Optional[bytes]:
+        """
+        Конвейер «скачивание -> FFmpeg -> сбор MP3» на ограниченных очередях
         
-        ext = ".mp4"
-        for e in [".mov", ".mkv", ".webm", ".avi"]:
-            if e in video_url.lower():
-                ext = e
-                break
+        Куски видео идут в stdin FFmpeg по мере скачивания, а MP3 забирается из stdout
+        параллельно — время ≈ самая долгая стадия, а не их сумма, и в памяти не больше
+        PIPELINE_QUEUE_SIZE кусков. Те же куски пишутся во временный файл: MP4 с moov
+        в конце из pipe не читается, и тогда FFmpeg перезапускается по уже скачанному
+        файлу без повторного скачивания.
+        """
+        chunks: asyncio.Queue = asyncio.Queue(maxsize=PIPELINE_QUEUE_SIZE)
+        spool = tempfile.NamedTemporaryFile(suffix=suffix, delete=False)
         
-        with tempfile.NamedTemporaryFile(suffix=ext, delete=False) as tmp_video:
-            tmp_video.write(video_data)
-            video_path = tmp_video.name
+        async def download():
+            async with http_client.session.get(video_url, timeout=aiohttp.ClientTimeout(total=300)) as resp:
+                if resp.status != 200:
+                    raise Exception(f"Не удалось скачать файл: {resp.status}")
+                async for chunk in resp.content.iter_chunked(PIPELINE_CHUNK_SIZE):
+                    await chunks.put(chunk)
+            await chunks.put(None)
         
-        audio_path = video_path.replace(ext, ".mp3")
+        async def feed(process: asyncio.subprocess.Process):
+            piping = True
+            while (chunk := await chunks.get()) is not None:
+                await asyncio.to_thread(spool.write, chunk)
+                if piping:
+                    try:
+                        process.stdin.write(chunk)
+                        await process.stdin.drain()
+                    except (BrokenPipeError, ConnectionResetError):
+                        # FFmpeg сдался на потоке — дальше видео докачивается только в файл
+                        piping = False
+            process.stdin.close()
         
-        cmd = [
-            "ffmpeg", "-y", "-i", video_path,
+        try:
+            async with ffmpeg_slots:
+                process = await asyncio.create_subprocess_exec(
+                    *self._ffmpeg_audio_cmd("pipe:0"),
+                    stdin=asyncio.subprocess.PIPE,
+                    stdout=asyncio.subprocess.PIPE,
+                    stderr=asyncio.subprocess.DEVNULL
+                )
+                stages = [asyncio.ensure_future(stage) for stage in (download(), feed(process), process.stdout.read())]
+                try:
+                    # Ошибка любой стадии отменяет остальные: очереди не остаются ждать вечно,
+                    # а общий таймаут не даёт зависшему FFmpeg держать слот ffmpeg_slots
+                    _, _, audio_data = await asyncio.wait_for(asyncio.gather(*stages), FFMPEG_AUDIO_TIMEOUT)
+                    await process.wait()
+                except BaseException:
+                    for stage in stages:
+                        stage.cancel()
+                    if process.returncode is None:
+                        process.kill()
+                        await process.wait()
+                    raise
+                finally:
+                    spool.close()
+            
+            if process.returncode == 0 and audio_data:
+                return audio_data
+            return await self._ffmpeg_audio(spool.name)
+        finally:
+            spool.close()
+            await asyncio.to_thread(remove_files, spool.name)
+    
+    @staticmethod
+    def _ffmpeg_audio_cmd(source: str) -> list[str]:
+        """Команда FFmpeg: MP3-дорожка источника в stdout"""
+        # Для URL — таймаут чтения: зависший хост обрывает FFmpeg, а не держит его вечно
+        network = ["-rw_timeout", str(FFMPEG_RW_TIMEOUT * 1_000_000)] if source.startswith(("http://", "https://")) else []
+        return [
+            "ffmpeg", "-nostdin", *network, "-i", source,
             "-vn", "-acodec", "libmp3lame", "-q:a", "2",
-            audio_path
+            "-f", "mp3", "pipe:1"
         ]
+    
+    async def _ffmpeg_audio(self, source: str) -> Optional[bytes]:
+        """MP3-дорожка источника (путь или URL) из stdout FFmpeg; None при ошибке или таймауте"""
+        async with ffmpeg_slots:
+            process = await asyncio.create_subprocess_exec(
+                *self._ffmpeg_audio_cmd(source), stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.DEVNULL
+            )
+            try:
+                audio_data, _ = await communicate_or_kill(process, FFMPEG_AUDIO_TIMEOUT)
+            except asyncio.TimeoutError:
+                logger.warning("FFmpeg не извлёк аудио за %s сек: %s", FFMPEG_AUDIO_TIMEOUT, source)
+                return None
         
-        process = await asyncio.create_subprocess_exec(
-            *cmd, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE
-        )
-        await process.communicate()
+        if process.returncode != 0 or not audio_data:
+            return None
+        return audio_data
+    
+    async def subtitles_for_video(
+        self,
+        video_url: str,
+        script: Optional[str] = None,
+        duration: Optional[float] = None,
+        language: str = "ru"
+    ) -> SubtitlesResult:
+        """
+        Субтитры к видео, записанному по сценарию
         
-        if os.path.exists(video_path):
-            os.unlink(video_path)
+        Если длительность видео сходится с расчётным временем чтения сценария, текст
+        берётся из сценария — без скачивания, FFmpeg и Whisper. Иначе (или при
+        USE_WHISPER_TRANSCRIPTION) видео транскрибируется; если транскрибировать
+        нечем, субтитры всё равно строятся по сценарию.
+        """
+        if script and duration:
+            if not self.is_available():
+                return self.subtitles_from_script(script, duration, language)
+            if not config.USE_WHISPER_TRANSCRIPTION and self.script_fits_duration(script, duration):
+                return self.subtitles_from_script(script, duration, language)
+        return await self.transcribe_audio(video_url, language)
+    
+    @staticmethod
+    def _script_words(script: str) -> list[str]:
+        return SCRIPT_MARKUP_RE.sub(" ", script).split()
+    
+    def script_fits_duration(self, script: str, duration: float) -> bool:
+        """Похоже ли видео на начитку сценария: длительность близка к расчётному времени чтения"""
+        expected = len(self._script_words(script)) / SCRIPT_WORDS_PER_SECOND
+        return expected > 0 and abs(duration - expected) <= expected * SCRIPT_DURATION_TOLERANCE
+    
+    def subtitles_from_script(self, script: str, duration: float, language: str = "ru") -> SubtitlesResult:
+        """Субтитры из текста сценария: время делится между словами пропорционально их длине"""
+        words = self._script_words(script)
+        # +1 к длине слова — пауза после него
+        weights = [len(word) + 1 for word in words]
+        scale = duration / sum(weights)
         
-        if process.returncode != 0 or not os.path.exists(audio_path):
-            raise Exception("Не удалось извлечь аудио из видео")
+        word_timings = []
+        start = 0.0
+        for word, weight in zip(words, weights):
+            end = start + weight * scale
+            word_timings.append(WordTiming(word=word, start_time=start, end_time=end))
+            start = end
         
-        return audio_path
+        return SubtitlesResult(
+            segments=self._group_words_into_segments(word_timings),
+            full_text=" ".join(words),
+            language=language,
+            duration=duration
+        )
     
     async def transcribe_audio(
         self,
@@ -102,78 +321,102 @@ class SubtitlesService:
         language: str = "ru"
     ) -> SubtitlesResult:
         """Транскрибирует аудио/видео через Whisper с word-level таймингами"""
-        if not self.client:
+        if not self.is_available():
             raise RuntimeError("OpenAI API недоступен")
         
-        is_video = any(ext in audio_url.lower() for ext in [".mp4", ".mov", ".mkv", ".webm", ".avi"])
+        url = audio_url.lower()
+        video_ext = next((ext for ext in VIDEO_EXTENSIONS if ext in url), None)
         
-        if is_video:
-            audio_path = await self._extract_audio_from_video_url(audio_url)
+        if video_ext:
+            audio_data = await self._extract_audio_from_video_url(audio_url, video_ext)
+            filename = "audio.mp3"
         else:
             audio_data = await self._download_file(audio_url)
-            ext = ".mp3"
-            for e in [".ogg", ".wav", ".m4a", ".flac", ".mpeg", ".mpga"]:
-                if e in audio_url.lower():
-                    ext = e
-                    break
-            
-            with tempfile.NamedTemporaryFile(suffix=ext, delete=False) as tmp:
-                tmp.write(audio_data)
-                audio_path = tmp.name
+            ext = next((ext for ext in AUDIO_EXTENSIONS if ext in url), ".mp3")
+            filename = f"audio{ext}"
         
-        try:
-            with open(audio_path, "rb") as audio_file:
-                response = await self.client.audio.transcriptions.create(
-                    model="whisper-1",
-                    file=audio_file,
-                    language=language,
-                    response_format="verbose_json",
-                    timestamp_granularities=["word"]
-                )
-            
-            words = getattr(response, 'words', []) or []
-            
-            if not words:
-                return await self._transcribe_fallback(audio_path, language)
-            
-            # Преобразуем в WordTiming
-            word_timings = []
-            for w in words:
-                if hasattr(w, 'word'):
-                    word_timings.append(WordTiming(
-                        word=w.word.strip(),
-                        start_time=float(w.start),
-                        end_time=float(w.end)
-                    ))
-                elif isinstance(w, dict):
-                    word_timings.append(WordTiming(
-                        word=w.get('word', '').strip(),
-                        start_time=float(w.get('start', 0)),
-                        end_time=float(w.get('end', 0))
-                    ))
-            
-            # Группируем по 3 слова
-            segments = self._group_words_into_segments(word_timings)
-            full_text = getattr(response, 'text', '') or ''
-            detected_language = getattr(response, 'language', language) or language
-            duration = segments[-1].end_time if segments else 0
-            
-            return SubtitlesResult(
-                segments=segments,
-                full_text=full_text,
-                language=detected_language,
-                duration=duration
+        return await self.transcribe_audio_bytes(audio_data, filename, language)
+    
+    async def transcribe_audio_bytes(
+        self,
+        audio_data: bytes,
+        filename: str,
+        language: str = "ru"
+    ) -> SubtitlesResult:
+        """
+        Транскрибирует аудио из памяти
+        
+        Байты уходят в Whisper как есть, без временного файла; по расширению
+        в filename Whisper определяет формат. Результат кэшируется по SHA-256
+        содержимого, так что повторная отправка того же файла не идёт в Whisper.
+        """
+        backend = "faster" if self.local_backend else "openai"
+        key = f"whisper:{backend}:{language}:{hashlib.sha256(audio_data).hexdigest()}"
+        
+        async def compute() -> dict:
+            return asdict(await self._transcribe_bytes(audio_data, filename, language))
+        
+        cached = await result_cache.get_or_compute(key, compute, ttl=TRANSCRIPTION_CACHE_TTL)
+        return SubtitlesResult.from_dict(cached)
+    
+    async def _transcribe_bytes(self, audio_data: bytes, filename: str, language: str) -> SubtitlesResult:
+        if self.local_backend:
+            return await asyncio.to_thread(self._transcribe_local, audio_data, language)
+        
+        if not self.client:
+            raise RuntimeError("OpenAI API недоступен")
+        
+        audio = (filename, audio_data)
+        
+        async with OPENAI_SEMAPHORE:
+            response = await self.client.audio.transcriptions.create(
+                model="whisper-1",
+                file=audio,
+                language=language,
+                response_format="verbose_json",
+                timestamp_granularities=["word"]
             )
-        finally:
-            if os.path.exists(audio_path):
-                os.unlink(audio_path)
+        
+        words = getattr(response, 'words', []) or []
+        
+        if not words:
+            return await self._transcribe_fallback(audio, language)
+        
+        # Преобразуем в WordTiming
+        word_timings = []
+        for w in words:
+            if hasattr(w, 'word'):
+                word_timings.append(WordTiming(
+                    word=w.word.strip(),
+                    start_time=float(w.start),
+                    end_time=float(w.end)
+                ))
+            elif isinstance(w, dict):
+                word_timings.append(WordTiming(
+                    word=w.get('word', '').strip(),
+                    start_time=float(w.get('start', 0)),
+                    end_time=float(w.get('end', 0))
+                ))
+        
+        # Группируем по 3 слова
+        segments = self._group_words_into_segments(word_timings)
+        full_text = getattr(response, 'text', '') or ''
+        detected_language = getattr(response, 'language', language) or language
+        duration = segments[-1].end_time if segments else 0
+        
+        return SubtitlesResult(
+            segments=segments,
+            full_text=full_text,
+            language=detected_language,
+            duration=duration
+        )
     
-    async def _transcribe_fallback(self, audio_path: str, language: str) -> SubtitlesResult:
+    async def _transcribe_fallback(self, audio: tuple[str, bytes], language: str) -> SubtitlesResult:
         """Fallback если word-level тайминги недоступны"""
-        with open(audio_path, "rb") as audio_file:
+        async with OPENAI_SEMAPHORE:
             response = await self.client.audio.transcriptions.create(
                 model="whisper-1",
-                file=audio_file,
+                file=audio,
                 language=language,
                 response_format="verbose_json",
                 timestamp_granularities=["segment"]
@@ -370,18 +613,17 @@ Format: Layer, Start, End, Style, Name, MarginL, MarginR, MarginV, Effect, Text
         ass_content: str
     ) -> Optional[bytes]:
         """Скачивает видео, накладывает субтитры с караоке через FFmpeg"""
-        if not self._check_ffmpeg():
+        if not ffmpeg_available():
             raise RuntimeError("FFmpeg не установлен")
         
         video_data = await self._download_file(video_url)
         
-        with tempfile.NamedTemporaryFile(suffix=".mp4", delete=False) as video_tmp:
-            video_tmp.write(video_data)
-            video_path = video_tmp.name
-        
-        with tempfile.NamedTemporaryFile(suffix=".ass", delete=False, mode='w', encoding='utf-8') as ass_tmp:
-            ass_tmp.write(ass_content)
-            ass_path = ass_tmp.name
+        # Запись и чтение файлов — в потоках: event loop продолжает обслуживать других пользователей
+        video_path, ass_path = await asyncio.gather(
+            asyncio.to_thread(write_temp_file, video_data, ".mp4"),
+            asyncio.to_thread(write_temp_file, ass_content, ".ass")
+        )
+        del video_data
         
         output_path = tempfile.mktemp(suffix=".mp4")
         
@@ -400,23 +642,19 @@ Format: Layer, Start, End, Style, Name, MarginL, MarginR, MarginV, Effect, Text
                 output_path
             ]
             
-            process = await asyncio.create_subprocess_exec(
-                *cmd, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE
-            )
-            stdout, stderr = await process.communicate()
+            # Перекодирование видео — самая тяжёлая работа бота: общий лимит FFmpeg
+            async with ffmpeg_slots:
+                process = await asyncio.create_subprocess_exec(
+                    *cmd, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE
+                )
+                stdout, stderr = await communicate_or_kill(process, FFMPEG_BURN_TIMEOUT)
             
             if process.returncode != 0:
                 raise Exception(f"FFmpeg error: {stderr.decode()[:500]}")
             
-            with open(output_path, 'rb') as f:
-                return f.read()
+            return await asyncio.to_thread(read_file, output_path)
                 
         finally:
-            for path in [video_path, ass_path, output_path]:
-                if os.path.exists(path):
-                    try:
-                        os.unlink(path)
-                    except:
-                        pass
+            await asyncio.to_thread(remove_files, video_path, ass_path, output_path)
 
 subtitles_service = SubtitlesService()
\ No newline at end of file
@@ -1,9 +1,22 @@
 import asyncio
 import json
 import logging
-from dataclasses import dataclass, field
+import random
+import time
+import zlib
+from dataclasses import dataclass, field, asdict
+from types import MappingProxyType
 from typing import Optional, Literal
-from datetime import datetime, timedelta
+from datetime import datetime
+
+from config import config
+from services.kie_callbacks import kie_callbacks
+
+# orjson быстрее разбирает resultJson; без него — стандартный json
+try:
+    from orjson import loads as json_loads
+except ImportError:
+    from json import loads as json_loads
 
 logger = logging.getLogger(__name__)
 
@@ -11,36 +24,155 @@ logger = logging.getLogger(__name__)
 AVATAR_VIDEOS_FOLDER_ID = "1euXl3Kfe0JJLWQCXUjRwWYFIoB4Hh1Un"  # Видео с аватаром + сами аватары
 SHORT_VIDEOS_FOLDER_ID = "1r6arLQJo88biINNkRnFwksAKJNDkrJPr"  # Видео от Sora/Veo
 
+# Названия моделей: для имён файлов на Drive и для сообщений пользователю
+MODEL_FILE_NAMES = MappingProxyType({
+    "sora2": "Sora2", "veo3": "Veo3", "veo3_fast": "Veo3_Fast",
+    "kling_motion": "Kling_Motion", "nano_banana": "NanoBanana"
+})
+MODEL_DISPLAY_NAMES = MappingProxyType({
+    "sora2": "Sora 2", "veo3": "Veo 3.1 Quality", "veo3_fast": "Veo 3.1 Fast",
+    "kling_motion": "Kling Motion Control", "nano_banana": "Nano Banana"
+})
+
+# Интервал опроса задачи: растёт от минимума до максимума, пока задача не готова.
+# Колбэк Kie.ai по задаче запускает её проверку сразу, не дожидаясь интервала.
+POLL_MIN_DELAY = 10.0
+POLL_MAX_DELAY = 30.0
+# Случайная добавка к интервалу (доля от него): задачи, запущенные вместе, не проверяются залпом
+POLL_JITTER = 0.2
+
+# Ключи Redis: хэш задачи и множество ожидающих задач
+REDIS_TASK_KEY = "task_tracker:task:{}"
+REDIS_PENDING_KEY = "task_tracker:pending"
+# Дольше самого длинного таймаута генерации (45 мин) — потом запись не нужна
+REDIS_TASK_TTL = 2 * 3600
+# Поля, которые не сохраняются: расписание опроса строится заново после рестарта
+TRANSIENT_FIELDS = ("poll_delay", "next_check_at", "subtitles_data")
+
 @dataclass
 class VideoTask:
     task_id: str
     chat_id: int
     user_id: int
     model: Literal["sora2", "veo3", "veo3_fast", "kling_motion", "nano_banana"]
-    created_at: datetime
+    # Время постановки задачи (Unix-время): переживает рестарт вместе с записью в Redis
+    created_at: float = field(default_factory=time.time)
     prompt: str = ""
     status: str = "pending"
     result_url: Optional[str] = None
     error: Optional[str] = None
     subtitles_data: Optional[dict] = field(default=None)  # {"srt": ..., "ass": ...}
     avatar_image_url: Optional[str] = None  # URL аватара для загрузки на Drive
+    poll_delay: float = POLL_MIN_DELAY
+    next_check_at: float = field(default_factory=lambda: time.monotonic() + POLL_MIN_DELAY)
 
 class TaskTracker:
+    """
+    Отслеживание запущенных генераций видео
+    
+    Рабочий набор задач живёт в памяти процесса; если задан REDIS_URL, каждая задача
+    дублируется в Redis и восстанавливается при старте, так что рестарт бота не теряет
+    генерации, которые ещё идут у провайдера.
+    """
+    
     def __init__(self):
         self.tasks: dict[str, VideoTask] = {}
         self._polling_task: Optional[asyncio.Task] = None
         self._bot = None
+        self._redis = None
     
     def set_bot(self, bot):
         self._bot = bot
     
-    def add_task(self, task: VideoTask):
+    def _client(self):
+        if self._redis is None and config.REDIS_URL:
+            from redis.asyncio import Redis
+            self._redis = Redis.from_url(config.REDIS_URL)
+        return self._redis
+    
+    async def add_task(self, task: VideoTask):
         self.tasks[task.task_id] = task
         logger.info(f"Task added: {task.task_id} for user {task.user_id}")
+        await self._save(task)
     
-    def remove_task(self, task_id: str):
+    async def attach_subtitles(self, task_id: str, subtitles_data: dict):
+        """Добавляет субтитры к уже отслеживаемой задаче; если видео успело прийти раньше — ничего не делает"""
+        task = self.tasks.get(task_id)
+        if task is None:
+            return
+        task.subtitles_data = subtitles_data
+        await self._save(task)
+    
+    async def remove_task(self, task_id: str):
         if task_id in self.tasks:
             del self.tasks[task_id]
+        kie_callbacks.forget(task_id)
+        
+        redis = self._client()
+        if redis is None:
+            return
+        try:
+            async with redis.pipeline(transaction=False) as pipe:
+                pipe.delete(REDIS_TASK_KEY.format(task_id))
+                pipe.srem(REDIS_PENDING_KEY, task_id)
+                await pipe.execute()
+        except Exception as e:
+            logger.warning(f"Failed to delete task {task_id} from Redis: {e}")
+    
+    async def _save(self, task: VideoTask):
+        """Сохраняет задачу в Redis: метаданные JSON, субтитры — сжатым отдельным полем"""
+        redis = self._client()
+        if redis is None:
+            return
+        
+        meta = {k: v for k, v in asdict(task).items() if k not in TRANSIENT_FIELDS}
+        fields = {"meta": json.dumps(meta, ensure_ascii=False)}
+        if task.subtitles_data:
+            fields["subtitles"] = zlib.compress(json.dumps(task.subtitles_data, ensure_ascii=False).encode("utf-8"))
+        
+        key = REDIS_TASK_KEY.format(task.task_id)
+        try:
+            async with redis.pipeline(transaction=False) as pipe:
+                pipe.hset(key, mapping=fields)
+                pipe.expire(key, REDIS_TASK_TTL)
+                pipe.sadd(REDIS_PENDING_KEY, task.task_id)
+                await pipe.execute()
+        except Exception as e:
+            logger.warning(f"Failed to persist task {task.task_id}: {e}")
+    
+    async def restore(self):
+        """Хук запуска диспетчера: поднимает из Redis задачи, не завершённые до рестарта"""
+        redis = self._client()
+        if redis is None:
+            return
+        
+        try:
+            task_ids = [tid.decode() for tid in await redis.smembers(REDIS_PENDING_KEY)]
+            if not task_ids:
+                return
+            
+            async with redis.pipeline(transaction=False) as pipe:
+                for task_id in task_ids:
+                    pipe.hgetall(REDIS_TASK_KEY.format(task_id))
+                records = await pipe.execute()
+        except Exception as e:
+            logger.warning(f"Failed to restore tasks from Redis: {e}")
+            return
+        
+        expired = []
+        for task_id, record in zip(task_ids, records):
+            if not record:
+                expired.append(task_id)
+                continue
+            meta = json_loads(record[b"meta"])
+            task = VideoTask(**meta)
+            if b"subtitles" in record:
+                task.subtitles_data = json_loads(zlib.decompress(record[b"subtitles"]))
+            self.tasks[task_id] = task
+        
+        if expired:
+            await redis.srem(REDIS_PENDING_KEY, *expired)
+        logger.info(f"Restored {len(task_ids) - len(expired)} tasks from Redis")
     
     async def check_task_status(self, task: VideoTask) -> dict:
         from services.kieai_service import kieai_service
@@ -86,8 +218,8 @@ class TaskTracker:
             result_json = data.get("resultJson", {})
             if isinstance(result_json, str):
                 try:
-                    result_json = json.loads(result_json)
-                except:
+                    result_json = json_loads(result_json)
+                except ValueError:
                     result_json = {}
             
             urls = result_json.get("resultUrls", [])
@@ -104,23 +236,35 @@ class TaskTracker:
         
         return "pending", None, None
     
+    def _next_wake_in(self) -> float:
+        """Сколько можно спать до ближайшей плановой проверки"""
+        if not self.tasks:
+            return POLL_MAX_DELAY
+        earliest = min(task.next_check_at for task in self.tasks.values())
+        return max(0.0, earliest - time.monotonic())
+    
     async def poll_tasks(self):
         while True:
             try:
-                await asyncio.sleep(30)
+                # Просыпаемся к ближайшей плановой проверке или раньше — по колбэку Kie.ai
+                await kie_callbacks.wait_any(self._next_wake_in())
                 
                 if not self.tasks or not self._bot:
                     continue
                 
                 tasks_to_check = list(self.tasks.values())
-                logger.info(f"Polling {len(tasks_to_check)} tasks...")
                 
                 for task in tasks_to_check:
                     timeout_minutes = 45 if task.model == "kling_motion" else 30
                     
-                    if datetime.now() - task.created_at > timedelta(minutes=timeout_minutes):
+                    if time.time() - task.created_at > timeout_minutes * 60:
                         await self._notify_timeout(task)
-                        self.remove_task(task.task_id)
+                        await self.remove_task(task.task_id)
+                        continue
+                    
+                    # Колбэк лишь сигнал: формат у моделей разный, статус читаем тем же запросом
+                    called_back = kie_callbacks.pop_signal(task.task_id)
+                    if not called_back and time.monotonic() < task.next_check_at:
                         continue
                     
                     response = await self.check_task_status(task)
@@ -130,10 +274,13 @@ class TaskTracker:
                     
                     if status == "completed" and video_url:
                         await self._notify_success(task, video_url)
-                        self.remove_task(task.task_id)
+                        await self.remove_task(task.task_id)
                     elif status == "failed" and error:
                         await self._notify_failure(task, error)
-                        self.remove_task(task.task_id)
+                        await self.remove_task(task.task_id)
+                    else:
+                        task.poll_delay = min(POLL_MAX_DELAY, task.poll_delay * 2)
+                        task.next_check_at = time.monotonic() + task.poll_delay * (1 + random.uniform(0, POLL_JITTER))
                     
                     await asyncio.sleep(3)
                     
@@ -149,13 +296,8 @@ class TaskTracker:
             if not await google_service.initialize():
                 return None
             
-            model_names = {
-                "sora2": "Sora2", "veo3": "Veo3", "veo3_fast": "Veo3_Fast",
-                "kling_motion": "Kling_Motion", "nano_banana": "NanoBanana"
-            }
-            
             timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-            file_name = f"{model_names.get(task.model, 'Video')}_{timestamp}.mp4"
+            file_name = f"{MODEL_FILE_NAMES.get(task.model, 'Video')}_{timestamp}.mp4"
             
             # Определяем папку в зависимости от типа контента
             if task.model == "kling_motion":
@@ -269,11 +411,6 @@ class TaskTracker:
         try:
             from aiogram.types import BufferedInputFile
             
-            model_names = {
-                "sora2": "Sora 2", "veo3": "Veo 3.1 Quality", "veo3_fast": "Veo 3.1 Fast",
-                "kling_motion": "Kling Motion Control", "nano_banana": "Nano Banana"
-            }
-            
             # Накладываем субтитры через FFmpeg если есть
             video_with_subs = None
             has_subtitles = task.subtitles_data and task.subtitles_data.get("ass")
@@ -316,7 +453,7 @@ class TaskTracker:
                     video=video_file,
                     caption=(
                         f"✅ <b>Видео с субтитрами готово!</b>\n\n"
-                        f"🎬 {model_names.get(task.model, task.model)}\n"
+                        f"🎬 {MODEL_DISPLAY_NAMES.get(task.model, task.model)}\n"
                         f"🆔 <code>{task.task_id}</code>{subtitle_info}{google_info}{avatar_info}"
                     ),
                     parse_mode="HTML"
@@ -328,7 +465,7 @@ class TaskTracker:
                         video=video_url,
                         caption=(
                             f"✅ <b>Видео готово!</b>\n\n"
-                            f"🎬 {model_names.get(task.model, task.model)}\n"
+                            f"🎬 {MODEL_DISPLAY_NAMES.get(task.model, task.model)}\n"
                             f"🆔 <code>{task.task_id}</code>{subtitle_info}{google_info}{avatar_info}"
                         ),
                         parse_mode="HTML"
@@ -338,7 +475,7 @@ class TaskTracker:
                         chat_id=task.chat_id,
                         text=(
                             f"✅ <b>Видео готово!</b>\n\n"
-                            f"🎬 {model_names.get(task.model, task.model)}\n"
+                            f"🎬 {MODEL_DISPLAY_NAMES.get(task.model, task.model)}\n"
                             f"🔗 <a href='{video_url}'>Скачать видео</a>\n"
                             f"🆔 <code>{task.task_id}</code>{subtitle_info}{google_info}{avatar_info}"
                         ),
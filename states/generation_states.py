@@ -22,6 +22,9 @@ class AvatarVideoStates(StatesGroup):
     selecting_edit_style = State()
     waiting_edit_description = State()
     
+    # Аватар генерируется в фоне — ждём доставки результата
+    generating_avatar = State()
+    
     # Загрузка готового фото
     waiting_avatar_image = State()
     
@@ -0,0 +1,6 @@
+from .chat_queue import chat_queues
+from .fsm import transition
+from .tasks import spawn
+from .telegram import fire_ack, safe_edit
+
+__all__ = ["chat_queues", "transition", "spawn", "fire_ack", "safe_edit"]
\ No newline at end of file
@@ -0,0 +1,40 @@
+import asyncio
+import logging
+from typing import Any, Awaitable, Callable
+
+from .tasks import spawn
+
+logger = logging.getLogger(__name__)
+
+class ChatQueues:
+    """
+    Фоновые работы, выполняемые по очереди в пределах одного чата
+    
+    У каждого чата свой воркер: долгая работа одного чата не задерживает другие,
+    а работы одного чата идут строго в порядке постановки. Воркер живёт, пока
+    в очереди есть работа.
+    """
+    
+    def __init__(self):
+        self._queues: dict[int, asyncio.Queue] = {}
+    
+    def enqueue(self, chat_id: int, job: Callable[[], Awaitable[Any]]):
+        """Ставит работу в очередь чата; job — фабрика корутины без аргументов"""
+        queue = self._queues.get(chat_id)
+        if queue is None:
+            queue = self._queues[chat_id] = asyncio.Queue()
+            spawn(self._worker(chat_id, queue), name=f"chat-worker-{chat_id}")
+        queue.put_nowait(job)
+    
+    async def _worker(self, chat_id: int, queue: asyncio.Queue):
+        try:
+            while not queue.empty():
+                job = queue.get_nowait()
+                try:
+                    await job()
+                except Exception as e:
+                    logger.error("Chat %s job failed: %s", chat_id, e, exc_info=True)
+        finally:
+            self._queues.pop(chat_id, None)
+
+chat_queues = ChatQueues()
\ No newline at end of file
@@ -0,0 +1,60 @@
+import asyncio
+import subprocess
+import time
+
+from config import config
+
+# Общий лимит процессов FFmpeg на весь бот: каждый занимает ядро целиком,
+# поэтому лишние ждут своей очереди, а не делят CPU с остальными
+ffmpeg_slots = asyncio.Semaphore(config.FFMPEG_CONCURRENCY)
+
+# Сколько держать результат проверки ffmpeg (найден / не найден), сек
+FFMPEG_CHECK_TTL = 3600
+FFMPEG_RECHECK_TTL = 30
+
+# (момент, до которого результат актуален, ffmpeg доступен)
+_ffmpeg_status: tuple[float, bool] = (0.0, False)
+
+def ffmpeg_available() -> bool:
+    """
+    Проверяет доступность FFmpeg
+    
+    Запуск процесса блокирует event loop, поэтому результат кэшируется:
+    найденный ffmpeg — на час, отсутствующий перепроверяется через 30 секунд.
+    """
+    global _ffmpeg_status
+    now = time.monotonic()
+    expires_at, available = _ffmpeg_status
+    if now < expires_at:
+        return available
+    
+    try:
+        subprocess.run(["ffmpeg", "-version"], capture_output=True, check=True)
+        available = True
+    except (subprocess.CalledProcessError, FileNotFoundError):
+        available = False
+    
+    _ffmpeg_status = (now + (FFMPEG_CHECK_TTL if available else FFMPEG_RECHECK_TTL), available)
+    return available
+
+async def communicate_or_kill(process: asyncio.subprocess.Process, timeout: float) -> tuple[bytes, bytes]:
+    """
+    communicate() с ограничением по времени
+    
+    Зависший FFmpeg не держит слот ffmpeg_slots вечно: по таймауту или отмене
+    ожидания процесс убивается. Таймаут пробрасывается как asyncio.TimeoutError.
+    """
+    try:
+        return await asyncio.wait_for(process.communicate(), timeout)
+    except asyncio.TimeoutError:
+        _kill(process)
+        await process.wait()
+        raise asyncio.TimeoutError(f"FFmpeg не завершился за {timeout} сек")
+    except BaseException:
+        _kill(process)
+        await process.wait()
+        raise
+
+def _kill(process: asyncio.subprocess.Process):
+    if process.returncode is None:
+        process.kill()
\ No newline at end of file
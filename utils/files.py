@@ -0,0 +1,27 @@
+import os
+import tempfile
+from typing import Union
+
+# Блокирующие операции с временными файлами: вызываются через asyncio.to_thread,
+# чтобы запись и чтение десятков мегабайт не останавливали event loop
+
+def write_temp_file(data: Union[bytes, str], suffix: str) -> str:
+    """Пишет данные во временный файл и возвращает его путь (строки — в UTF-8)"""
+    if isinstance(data, str):
+        data = data.encode("utf-8")
+    with tempfile.NamedTemporaryFile(suffix=suffix, delete=False) as tmp:
+        tmp.write(data)
+        return tmp.name
+
+def read_file(path: str) -> bytes:
+    """Читает файл целиком"""
+    with open(path, "rb") as f:
+        return f.read()
+
+def remove_files(*paths: str):
+    """Удаляет файлы, пропуская уже удалённые"""
+    for path in paths:
+        try:
+            os.unlink(path)
+        except OSError:
+            pass
\ No newline at end of file
@@ -0,0 +1,39 @@
+import asyncio
+from typing import Any, Optional, Union
+from aiogram.fsm.context import FSMContext
+from aiogram.fsm.state import State
+
+async def transition(
+    state: FSMContext,
+    new_state: Optional[Union[State, str]],
+    snapshot: Optional[dict] = None,
+    **data: Any
+) -> None:
+    """
+    Переводит FSM в новое состояние и дописывает данные
+    
+    Состояние и данные лежат в хранилище под разными ключами, поэтому обе записи
+    уходят одновременно, а не двумя последовательными round-trip'ами.
+    Redis-хранилище с пайплайном записывает их одной пачкой.
+    
+    snapshot — данные, уже прочитанные хендлером через get_data(): они дополняются
+    на месте и записываются целиком, без повторного чтения из хранилища.
+    """
+    if snapshot is not None:
+        snapshot.update(data)
+        pipelined = getattr(state.storage, "set_state_and_data", None)
+        if pipelined is not None:
+            await pipelined(state.key, new_state, snapshot)
+            return
+        await asyncio.gather(state.set_data(snapshot), state.set_state(new_state))
+        return
+    
+    pipelined = getattr(state.storage, "update_state_and_data", None)
+    if pipelined is not None:
+        await pipelined(state.key, new_state, data)
+        return
+    
+    await asyncio.gather(
+        state.update_data(**data),
+        state.set_state(new_state)
+    )
\ No newline at end of file
@@ -0,0 +1,6 @@
+import asyncio
+
+# Ограничение одновременных запросов к внешним API со всего бота: держится только
+# на время самого запроса, а не скачивания или FFmpeg вокруг него
+OPENAI_SEMAPHORE = asyncio.Semaphore(16)
+KIEAI_SEMAPHORE = asyncio.Semaphore(8)
\ No newline at end of file
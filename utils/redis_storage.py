@@ -0,0 +1,33 @@
+from typing import Any, Dict, Optional, cast
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import StateType, StorageKey
+from aiogram.fsm.storage.redis import RedisStorage
+
+class PipelinedRedisStorage(RedisStorage):
+    """RedisStorage, умеющий записывать состояние и данные одним пайплайном"""
+    
+    async def set_state_and_data(self, key: StorageKey, state: StateType, data: Dict[str, Any]):
+        """SET/DEL состояния и SET/DEL данных одним пайплайном — один round-trip"""
+        state_key = self.key_builder.build(key, "state")
+        data_key = self.key_builder.build(key, "data")
+        
+        async with self.redis.pipeline(transaction=False) as pipe:
+            if state is None:
+                pipe.delete(state_key)
+            else:
+                pipe.set(state_key, cast(str, state.state if isinstance(state, State) else state), ex=self.state_ttl)
+            if data:
+                pipe.set(data_key, self.json_dumps(data), ex=self.data_ttl)
+            else:
+                pipe.delete(data_key)
+            await pipe.execute()
+    
+    async def update_state_and_data(self, key: StorageKey, state: StateType, data: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        Read-modify-write данных плюс смена состояния за два round-trip'а:
+        GET данных, затем SET данных и SET/DEL состояния в одном пайплайне
+        """
+        current = await self.get_data(key)
+        current.update(data)
+        await self.set_state_and_data(key, state, current)
+        return current
\ No newline at end of file
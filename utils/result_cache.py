@@ -0,0 +1,72 @@
+import json
+import logging
+import time
+from typing import Any, Awaitable, Callable, Optional
+
+from config import config
+
+logger = logging.getLogger(__name__)
+
+# Сколько записей держать в памяти, если Redis не настроен
+LOCAL_CACHE_SIZE = 1024
+
+class ResultCache:
+    """
+    Кэш результатов дорогих вызовов (транскрибация и т.п.) по ключу
+    
+    Хранит JSON-значения в Redis с TTL, если задан REDIS_URL, иначе — в памяти
+    процесса. Ошибки Redis не ломают вызов: результат просто считается заново.
+    """
+    
+    def __init__(self, prefix: str = "result_cache"):
+        self.prefix = prefix
+        self._redis = None
+        # ключ -> (истекает, значение)
+        self._local: dict[str, tuple[float, Any]] = {}
+    
+    def _client(self):
+        if self._redis is None and config.REDIS_URL:
+            from redis.asyncio import Redis
+            self._redis = Redis.from_url(config.REDIS_URL)
+        return self._redis
+    
+    async def get(self, key: str) -> Optional[Any]:
+        redis = self._client()
+        if redis is None:
+            cached = self._local.get(key)
+            if cached and cached[0] > time.monotonic():
+                return cached[1]
+            return None
+        
+        try:
+            raw = await redis.get(f"{self.prefix}:{key}")
+        except Exception as e:
+            logger.warning(f"Result cache read failed: {e}")
+            return None
+        return json.loads(raw) if raw is not None else None
+    
+    async def set(self, key: str, value: Any, ttl: int):
+        redis = self._client()
+        if redis is None:
+            if len(self._local) >= LOCAL_CACHE_SIZE:
+                # Словарь упорядочен по вставке — выбрасываем самую старую запись
+                self._local.pop(next(iter(self._local)))
+            self._local[key] = (time.monotonic() + ttl, value)
+            return
+        
+        try:
+            await redis.set(f"{self.prefix}:{key}", json.dumps(value, ensure_ascii=False), ex=ttl)
+        except Exception as e:
+            logger.warning(f"Result cache write failed: {e}")
+    
+    async def get_or_compute(self, key: str, factory: Callable[[], Awaitable[Any]], ttl: int = 86400) -> Any:
+        """Возвращает закэшированное значение или вычисляет его через factory и сохраняет"""
+        cached = await self.get(key)
+        if cached is not None:
+            return cached
+        
+        value = await factory()
+        await self.set(key, value, ttl)
+        return value
+
+result_cache = ResultCache()
\ No newline at end of file
@@ -0,0 +1,28 @@
+import asyncio
+import logging
+from typing import Any, Coroutine, Optional
+
+logger = logging.getLogger(__name__)
+
+# Ссылки на фоновые задачи, чтобы их не собрал GC до завершения
+_background_tasks: set[asyncio.Task] = set()
+
+def _on_done(task: asyncio.Task):
+    _background_tasks.discard(task)
+    if task.cancelled():
+        return
+    exc = task.exception()
+    if exc is not None:
+        logger.error(f"Background task {task.get_name()} failed: {exc}")
+
+def spawn(coro: Coroutine[Any, Any, Any], name: Optional[str] = None) -> asyncio.Task:
+    """
+    Запускает корутину в фоне, не дожидаясь её завершения
+    
+    Задача удерживается до конца работы, а её исключение попадает в лог,
+    а не в "Task exception was never retrieved".
+    """
+    task = asyncio.create_task(coro, name=name)
+    _background_tasks.add(task)
+    task.add_done_callback(_on_done)
+    return task
\ No newline at end of file
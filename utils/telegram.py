@@ -0,0 +1,48 @@
+from typing import Any, Optional
+from aiogram.exceptions import TelegramBadRequest
+from aiogram.types import CallbackQuery, Message, InlineKeyboardMarkup
+
+from .tasks import spawn
+
+async def safe_edit(
+    message: Message,
+    text: str,
+    reply_markup: Optional[InlineKeyboardMarkup] = None,
+    **kwargs: Any
+) -> bool:
+    """
+    edit_text без лишнего запроса, если сообщение уже выглядит так же
+    
+    Текущий текст и клавиатура приходят вместе с апдейтом, поэтому сравнение ничего не стоит.
+    Повторный тап по "Назад" больше не даёт запрос в Telegram и ошибку "message is not modified".
+    
+    Returns:
+        True если сообщение было изменено
+    """
+    if message.html_text == text and message.reply_markup == reply_markup:
+        return False
+    
+    try:
+        await message.edit_text(text, reply_markup=reply_markup, **kwargs)
+    except TelegramBadRequest as e:
+        if "message is not modified" not in str(e):
+            raise
+        return False
+    return True
+
+async def _answer_quietly(callback: CallbackQuery, **kwargs: Any):
+    try:
+        await callback.answer(**kwargs)
+    except TelegramBadRequest as e:
+        # Запрос уже отвечен или старше ~15 секунд — подтверждать больше нечего
+        if "query is too old" not in str(e) and "query ID is invalid" not in str(e):
+            raise
+
+def fire_ack(callback: CallbackQuery, **kwargs: Any):
+    """
+    Подтверждает нажатие кнопки в фоне
+    
+    Хендлер не ждёт ответа Telegram на answerCallbackQuery, а устаревший запрос
+    не превращается в ошибку в логе.
+    """
+    spawn(_answer_quietly(callback, **kwargs), name=f"ack-{callback.id}")
\ No newline at end of file